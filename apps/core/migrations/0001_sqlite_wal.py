@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def set_journal_mode(mode):
+    def apply(apps, schema_editor):
+        # Режим журнала хранится в самом файле БД: переключаем один раз, при migrate
+        if schema_editor.connection.vendor != 'sqlite': return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode={mode}")
+    return apply
+
+
+class Migration(migrations.Migration):
+    """
+    WAL: читатели не ждут писателя (и наоборот), коммит - это дописать в -wal.
+    synchronous оставляем по умолчанию (FULL): подтвержденная запись переживает и падение ОС.
+    """
+
+    # Внутри транзакции SQLite не переходит в WAL
+    atomic = False
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(set_journal_mode('WAL'), set_journal_mode('DELETE')),
+    ]
@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .models import PlayerProfile
 from .forms import CharacterForm
-from apps.labs.models import LabScenario, UserLabSession
+from apps.labs.models import LabScenario, PlayerProgress
 
 @login_required
 def create_character(request):
@@ -33,21 +34,17 @@ def intro(request):
 def office(request):
     profile = request.user.profile
     
-    # 1. Ищем АКТИВНОЕ задание (принятое, но не выполненное)
-    active_session = UserLabSession.objects.filter(
-        user=request.user, 
-        is_completed=False
-    ).first() # Берем первое активное
-    
-    # 2. Ищем ВХОДЯЩИЕ задания (доступные по уровню, не выполненные и не активные сейчас)
-    # Получаем ID всех начатых или завершенных лаб
-    excluded_ids = UserLabSession.objects.filter(user=request.user).values_list('lab_id', flat=True)
+    # 1. АКТИВНОЕ задание (принятое, но не выполненное) - уже посчитано в прогрессе игрока
+    progress = PlayerProgress.for_user(request.user)
+    active_session = progress.active_session
     
+    # 2. ВХОДЯЩИЕ задания (доступные по уровню, не начатые): один запрос по индексу (min_level, id),
+    # id начатых лаб берем из прогресса, а не подзапросом по всем сессиям
     inbox_labs = LabScenario.objects.filter(
         min_level__lte=profile.level
     ).exclude(
-        id__in=excluded_ids
-    )
+        id__in=progress.started
+    ).order_by('id')[:settings.LAB_INBOX_LIMIT]
     
     return render(request, 'game/office.html', {
         'profile': profile,
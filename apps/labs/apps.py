@@ -1,4 +1,14 @@
 from django.apps import AppConfig
 class LabsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.labs'
\ No newline at end of file
+    name = 'apps.labs'
+
+    def ready(self):
+        # Сохранение/удаление лабы сбрасывает ее разобранную копию в кэше процесса
+        from django.db.models.signals import post_delete, post_save
+        from .lab_cache import on_lab_changed
+        from .models import LabScenario, UserLabSession, on_session_deleted
+        post_save.connect(on_lab_changed, sender=LabScenario, dispatch_uid="labs_cache_save")
+        post_delete.connect(on_lab_changed, sender=LabScenario, dispatch_uid="labs_cache_delete")
+        # Прогресс игрока (офис, список лаб) держим в актуальном состоянии
+        post_delete.connect(on_session_deleted, sender=UserLabSession, dispatch_uid="labs_progress_delete")
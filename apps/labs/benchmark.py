@@ -0,0 +1,329 @@
+"""
+Бенчмарк движка лабы: сценарии студентов прогоняются через IOSCommandProcessor,
+время раскладывается по фазам (load, normalize, dispatch, render, grade, persist).
+
+MemorySession повторяет интерфейс UserLabSession, которым пользуется процессор,
+но ничего не пишет в БД - так стоимость движка видна отдельно от стоимости БД.
+Запуск: python manage.py bench_engine (см. management/commands/bench_engine.py).
+"""
+import itertools
+import random
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+from .engine.processor import IOSCommandProcessor
+
+PHASES = ("load", "normalize", "dispatch", "render", "grade", "persist")
+
+# pk стенд-инов отрицательные, чтобы кэши процесса (grading/network/render)
+# не пересекались с настоящими сессиями
+_memory_ids = itertools.count(-1, -1)
+
+
+# --- СЕССИЯ В ПАМЯТИ ---
+
+class MemorySession:
+    """Стенд-ин UserLabSession без БД (тот же набор методов, что зовет процессор)"""
+
+    def __init__(self, lab_id, device="R1", console_limit=5000):
+        self.pk = self.id = next(_memory_ids)
+        self.lab_id = lab_id
+        self.current_device = device
+        self.virtual_config = {}
+        self.is_completed = False
+        self.user_id = None
+        self.console = deque(maxlen=console_limit)
+        self._version = 0
+
+    def load_state(self):
+        return self.virtual_config
+
+    def load_devices(self, devices=None):
+        return self.virtual_config
+
+    def state_token(self):
+        return self._version
+
+    def record_mutation(self, device, values=None, config_paths=None):
+        if values or config_paths: self._version += 1
+
+    def append_console(self, device, logs):
+        self.console.extend(logs)
+
+    def defer_writes(self):
+        pass
+
+    def flush_writes(self):
+        pass
+
+    def mark_completed(self):
+        self.is_completed = True
+
+    def award_completion(self, money, xp):
+        return None   # журнал наград в БД в бенчмарке не трогаем
+
+    def push_undo(self, device, blob):
+        pass
+
+    def save(self, *args, **kwargs):
+        pass
+
+
+# --- ТАЙМЕР ФАЗ ---
+
+class PhaseTimer:
+    """
+    Эксклюзивное время фаз: вложенная фаза вычитается из внешней
+    (render внутри dispatch считается только как render).
+    """
+
+    def __init__(self):
+        self.current = None
+        self._stack = []
+
+    def start(self):
+        self.current = dict.fromkeys(PHASES, 0)
+
+    @contextmanager
+    def phase(self, name):
+        if self.current is None:
+            yield
+            return
+        self._stack.append([name, time.perf_counter_ns(), 0])
+        try:
+            yield
+        finally:
+            name, started, nested = self._stack.pop()
+            elapsed = time.perf_counter_ns() - started
+            self.current[name] += elapsed - nested
+            if self._stack: self._stack[-1][2] += elapsed
+
+    def finish(self):
+        sample, self.current = self.current, None
+        return sample
+
+
+class TimedProcessor(IOSCommandProcessor):
+    """Процессор с замерами; обработчики команд те же (таблица COMMANDS общая)"""
+    timer = None
+
+    def _execute(self, raw_command):
+        with self.timer.phase("dispatch"):
+            return super()._execute(raw_command)
+
+    def _normalize_tokens(self, raw_command):
+        with self.timer.phase("normalize"):
+            return super()._normalize_tokens(raw_command)
+
+    def _render_cached(self, key, render, subtrees=()):
+        with self.timer.phase("render"):
+            return super()._render_cached(key, render, subtrees)
+
+    def check_completion(self):
+        with self.timer.phase("grade"):
+            return super().check_completion()
+
+
+def instrument_session(session, timer):
+    """Запись в журнал и консоль -> фаза persist (работает и для модели, и для стенд-ина)"""
+    for name in ("record_mutation", "append_console", "flush_writes"):
+        method = getattr(session, name)
+
+        def timed(*args, _method=method, **kwargs):
+            with timer.phase("persist"):
+                return _method(*args, **kwargs)
+        setattr(session, name, timed)
+    return session
+
+
+# --- СЦЕНАРИИ ---
+# Сценарий - генератор шагов: ("cmd", устройство, строка) или ("paste", устройство, [строки])
+
+ABBREVIATIONS = [
+    "en", "conf t", "int fa0/0", "ip add 192.168.1.1 255.255.255.0", "no sh", "desc uplink",
+    "exit", "ho R1", "do sh ip int br", "end", "sh run", "sh int d", "wr",
+]
+
+HELP = ["?", "sh ?", "sh int ?", "conf ?", "conf t", "?", "int ?", "line ?", "int fa0/0", "ip ?", "end"]
+
+CONTEXTS = [
+    "conf t", "int fa0/0", "exit", "line con 0", "password cisco", "login", "exit",
+    "int fa0/1", "shut", "no shut", "end", "conf t", "crypto isakmp policy 10",
+    "encryption aes", "group 2", "exit", "end",
+]
+
+
+def running_config(size):
+    lines = ["conf t", "hostname CORE"]
+    for i in range(size):
+        lines += [f"int fa0/{i % 2}", f"description link-{i}", f"ip address 10.{i // 250}.{i % 250}.1 255.255.255.0",
+                  "no shutdown", "exit", f"ip route 172.{16 + i % 16}.{i % 250}.0 255.255.255.0 10.{i // 250}.{i % 250}.2"]
+    return lines + ["end"]
+
+
+def scenario_abbreviations(rng, count):
+    for i in range(count):
+        yield "cmd", "R1", ABBREVIATIONS[i % len(ABBREVIATIONS)]
+
+
+def scenario_help(rng, count):
+    for i in range(count):
+        yield "cmd", "R1", HELP[i % len(HELP)]
+
+
+def scenario_contexts(rng, count):
+    for i in range(count):
+        yield "cmd", "R1", CONTEXTS[i % len(CONTEXTS)]
+
+
+def scenario_paste(rng, count, size=100):
+    for _ in range(max(1, count // size)):
+        yield "paste", "R1", running_config(size // 6 + 1)
+        yield "cmd", "R1", "sh run"
+
+
+def scenario_devices(rng, count, devices=20):
+    names = [f"R{i}" for i in range(1, devices + 1)]
+    for _ in range(count):
+        yield "cmd", rng.choice(names), rng.choice(ABBREVIATIONS + CONTEXTS)
+
+
+def scenario_history(rng, count):
+    # Длинная история: много строк в консоли, команды повторяются
+    for i in range(count):
+        yield "cmd", "R1", rng.choice(ABBREVIATIONS + ["sh run", "sh ip route", "ping 192.168.1.1"])
+
+
+SCENARIOS = {
+    "abbreviations": scenario_abbreviations,
+    "help": scenario_help,
+    "contexts": scenario_contexts,
+    "paste": scenario_paste,
+    "devices": scenario_devices,
+    "history": scenario_history,
+}
+
+
+def transcript_scenario(path):
+    """
+    Записанный транскрипт: одна команда на строку.
+    "#device R2" переключает устройство, блок между "#paste" и "#end" уходит одной вставкой.
+    """
+    with open(path, encoding="utf-8") as fh:
+        raw_lines = fh.read().splitlines()
+
+    def scenario(rng, count):
+        device, paste = "R1", None
+        for line in raw_lines:
+            if line.startswith("#device "):
+                device = line.split(None, 1)[1].strip()
+            elif line.strip() == "#paste":
+                paste = []
+            elif line.strip() == "#end" and paste is not None:
+                yield "paste", device, paste
+                paste = None
+            elif paste is not None:
+                paste.append(line)
+            else:
+                yield "cmd", device, line
+    return scenario
+
+
+# --- МИКРОБЕНЧМАРК РАЗБОРА КОМАНД ---
+# Без фаз и перцентилей: среднее на команду по 12 смешанным командам (bench_engine --micro)
+
+MICRO_COMMANDS = ABBREVIATIONS[:12]
+
+
+def micro_grammar(lab_id, iterations=3000):
+    """Среднее время (мкс) создания процессора, normalize_command и создания + process_input"""
+    session = MemorySession(lab_id)
+    processor = IOSCommandProcessor(session)
+
+    def mean_us(func):
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            for command in MICRO_COMMANDS:
+                func(command)
+        return round((time.perf_counter_ns() - started) / 1000 / (iterations * len(MICRO_COMMANDS)), 2)
+
+    return {
+        "construct": mean_us(lambda command: IOSCommandProcessor(session)),
+        "normalize": mean_us(processor.normalize_command),
+        "construct_process": mean_us(lambda command: IOSCommandProcessor(session).process_input(command)),
+    }
+
+
+# --- ПРОГОН ---
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values_ns):
+    values = sorted(v / 1000 for v in values_ns)   # мкс
+    return {
+        "count": len(values),
+        "mean_us": round(sum(values) / len(values), 2) if values else 0,
+        "p50_us": round(percentile(values, 50), 2),
+        "p95_us": round(percentile(values, 95), 2),
+        "p99_us": round(percentile(values, 99), 2),
+    }
+
+
+def run_scenario(scenario, lab_id, count, seed=0, session_factory=None, track_allocations=False):
+    """
+    Прогоняет сценарий. session_factory(device) -> сессия на каждую команду
+    (как вьюха: загрузка на запрос); по умолчанию - одна MemorySession.
+    """
+    rng = random.Random(seed)
+    timer = PhaseTimer()
+    TimedProcessor.timer = timer
+    memory = instrument_session(MemorySession(lab_id), timer)
+
+    samples, allocations = [], []
+    if track_allocations: tracemalloc.start()
+    try:
+        for kind, device, payload in scenario(rng, count):
+            if track_allocations: tracemalloc.reset_peak()
+            timer.start()
+            started = time.perf_counter_ns()
+
+            with timer.phase("load"):
+                if session_factory is not None:
+                    session = instrument_session(session_factory(device), timer)
+                else:
+                    session = memory
+                    session.current_device = device
+                processor = TimedProcessor(session)
+
+            if kind == "paste":
+                session.defer_writes()
+                processor.process_batch(payload)
+                session.flush_writes()
+            else:
+                processor.process_input(payload)
+
+            sample = timer.finish()
+            sample["total"] = time.perf_counter_ns() - started
+            samples.append(sample)
+            if track_allocations: allocations.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        if track_allocations: tracemalloc.stop()
+        TimedProcessor.timer = None
+
+    result = {"commands": len(samples)}
+    for name in PHASES + ("total",):
+        result[name] = summarize([s[name] for s in samples])
+    if allocations:
+        allocations.sort()
+        result["peak_alloc_bytes"] = {
+            "p50": percentile(allocations, 50),
+            "p95": percentile(allocations, 95),
+            "max": allocations[-1],
+        }
+    return result
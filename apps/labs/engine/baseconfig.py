@@ -0,0 +1,101 @@
+"""
+Базовая конфигурация устройств лабы и оверлеи сессий.
+
+Свежее устройство у всех студентов одинаковое: hostname, services, lines (плюс то,
+что автор лабы положил в topology_data -> nodes[].base_config). Эта база живет
+в LabDefinition (одна на процесс, не меняется), а в сессии хранится только оверлей -
+то, что студент изменил:
+
+    в БД (снимок и журнал)   {"R1": {"context": ..., "rev": ..., "config": {"hostname": "HQ"}}}
+    в памяти (после load)    {"R1": {"context": ..., "rev": ..., "config": база + оверлей}}
+
+None в оверлее - ключ базы удален студентом (no ip route ... для маршрута из базы).
+Движок работает с уже собранным конфигом, при сворачивании журнала в снимок
+(UserLabSession.save) конфиг снова превращается в оверлей.
+"""
+import copy
+
+# Что видно на свежем устройстве, по типу узла топологии
+DEFAULT_BASE = {
+    "router": {
+        "services": {
+            "password-encryption": False,
+            "timestamps_log": True,
+            "timestamps_debug": True,
+        },
+        "lines": {
+            "con 0": {"login": False, "logging_sync": False},
+            "vty 0 4": {"login": False},   # В лабе дефолт no login для удобства
+            "vty 5 15": {"login": False},
+        },
+    },
+}
+
+
+def build_base(device, node_type, seeded=None):
+    """База устройства: дефолт типа + то, что задал автор лабы"""
+    base = {"hostname": device}
+    base.update(copy.deepcopy(DEFAULT_BASE.get(node_type, DEFAULT_BASE["router"])))
+    if isinstance(seeded, dict): base = merge(base, seeded)
+    return base
+
+
+def merge(base, overlay):
+    """Новый словарь: base, поверх него overlay. base не меняется и не разделяется с результатом"""
+    result = {}
+    for key, value in base.items():
+        if key not in overlay: result[key] = copy.deepcopy(value)
+    for key, value in overlay.items():
+        if value is None: continue
+        if isinstance(value, dict):
+            # Порядок ключей базы сохраняем (от него зависит порядок в show running-config),
+            # надгробия None вычищаем и там, где базы нет
+            result[key] = merge(base[key] if isinstance(base.get(key), dict) else {}, value)
+        else:
+            result[key] = value
+    return {key: result[key] for key in list(base) + list(overlay) if key in result}
+
+
+def diff(config, base):
+    """Оверлей: чем config отличается от base (удаленные ключи base -> None)"""
+    overlay = {}
+    for key, value in config.items():
+        if key not in base:
+            overlay[key] = value
+        elif isinstance(value, dict) and isinstance(base[key], dict):
+            changed = diff(value, base[key])
+            if changed: overlay[key] = changed
+        elif value != base[key]:
+            overlay[key] = value
+    for key in base:
+        if key not in config: overlay[key] = None
+    return overlay
+
+
+def resolve_device(base, stored):
+    """Устройство из снимка/журнала -> рабочее состояние для движка"""
+    device = dict(stored)
+    device["config"] = merge(base, stored.get("config") or {})
+    device.setdefault("context", "privileged")
+    return device
+
+
+def overlay_device(base, device):
+    """Обратно: рабочее состояние -> то, что пишем в снимок"""
+    stored = {key: value for key, value in device.items() if key != "config"}
+    config = diff(device.get("config", {}), base)
+    if config: stored["config"] = config
+    return stored
+
+
+def init_device(session, lab, device):
+    """
+    Первое обращение к устройству: база лабы, в журнал уходят только контекст и ревизия.
+    Возвращает состояние устройства.
+    """
+    from .render import new_revision
+
+    stored = {"context": "privileged", "rev": new_revision()}
+    session.virtual_config[device] = resolve_device(lab.base_config(device), stored)
+    session.record_mutation(device, values=stored)
+    return session.virtual_config[device]
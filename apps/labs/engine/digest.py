@@ -0,0 +1,103 @@
+"""
+Хэши конфига устройства по содержимому (Merkle): хэш каждого поддерева верхнего
+уровня (hostname, interfaces, lines, routes, ...) и корень из них.
+
+По ним render-кэш (render.RENDERED) находит вывод show у любого студента с таким же
+конфигом, а не только у этой же сессии. Хэши держатся на (сессия, устройство) для
+текущей ревизии; команда, изменившая конфиг, пересчитывает только тронутые поддеревья.
+"""
+import hashlib
+import marshal
+import threading
+from collections import OrderedDict
+
+# Сколько устройств (сессия, устройство) держим в процессе
+MAX_DIGESTS = 8192
+
+
+def subtree_hash(value):
+    """
+    Хэш поддерева. Порядок ключей важен (маршруты в show run идут в порядке добавления),
+    поэтому не канонический JSON, а marshal: в 4 раза быстрее, а хэши живут только
+    в памяти процесса. Версия 2 - без ссылок, одинаковое содержимое дает одинаковые байты.
+    """
+    return hashlib.blake2b(marshal.dumps(value, 2), digest_size=16).digest()
+
+
+class ConfigDigest:
+    """Хэши поддеревьев config одной ревизии устройства"""
+    __slots__ = ("rev", "subtrees", "stale", "_root")
+
+    def __init__(self, rev, subtrees):
+        self.rev = rev
+        self.subtrees = subtrees
+        # Поддеревья, измененные после подсчета: пересчитаются при следующем чтении
+        self.stale = set()
+        self._root = None
+
+    @classmethod
+    def of(cls, rev, config):
+        return cls(rev, {key: subtree_hash(value) for key, value in config.items()})
+
+    def advance(self, rev, touched_paths):
+        """Следующая ревизия: тронутые поддеревья только помечаются (вставка из сотни строк - один пересчет)"""
+        self.rev = rev
+        self.stale.update(path[0] for path in touched_paths)
+        self._root = None
+
+    def refresh(self, config):
+        for key in self.stale:
+            if key in config: self.subtrees[key] = subtree_hash(config[key])
+            else: self.subtrees.pop(key, None)
+        self.stale.clear()
+
+    @property
+    def root(self):
+        if self._root is None:
+            root = hashlib.blake2b(digest_size=16)
+            for key in sorted(self.subtrees):
+                root.update(key.encode())
+                root.update(self.subtrees[key])
+            self._root = root.digest()
+        return self._root
+
+    def part(self, keys):
+        """Ключ по набору поддеревьев (отсутствующее поддерево - None)"""
+        return tuple(self.subtrees.get(key) for key in keys)
+
+
+# (session.pk, устройство) -> ConfigDigest последней увиденной ревизии.
+# Общий для потоков запросов - только под _lock (сам ConfigDigest трогает один запрос сессии)
+_digests = OrderedDict()
+_lock = threading.Lock()
+
+
+def _remember(key, digest):
+    with _lock:
+        _digests[key] = digest
+        _digests.move_to_end(key)
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+
+
+def device_digest(session, device, config, rev):
+    """Хэши текущей ревизии (целиком считаются, только если ревизию видим впервые)"""
+    key = (session.pk, device)
+    with _lock: digest = _digests.get(key)
+    if digest is None or digest.rev != rev:
+        digest = ConfigDigest.of(rev, config)
+    elif digest.stale:
+        digest.refresh(config)
+    _remember(key, digest)
+    return digest
+
+
+def advance_digest(session, device, rev_before, rev, touched_paths):
+    """Команда перевела конфиг rev_before -> rev: переносим хэши, если они были посчитаны"""
+    key = (session.pk, device)
+    with _lock: digest = _digests.get(key)
+    if digest is None or digest.rev != rev_before: return
+    # Тронут весь config (новое устройство) - проще посчитать заново при следующем show
+    if () in touched_paths:
+        with _lock: _digests.pop(key, None)
+    else: digest.advance(rev, touched_paths)
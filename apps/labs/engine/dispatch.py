@@ -0,0 +1,246 @@
+from types import MappingProxyType
+
+# --- ТИПЫ АРГУМЕНТОВ ---
+# Каждый конвертер возвращает значение или None, если токен не подходит.
+
+def _parse_ip(token):
+    parts = token.split(".")
+    if len(parts) != 4: return None
+    for p in parts:
+        if not p.isdigit() or int(p) > 255: return None
+    return token
+
+
+def _parse_mask(token):
+    if _parse_ip(token) is None: return None
+    bits = "".join(f"{int(p):08b}" for p in token.split("."))
+    # Маска - это единицы, за которыми идут только нули
+    if "01" in bits: return None
+    return token
+
+
+def _parse_int(token):
+    return int(token) if token.isdigit() else None
+
+
+def expand_interface_name(short_name):
+    """
+    Превращает f0/0, fa0/0, fast0/0 в FastEthernet0/0.
+    Если не распознано, возвращает оригинал.
+    """
+    s = short_name.lower()
+    # FastEthernet
+    if s.startswith("f") and "ethernet" not in s:
+        # fa0/0 -> 0/0, f0/1 -> 0/1, fast0/0 -> 0/0
+        parts = s.replace("fast", "").replace("fa", "").replace("f", "")
+        return "FastEthernet" + parts
+
+    # GigabitEthernet (на будущее)
+    if s.startswith("g") and "ethernet" not in s:
+        parts = s.replace("gig", "").replace("gi", "").replace("g", "")
+        return "GigabitEthernet" + parts
+
+    # Полное имя в нижнем регистре (после normalize) -> каноничный регистр
+    if s.startswith("fastethernet"): return "FastEthernet" + s[len("fastethernet"):]
+    if s.startswith("gigabitethernet"): return "GigabitEthernet" + s[len("gigabitethernet"):]
+    return short_name
+
+
+ARG_TYPES = MappingProxyType({
+    "ip": _parse_ip,
+    "mask": _parse_mask,
+    "int": _parse_int,
+    "iface": expand_interface_name,
+    "word": lambda token: token,
+})
+
+# "line" - особый тип: забирает весь остаток строки (description, access-list ...)
+REST_TYPE = "line"
+
+MSG_INVALID = "% Invalid input detected."
+MSG_INVALID_ARG = "% Invalid input detected at '^' marker."
+MSG_INCOMPLETE = "% Incomplete command."
+
+
+class CommandSpec:
+    """Описание одной команды: контекст, литералы шаблона и типизированные аргументы"""
+    __slots__ = ("context", "literals", "args", "handler", "negatable", "guarded")
+
+    def __init__(self, context, pattern, handler, negatable=False, guarded=True):
+        self.context = context
+        self.handler = handler
+        self.negatable = negatable
+        self.guarded = guarded
+
+        literals, args = [], []
+        for part in pattern.split():
+            if part.startswith("<"):
+                name = part.strip("<>")
+                optional = name.endswith("?")
+                name = name.rstrip("?")
+                if name != REST_TYPE and name not in ARG_TYPES:
+                    raise ValueError(f"Unknown argument type <{name}> in '{pattern}'")
+                args.append((name, optional))
+            else:
+                if args:
+                    raise ValueError(f"Literal after argument in '{pattern}'")
+                literals.append(part)
+        self.literals = tuple(literals)
+        self.args = tuple(args)
+
+    def bind(self, tokens):
+        """
+        Разбирает аргументы. Возвращает (значения, None) или (None, сообщение об ошибке).
+        """
+        values = []
+        i = 0
+        for name, optional in self.args:
+            if i >= len(tokens):
+                if optional:
+                    values.append(None)
+                    continue
+                return None, MSG_INCOMPLETE
+            if name == REST_TYPE:
+                values.append(" ".join(tokens[i:]))
+                i = len(tokens)
+                continue
+            value = ARG_TYPES[name](tokens[i])
+            if value is None: return None, MSG_INVALID_ARG
+            values.append(value)
+            i += 1
+        if i < len(tokens): return None, MSG_INVALID_ARG
+        return values, None
+
+
+def command(context, pattern, negatable=False, guarded=True):
+    """
+    Регистрирует метод процессора как обработчик команды.
+    Декоратор можно вешать несколько раз (одна команда в нескольких контекстах).
+
+        @command("interface_config", "ip address <ip> <mask>")
+        def _cmd_ip_address(self, ip, mask): ...
+
+    negatable=True - команда принимает форму "no ...", в обработчик придет no=True.
+    guarded=False  - не вызывать context_guard контекста (например, смена интерфейса).
+    """
+    def decorator(func):
+        specs = getattr(func, "_command_specs", [])
+        specs.append((context, pattern, negatable, guarded))
+        func._command_specs = specs
+        return func
+    return decorator
+
+
+def context_guard(context):
+    """
+    Метод, который вызывается перед любой командой контекста.
+    Возвращает текст ошибки (команда не выполняется) или None.
+    """
+    def decorator(func):
+        func._guard_context = context
+        return func
+    return decorator
+
+
+class _Node:
+    __slots__ = ("children", "specs")
+
+    def __init__(self):
+        self.children = {}
+        self.specs = []
+
+
+class CommandTable:
+    """
+    Таблица команд: для каждого контекста - дерево литералов шаблонов.
+    Команда токенизируется один раз, литералы ищутся по словарю,
+    поэтому стоимость разбора зависит от длины команды, а не от числа команд.
+    """
+
+    def __init__(self):
+        self._roots = {}      # (context, negated) -> _Node
+        self._guards = {}     # context -> функция-guard
+
+    @classmethod
+    def from_class(cls, klass):
+        table = cls()
+        for attr in dir(klass):
+            func = getattr(klass, attr)
+            for context, pattern, negatable, guarded in getattr(func, "_command_specs", ()):
+                table.add(CommandSpec(context, pattern, func, negatable, guarded))
+            guard_context = getattr(func, "_guard_context", None)
+            if guard_context: table._guards[guard_context] = func
+        return table
+
+    def add(self, spec):
+        variants = [False, True] if spec.negatable else [False]
+        for negated in variants:
+            node = self._roots.setdefault((spec.context, negated), _Node())
+            for literal in spec.literals:
+                node = node.children.setdefault(literal, _Node())
+            node.specs.append(spec)
+
+    def contexts(self):
+        return {context for context, _ in self._roots}
+
+    def _match(self, context, tokens):
+        """
+        Спуск по литералам. Возвращает (negated, tokens без "no", самый глубокий узел
+        с командами, сколько токенов он съел, где остановились, корень) или None.
+        """
+        negated = bool(tokens) and tokens[0] == "no"
+        root = self._roots.get((context, negated)) if negated else None
+        if root is None:
+            negated = False
+            root = self._roots.get((context, False))
+            if root is None: return None
+        else:
+            tokens = tokens[1:]
+
+        # Спускаемся по литералам, запоминая самый глубокий узел с командами
+        node, best, consumed = root, None, 0
+        for i, token in enumerate(tokens):
+            node = node.children.get(token)
+            if node is None: break
+            if node.specs: best, consumed = node, i + 1
+        return negated, tokens, best, consumed, node, root
+
+    def family(self, context, tokens):
+        """
+        Семейство команды для метрик: литералы шаблона ("show ip route", "no shutdown").
+        Набор конечный (только зарегистрированные шаблоны), поэтому годится в метку.
+        """
+        match = self._match(context, tokens)
+        if match is None: return "unknown"
+        negated, _, best, _, _, _ = match
+        if best is None: return "invalid"
+        literals = " ".join(best.specs[0].literals)
+        return f"no {literals}" if negated else literals
+
+    def dispatch(self, target, context, tokens):
+        """
+        Находит и вызывает обработчик. target - экземпляр процессора.
+        Возвращает текст ответа или None, если контекст не обслуживается таблицей.
+        """
+        match = self._match(context, tokens)
+        if match is None: return None
+        negated, tokens, best, consumed, node, root = match
+        if best is None:
+            # Все слова - литералы, но команда не дописана ("crypto isakmp")
+            if node is not None and node is not root: return MSG_INCOMPLETE
+            return MSG_INVALID
+
+        error = MSG_INVALID
+        for spec in best.specs:
+            values, error = spec.bind(tokens[consumed:])
+            if values is None: continue
+
+            guard = self._guards.get(context)
+            if spec.guarded and guard:
+                guard_error = guard(target)
+                if guard_error is not None: return guard_error
+
+            if spec.negatable:
+                return spec.handler(target, *values, no=negated)
+            return spec.handler(target, *values)
+        return error
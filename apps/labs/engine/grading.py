@@ -0,0 +1,183 @@
+import threading
+from collections import OrderedDict
+
+from .digest import device_digest
+
+
+def _normalize(value):
+    """Так же, как сравнивали раньше: пустое/None -> "", иначе str().strip().lower()"""
+    return str(value).strip().lower() if value else ""
+
+
+class CompiledCheck:
+    """Одна проверка: значение по пути в config устройства"""
+    __slots__ = ("device", "path", "expected")
+
+    def __init__(self, device, path, expected):
+        self.device = device
+        self.path = tuple(path)
+        self.expected = expected
+
+    def passes(self, virtual_config):
+        current = virtual_config.get(self.device, {}).get("config", {})
+        for key in self.path:
+            if not isinstance(current, dict):
+                current = None
+                break
+            current = current.get(key)
+            if current is None: break
+        return _normalize(current) == self.expected
+
+
+class CriteriaEvaluator:
+    """
+    LabScenario.success_criteria, скомпилированные один раз на версию лабы.
+    Ожидаемые значения нормализованы заранее, а для каждого устройства
+    построен индекс "путь конфига -> зависящие от него проверки".
+    """
+
+    def __init__(self, criteria):
+        self.checks = []
+        if isinstance(criteria, dict):
+            for dev_id, requirements in criteria.items():
+                if not isinstance(requirements, dict): continue
+                # 1. Hostname
+                if requirements.get("hostname"):
+                    self.checks.append(CompiledCheck(dev_id, ["hostname"], _normalize(requirements["hostname"])))
+                # 2. Config Checks
+                for check in requirements.get("config_checks", []):
+                    expected = str(check.get("value", "")).strip().lower()
+                    self.checks.append(CompiledCheck(dev_id, check.get("path", []), expected))
+
+        # (device, префикс пути) -> проверки, чей путь начинается с этого префикса
+        self._by_prefix = {}
+        # (device, полный путь) -> проверки ровно с этим путем
+        self._by_path = {}
+        for index, check in enumerate(self.checks):
+            for i in range(len(check.path) + 1):
+                self._by_prefix.setdefault((check.device, check.path[:i]), []).append(index)
+            self._by_path.setdefault((check.device, check.path), []).append(index)
+        # Устройства, которые нужны полной проверке (остальные можно не загружать)
+        self.devices = sorted({check.device for check in self.checks})
+        # Устройство -> его проверки и поддеревья config, которые они читают
+        self._device_checks = {}
+        subtrees = {}
+        for index, check in enumerate(self.checks):
+            self._device_checks.setdefault(check.device, []).append(index)
+            subtrees.setdefault(check.device, set()).add(check.path[0] if check.path else None)
+        # Проверка с пустым путем читает весь config (None)
+        self._subtrees = {device: None if None in keys else tuple(sorted(keys, key=str))
+                          for device, keys in subtrees.items()}
+
+    def __bool__(self):
+        return bool(self.checks)
+
+    def failing(self, virtual_config):
+        """Полная проверка: множество индексов непройденных проверок"""
+        return frozenset(i for i, check in enumerate(self.checks) if not check.passes(virtual_config))
+
+    def device_failing(self, device, virtual_config):
+        """Непройденные проверки одного устройства"""
+        return frozenset(i for i in self._device_checks.get(device, ()) if not self.checks[i].passes(virtual_config))
+
+    def content_key(self, device, digest):
+        """Хэши только тех поддеревьев config, от которых зависят проверки устройства"""
+        subtrees = self._subtrees.get(device)
+        return digest.root if subtrees is None else digest.part(subtrees)
+
+    def affected(self, device, touched_paths):
+        """Проверки, которые зависят от измененных путей (в любую сторону по префиксу)"""
+        result = set()
+        for path in touched_paths:
+            # Изменили поддерево, внутри которого лежит проверяемое значение
+            result.update(self._by_prefix.get((device, path), ()))
+            # Изменили значение внутри проверяемого поддерева
+            for i in range(len(path)):
+                result.update(self._by_path.get((device, path[:i]), ()))
+        return result
+
+    def recheck(self, virtual_config, previous_failing, device, touched_paths):
+        """Пересчитывает только зависимые проверки, остальные берет из previous_failing"""
+        affected = self.affected(device, touched_paths)
+        if not affected: return previous_failing
+        failing = set(previous_failing) - affected
+        failing.update(i for i in affected if not self.checks[i].passes(virtual_config))
+        return frozenset(failing)
+
+
+# --- КЭШИ ПРОЦЕССА ---
+# Сам evaluator компилируется один раз на версию лабы (lab_cache.LabDefinition)
+
+# Два уровня:
+# 1. Память сессии: session.pk -> (evaluator, state_token, failing). flush_writes переносит ее
+#    на записанный токен (retoken), и следующая команда - по HTTP или WebSocket - перепроверяет
+#    только тронутые пути.
+# 2. Вердикты по содержимому: (evaluator, устройство, хэши поддеревьев) -> непройденные проверки
+#    устройства. Хэши - те же, что у render-кэша (digest.py), поэтому одинаковые конфиги разных
+#    студентов делят вердикт. Evaluator в ключе - версия лабы (компилируется на версию).
+# Оба ограничены по размеру. Их трогают потоки запросов и поток писателя (retoken) - только под _lock
+_verdicts = OrderedDict()
+_by_content = OrderedDict()
+_lock = threading.Lock()
+MAX_CACHED_SESSIONS = 5000
+MAX_CACHED_VERDICTS = 20000
+
+
+def evaluate_session(session, evaluator, token_before, device=None, touched_paths=None):
+    """
+    Непройденные проверки сессии.
+    Если состояние сессии с прошлой проверки в этом процессе не менялось
+    (token_before совпал), перепроверяются только пути, тронутые командой.
+    """
+    memo = None
+    if session.pk:
+        with _lock: memo = _verdicts.get(session.pk)
+    if (memo is not None and memo[0] is evaluator and memo[1] == token_before
+            and touched_paths is not None):
+        return evaluator.recheck(session.virtual_config, memo[2], device, touched_paths)
+    session.load_devices(evaluator.devices)
+    failing = set()
+    for device in evaluator.devices:
+        failing.update(_device_failing(session, evaluator, device))
+    return frozenset(failing)
+
+
+def _device_failing(session, evaluator, device):
+    """Проверки устройства: по хэшу его конфига из кэша процесса, промах - считаем и запоминаем"""
+    data = session.virtual_config.get(device)
+    rev = data.get("rev") if data else None
+    # Устройства еще нет или у него нет ревизии (хэши живут на ревизии) - просто проверяем
+    if not session.pk or rev is None: return evaluator.device_failing(device, session.virtual_config)
+
+    digest = device_digest(session, device, data.get("config", {}), rev)
+    key = (evaluator, device, evaluator.content_key(device, digest))
+    with _lock:
+        failing = _by_content.get(key)
+        if failing is not None: _by_content.move_to_end(key)
+    if failing is None:
+        failing = evaluator.device_failing(device, session.virtual_config)
+        with _lock:
+            _by_content[key] = failing
+            while len(_by_content) > MAX_CACHED_VERDICTS:
+                _by_content.popitem(last=False)
+    return failing
+
+
+def remember(session, evaluator, failing):
+    """Запоминает результат для следующей команды этой сессии"""
+    if not session.pk: return
+    memo = (evaluator, session.state_token(), failing)
+    with _lock:
+        _verdicts[session.pk] = memo
+        _verdicts.move_to_end(session.pk)
+        while len(_verdicts) > MAX_CACHED_SESSIONS:
+            _verdicts.popitem(last=False)
+
+
+def retoken(session, token_before, token):
+    """Состояние записано (flush_writes) без изменений: вердикт переходит на записанный токен"""
+    if not session.pk: return
+    with _lock:
+        memo = _verdicts.get(session.pk)
+        if memo is not None and memo[1] == token_before:
+            _verdicts[session.pk] = (memo[0], token, memo[2])
@@ -0,0 +1,312 @@
+import hashlib
+import json
+from types import MappingProxyType
+
+# --- КАРТА ПРОМПТОВ ---
+PROMPT_KEYS = MappingProxyType({
+    "privileged": "#",
+    "global_config": "(config)#",
+    "interface_config": "(config-if)#",
+    "line_config": "(config-line)#",
+    "isakmp_config": "(config-isakmp)#",
+})
+
+# --- МОДИФИКАТОРЫ ВЫВОДА ---
+# "show ... | include <regex>" (см. paging.py)
+PIPE = ("|", "Output modifiers")
+OUTPUT_MODIFIERS = (
+    ("begin", "Begin with the line that matches"),
+    ("exclude", "Exclude lines that match"),
+    ("include", "Include lines that match"),
+    ("section", "Filter a section of output"),
+)
+
+# --- ДЕРЕВО СПРАВКИ (HELP TREE) ---
+# Формат: "ключ": (("команда", "описание"), ...)
+# Корневые ключи ("" и "__xxx__") - стартовые уровни контекстов,
+# остальные ключи - путь из слов через пробел ("show interface").
+# Если у команды в разных контекстах разные продолжения, ключ уточняется
+# корнем: "__global__ ip" (ip route) против общего "ip" (ip address).
+HELP_TREE = MappingProxyType({
+    # PRIVILEGED EXEC (Router#)
+    "": (
+        ("show", "Show running system information"),
+        ("configure", "Enter configuration mode"),
+        ("enable", "Turn on privileged commands"),
+        ("exit", "Exit current mode"),
+        ("copy", "Copy configuration files"),
+        ("write", "Write running configuration to memory"),
+        ("ping", "Send echo messages"),
+        ("traceroute", "Trace route to destination"),
+    ),
+    "__global__": (
+        ("hostname", "Set system's network name"),
+        ("interface", "Select an interface to configure"),
+        ("ip", "Global IP configuration subcommands"),
+        ("line", "Configure a terminal line"),
+        ("service", "Modify use of network based services"),
+        ("crypto", "Encryption module"),
+        ("access-list", "Add an access list entry"),
+        ("exit", "Exit from configure mode"),
+        ("no", "Negate a command or set its defaults"),
+        ("do", "To run exec commands in config mode"),
+    ),
+    "configure": (
+        ("terminal", "Configure from the terminal"),
+        ("<cr>", ""),
+    ),
+    "interface": (
+        ("FastEthernet0/0", ""),
+        ("FastEthernet0/1", ""),
+    ),
+
+    # SERVICE
+    "service": (
+        ("password-encryption", "Encrypt system passwords"),
+        ("timestamps", "Timestamp debug/log messages"),
+    ),
+    "service timestamps": (("log", ""), ("debug", "")),
+
+    # LINE CONFIG
+    "line": (("console", "Primary terminal line"), ("vty", "Virtual terminal")),
+    "__line__": (
+        ("password", "Set a password"),
+        ("login", "Enable password checking"),
+        ("logging", "Modify message logging facilities"),
+        ("no", "Negate a command"),
+        ("exit", "Exit from line configuration mode"),
+        ("do", "To run exec commands in config mode"),
+    ),
+    "logging": (("synchronous", "Synchronized message output"),),
+
+    # INTERFACE CONFIG
+    "__interface__": (
+        ("interface", "Select an interface to configure"),
+        ("ip", "Interface Internet Protocol config commands"),
+        ("description", "Interface specific description"),
+        ("shutdown", "Shutdown the selected interface"),
+        ("no", "Negate a command or set its defaults"),
+        ("exit", "Exit from interface configuration mode"),
+        ("do", "To run exec commands in config mode"),
+    ),
+    "ip": (("address", "Set the IP address of an interface"),),
+    "__global__ ip": (("route", "Establish static routes"),),
+    "__global__ ip route": (("<A.B.C.D>", "Destination prefix"),),
+
+    "show": (
+        ("running-config", "Current operating configuration"),
+        ("ip", "IP information"),
+        ("interface", "Interface status and configuration"),
+        ("crypto", "Encryption module"),
+    ),
+    "show ip": (
+        ("interface", "IP interface status and configuration"),
+        ("route", "IP routing table"),
+    ),
+    "show ip interface": (("brief", "Brief summary of IP status and configuration"),),
+    "show ip interface brief": (PIPE, ("<cr>", "")),
+    "show ip interface brief |": OUTPUT_MODIFIERS,
+    "show ip route": (("<A.B.C.D>", "Network to display information about"), PIPE, ("<cr>", "")),
+    "show ip route |": OUTPUT_MODIFIERS,
+    "show running-config": (PIPE, ("<cr>", "")),
+    "show running-config |": OUTPUT_MODIFIERS,
+    "show interface": (
+        ("FastEthernet0/0", ""),
+        ("FastEthernet0/1", ""),
+        ("description", "Show descriptions"),
+        PIPE,
+        ("<cr>", ""),
+    ),
+    "show interface |": OUTPUT_MODIFIERS,
+    "hostname": (
+        ("<WORD>", "This system's network name"),
+    ),
+    "ping": (("<WORD>", "Ping destination address or hostname"),),
+    "traceroute": (("<WORD>", "Trace route to destination address or hostname"),),
+})
+
+# ISAKMP (Phase 1) - отдельное дерево со своим корнем
+HELP_TREE_ISAKMP = MappingProxyType({
+    "": (
+        ("encryption", "Set encryption algorithm"),
+        ("authentication", "Set authentication method"),
+        ("group", "Set Diffie-Hellman group"),
+        ("exit", "Exit to global config"),
+        ("do", "To run exec commands in config mode"),
+    ),
+    "encryption": (("aes", ""), ("3des", ""), ("des", "")),
+    "authentication": (("pre-share", ""),),
+    "group": (("1", ""), ("2", ""), ("5", "")),
+})
+
+# Скрытые слова: работают (и разворачиваются дальше), но не видны в "?" и не дополняются.
+# "show ..." в global config без do принимался и до грамматики - оставляем как было
+HIDDEN_KEYWORDS = MappingProxyType({
+    "__global__": ("show",),
+})
+
+# Контекст -> (дерево, корневой ключ)
+CONTEXT_ROOTS = MappingProxyType({
+    "privileged": (HELP_TREE, ""),
+    "global_config": (HELP_TREE, "__global__"),
+    "interface_config": (HELP_TREE, "__interface__"),
+    "line_config": (HELP_TREE, "__line__"),
+    "isakmp_config": (HELP_TREE_ISAKMP, ""),
+})
+
+
+class GrammarNode:
+    """
+    Узел скомпилированного дерева команд.
+    options  - варианты на этом уровне (для справки "?")
+    children - слово -> следующий уровень
+    Все префиксы слов заранее разложены в словарь, поэтому разворот
+    сокращения стоит один lookup по токену, а не перебор всех опций.
+    """
+    __slots__ = ("options", "children", "_prefixes")
+
+    def __init__(self, options):
+        self.options = tuple(options)
+        self.children = {}
+
+        prefixes = {}
+        for name, _ in self.options:
+            # Плейсхолдеры типа <cr> или <WORD> не разворачиваем
+            if name.startswith("<"): continue
+            for i in range(1, len(name) + 1):
+                prefixes.setdefault(name[:i], []).append(name)
+        self._prefixes = MappingProxyType({p: tuple(names) for p, names in prefixes.items()})
+
+    def resolve(self, token):
+        """
+        Возвращает полное слово для токена или None,
+        если совпадений нет или сокращение неоднозначно.
+        """
+        matches = self._prefixes.get(token, ())
+        if len(matches) == 1:
+            return matches[0]
+        if token in matches:
+            # Точное совпадение побеждает неоднозначность ("co" -> нет, "copy" -> да)
+            return token
+        # Скрытое слово (HIDDEN_KEYWORDS) - только целиком
+        return token if token in self.children else None
+
+    def help(self, prefix=""):
+        """Опции этого уровня, начинающиеся на prefix (без учета регистра)"""
+        prefix = prefix.lower()
+        return [(n, d) for n, d in self.options if n.lower().startswith(prefix)]
+
+
+def _compile_tree(tree, privileged_root=None):
+    """
+    Собирает все корни дерева за один проход.
+    Одинаковые ключи делят один узел ("show" из Router# и из "do show").
+    """
+    nodes = {}
+    root_keys = [k for k in tree if k == "" or k.startswith("__")]
+
+    def build(key):
+        if key in nodes: return nodes[key]
+        node = nodes[key] = GrammarNode(tree.get(key, ()))
+        for name, _ in node.options:
+            if name.startswith("<"): continue
+            child_key = f"{key} {name}"
+            if key in root_keys and child_key not in tree: child_key = name
+            if child_key in tree:
+                node.children[name] = build(child_key)
+        return node
+
+    roots = {key: build(key) for key in root_keys}
+    if privileged_root is None:
+        privileged_root = roots.get("")
+
+    # "no ..." продолжает разбор с корня того же контекста,
+    # "do ..." - с корня привилегированного режима
+    for root in roots.values():
+        names = {n for n, _ in root.options}
+        if "no" in names: root.children["no"] = root
+        if "do" in names and privileged_root is not None:
+            root.children["do"] = privileged_root
+    for key, words in HIDDEN_KEYWORDS.items():
+        if key not in roots: continue
+        for word in words:
+            if word in tree: roots[key].children[word] = build(word)
+
+    for node in nodes.values():
+        node.children = MappingProxyType(node.children)
+    return roots
+
+
+def _compile_grammar():
+    main_roots = _compile_tree(HELP_TREE)
+    isakmp_roots = _compile_tree(HELP_TREE_ISAKMP, privileged_root=main_roots[""])
+    compiled = {}
+    for context, (tree, root_key) in CONTEXT_ROOTS.items():
+        roots = main_roots if tree is HELP_TREE else isakmp_roots
+        compiled[context] = roots[root_key]
+    return MappingProxyType(compiled)
+
+
+# Компилируется один раз при импорте и разделяется всеми процессорами
+GRAMMAR = _compile_grammar()
+
+
+def _export_grammar():
+    """
+    Грамматика для браузера: lab.js отвечает на "?" и Tab сам, без запроса к серверу.
+    Узлы - плоский список, переходы - индексы (узлы общие, "no"/"do" дают циклы).
+    Версия - хэш содержимого: меняется только вместе с деревом, поэтому бандл
+    отдается с вечным кэшем по URL с версией.
+    """
+    ids, nodes = {}, []
+
+    def visit(node):
+        if id(node) in ids: return ids[id(node)]
+        ids[id(node)] = len(nodes)
+        entry = {"options": [list(option) for option in node.options], "children": {}}
+        nodes.append(entry)
+        for word, child in node.children.items():
+            entry["children"][word] = visit(child)
+        return ids[id(node)]
+
+    bundle = {
+        "prompts": dict(PROMPT_KEYS),
+        "contexts": {context: visit(root) for context, root in GRAMMAR.items()},
+        "nodes": nodes,
+    }
+    body = json.dumps(bundle, ensure_ascii=False, separators=(",", ":")).encode()
+    return hashlib.blake2b(body, digest_size=8).hexdigest(), body
+
+
+GRAMMAR_VERSION, GRAMMAR_BUNDLE = _export_grammar()
+
+
+def context_root(context):
+    """Корневой узел грамматики для контекста (неизвестные -> privileged)"""
+    return GRAMMAR.get(context, GRAMMAR["privileged"])
+
+
+def expand_tokens(node, tokens):
+    """
+    Разворачивает сокращения: ['sh', 'int', 'd'] -> ['show', 'interface', 'description'].
+    Как только слово не распознано (аргумент, IP, имя хоста) - дальше не разворачиваем.
+    """
+    expanded = []
+    for i, token in enumerate(tokens):
+        word = node.resolve(token) if node is not None else None
+        if word is None:
+            expanded.extend(tokens[i:])
+            break
+        expanded.append(word)
+        node = node.children.get(word)
+    return expanded
+
+
+def walk(node, tokens):
+    """Спускается по дереву; None если путь не распознан"""
+    for token in tokens:
+        word = node.resolve(token)
+        if word is None: return None
+        node = node.children.get(word)
+        if node is None: return None
+    return node
@@ -0,0 +1,465 @@
+import json
+import threading
+from collections import OrderedDict
+
+from .dispatch import expand_interface_name
+
+# Порты по умолчанию, если узел топологии не перечисляет свои "interfaces"
+DEFAULT_INTERFACES = ("FastEthernet0/0", "FastEthernet0/1")
+
+# Узлы без IOS (PC, сервер): адрес и шлюз берутся прямо из topology_data
+HOST_TYPES = ("pc", "host", "server")
+HOST_IFACE = "eth0"
+
+MAX_HOPS = 30
+
+# Административная дистанция по умолчанию
+DISTANCE = {"L": 0, "C": 0, "S": 1}
+
+
+# --- АДРЕСА ---
+
+def ip_to_int(ip):
+    """'192.168.1.1' -> int или None, если это не IPv4"""
+    if not isinstance(ip, str): return None
+    parts = ip.split(".")
+    if len(parts) != 4: return None
+    value = 0
+    for p in parts:
+        if not p.isdigit() or int(p) > 255: return None
+        value = (value << 8) | int(p)
+    return value
+
+
+def int_to_ip(value):
+    return ".".join(str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+
+
+def mask_to_prefix(mask):
+    """'255.255.255.0' -> 24, None для несмежной маски"""
+    value = ip_to_int(mask)
+    if value is None: return None
+    prefix = bin(value).count("1")
+    if value != prefix_mask(prefix): return None
+    return prefix
+
+
+def prefix_mask(prefix):
+    return (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF if prefix else 0
+
+
+# --- ТАБЛИЦА МАРШРУТИЗАЦИИ ---
+
+class Route:
+    __slots__ = ("kind", "network", "prefix", "iface", "next_hop", "distance", "key")
+
+    def __init__(self, kind, network, prefix, iface=None, next_hop=None, distance=None, key=None):
+        self.kind = kind
+        self.network = network & prefix_mask(prefix)
+        self.prefix = prefix
+        self.iface = iface
+        self.next_hop = next_hop
+        self.distance = DISTANCE.get(kind, 1) if distance is None else distance
+        # Уникальный ключ записи: "C:FastEthernet0/0", "S:<ключ в config.routes>"
+        self.key = key or f"{kind}:{iface}"
+
+    def __repr__(self):
+        return f"{self.kind} {int_to_ip(self.network)}/{self.prefix}"
+
+
+def _preference(route):
+    return route.distance, route.key
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes", "best")
+
+    def __init__(self):
+        self.children = [None, None]
+        self.routes = {}      # key -> Route с этим префиксом
+        self.best = None      # победитель по административной дистанции
+
+
+class RouteTrie:
+    """
+    Бинарное префиксное дерево по битам IPv4 (старший бит первым).
+    Маршрут /n лежит на глубине n; lookup спускается по битам адреса
+    и запоминает последний узел с маршрутом - это и есть longest-prefix-match.
+    Добавление/удаление одного маршрута трогает только его путь в дереве.
+    """
+    __slots__ = ("_root", "_count")
+
+    def __init__(self, routes=()):
+        self._root = _TrieNode()
+        self._count = 0
+        for route in routes:
+            self.insert(route)
+
+    def __len__(self):
+        return self._count
+
+    def _path(self, network, prefix, create=False):
+        node, path = self._root, [self._root]
+        for i in range(prefix):
+            bit = (network >> (31 - i)) & 1
+            child = node.children[bit]
+            if child is None:
+                if not create: return None
+                child = node.children[bit] = _TrieNode()
+            node = child
+            path.append(node)
+        return path
+
+    @staticmethod
+    def _elect(node):
+        # При равной дистанции - детерминированно по ключу, независимо от порядка вставки
+        node.best = min(node.routes.values(), key=_preference) if node.routes else None
+
+    def insert(self, route):
+        node = self._path(route.network, route.prefix, create=True)[-1]
+        if route.key not in node.routes: self._count += 1
+        node.routes[route.key] = route
+        self._elect(node)
+
+    def remove(self, network, prefix, key):
+        path = self._path(network, prefix)
+        if path is None or key not in path[-1].routes: return
+        del path[-1].routes[key]
+        self._count -= 1
+        self._elect(path[-1])
+        # Подрезаем опустевшие ветки снизу вверх
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.routes or node.children[0] or node.children[1]: break
+            bit = (network >> (31 - (depth - 1))) & 1
+            path[depth - 1].children[bit] = None
+
+    def lookup(self, address, exclude=None):
+        """Самый длинный совпавший префикс; exclude - маршрут, который не считаем"""
+        node, found = self._root, None
+        for i in range(33):
+            best = node.best
+            if best is not None and best is not exclude: found = best
+            if i == 32: break
+            node = node.children[(address >> (31 - i)) & 1]
+            if node is None: break
+        return found
+
+    def matches(self, address):
+        """Все маршруты, покрывающие адрес: от самого длинного префикса, внутри - по дистанции"""
+        node, path = self._root, []
+        for i in range(33):
+            if node.routes: path.append(node)
+            if i == 32: break
+            node = node.children[(address >> (31 - i)) & 1]
+            if node is None: break
+        for node in reversed(path):
+            yield from sorted(node.routes.values(), key=_preference)
+
+    def routes(self):
+        """Лучшие маршруты в порядке обхода: по адресу сети, затем по длине префикса"""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node.best is not None: yield node.best
+            if node.children[1] is not None: stack.append(node.children[1])
+            if node.children[0] is not None: stack.append(node.children[0])
+
+
+def _route_entry(key, entry):
+    """config["routes"][key] -> Route или None, если запись битая"""
+    network, prefix = ip_to_int(entry.get("network")), mask_to_prefix(entry.get("mask", ""))
+    if network is None or prefix is None: return None
+    return Route("S", network, prefix, iface=entry.get("iface"), next_hop=ip_to_int(entry.get("next_hop")),
+                 distance=entry.get("distance"), key=f"S:{key}")
+
+
+class DeviceTable:
+    """
+    Скомпилированное L3-состояние одного устройства: адреса и таблица маршрутов.
+    Умеет обновляться точечно - по одному интерфейсу или одному статическому маршруту.
+    """
+
+    def __init__(self, interfaces, static_routes=None):
+        # iface -> (адрес, префикс) только для поднятых интерфейсов с валидным IP
+        self.iface_addr = {}
+        # адрес -> iface
+        self.addresses = {}
+        # ключ config.routes -> Route
+        self.static = {}
+        self.trie = RouteTrie()
+        # адрес назначения -> результат resolve(); сбрасывается при любом изменении
+        self._resolved = {}
+
+        for name, cfg in interfaces.items():
+            self.set_interface(name, cfg)
+        for key, entry in (static_routes or {}).items():
+            self.set_route(key, entry)
+
+    def set_interface(self, name, cfg):
+        self._resolved.clear()
+        old = self.iface_addr.pop(name, None)
+        if old is not None:
+            self.addresses.pop(old[0], None)
+            self.trie.remove(old[0], old[1], f"C:{name}")
+            self.trie.remove(old[0], 32, f"L:{name}")
+
+        if not isinstance(cfg, dict) or cfg.get("status") != "up": return
+        address, prefix = ip_to_int(cfg.get("ip_address")), mask_to_prefix(cfg.get("mask", ""))
+        if address is None or prefix is None: return
+        self.iface_addr[name] = (address, prefix)
+        self.addresses[address] = name
+        self.trie.insert(Route("C", address, prefix, iface=name))
+        self.trie.insert(Route("L", address, 32, iface=name))
+
+    def set_route(self, key, entry):
+        self._resolved.clear()
+        old = self.static.pop(key, None)
+        if old is not None: self.trie.remove(old.network, old.prefix, old.key)
+        route = _route_entry(key, entry) if isinstance(entry, dict) else None
+        if route is None: return
+        self.static[key] = route
+        self.trie.insert(route)
+
+    def installed(self, route):
+        """Как в IOS: статический маршрут активен, только если next-hop достижим"""
+        if route.kind != "S": return True
+        if route.next_hop is None: return route.iface in self.iface_addr
+        return self.trie.lookup(route.next_hop, exclude=route) is not None
+
+    def lookup(self, address):
+        # Неактивный статический маршрут не должен перекрывать менее точные
+        for route in self.trie.matches(address):
+            if self.installed(route): return route
+        return None
+
+    def routes(self):
+        return [r for r in self.trie.routes() if self.installed(r)]
+
+    def resolve(self, destination):
+        """
+        Куда отправить пакет: (исходящий интерфейс, IP следующего хопа) или None.
+        Next-hop статического маршрута разрешается рекурсивно до connected-сети.
+        """
+        if destination not in self._resolved:
+            if len(self._resolved) >= 1024: self._resolved.clear()
+            self._resolved[destination] = self._resolve(destination)
+        return self._resolved[destination]
+
+    def _resolve(self, destination):
+        target = destination
+        for _ in range(MAX_HOPS):
+            route = self.lookup(target)
+            if route is None: return None
+            if route.kind in ("C", "L"): return route.iface, target
+            if route.next_hop is None:
+                # ip route ... <interface>: адресат считается соседом на этом порту
+                return (route.iface, target) if route.iface else None
+            target = route.next_hop
+        return None
+
+    def source_for(self, iface):
+        entry = self.iface_addr.get(iface)
+        return entry[0] if entry else None
+
+
+# --- ТОПОЛОГИЯ ---
+
+def as_dict(data):
+    # JSONField иногда возвращает строку (см. views.switch_device)
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            return {}
+    return data if isinstance(data, dict) else {}
+
+
+class Topology:
+    """
+    Граф лабы из topology_data:
+        "nodes": [{"id": "R1", "type": "router", "interfaces": [...]},
+                  {"id": "PC1", "type": "pc", "ip": "...", "mask": "...", "gateway": "..."}]
+        "links": [{"from": "R1", "from_iface": "Fa0/0", "to": "PC1"}]
+    Интерфейс в связи можно не указывать - тогда соседом считается любой
+    поднятый порт узла в той же подсети.
+    """
+
+    def __init__(self, topology_data):
+        data = as_dict(topology_data)
+        self.hardware = {}
+        self.hosts = {}
+        for node in data.get("nodes", []):
+            if not isinstance(node, dict) or not node.get("id"): continue
+            node_id = node["id"]
+            if node.get("type") in HOST_TYPES:
+                self.hosts[node_id] = node
+                self.hardware[node_id] = (HOST_IFACE,)
+            else:
+                ifaces = node.get("interfaces") or DEFAULT_INTERFACES
+                self.hardware[node_id] = tuple(expand_interface_name(i) for i in ifaces)
+
+        # (узел, порт или None) -> [(сосед, порт соседа или None)]
+        self.neighbors = {}
+        for link in data.get("links", []):
+            if not isinstance(link, dict): continue
+            a, b = link.get("from"), link.get("to")
+            if not a or not b: continue
+            a_iface = self._iface(a, link.get("from_iface"))
+            b_iface = self._iface(b, link.get("to_iface"))
+            self.neighbors.setdefault((a, a_iface), []).append((b, b_iface))
+            self.neighbors.setdefault((b, b_iface), []).append((a, a_iface))
+
+    def _iface(self, node, name):
+        if node in self.hosts: return HOST_IFACE
+        return expand_interface_name(name) if name else None
+
+    def interfaces_of(self, node):
+        return self.hardware.get(node, DEFAULT_INTERFACES)
+
+    def host_table(self, node_id):
+        host = self.hosts[node_id]
+        interfaces = {HOST_IFACE: {"ip_address": host.get("ip"), "mask": host.get("mask", "255.255.255.0"), "status": "up"}}
+        routes = {}
+        if ip_to_int(host.get("gateway")) is not None:
+            routes["default"] = {"network": "0.0.0.0", "mask": "0.0.0.0", "next_hop": host["gateway"]}
+        return DeviceTable(interfaces, routes)
+
+    def candidates(self, node, iface):
+        return self.neighbors.get((node, iface), []) + self.neighbors.get((node, None), [])
+
+
+class NetworkState:
+    """
+    L3-состояние всех устройств одной сессии. Таблицы устройств компилируются
+    лениво и обновляются точечно, когда команда меняет интерфейс или маршрут.
+    """
+
+    def __init__(self, topology):
+        self.topology = topology
+        self._tables = {}
+
+    def invalidate(self, device=None):
+        if device is None: self._tables.clear()
+        else: self._tables.pop(device, None)
+
+    def apply_changes(self, virtual_config, device, touched_paths):
+        """
+        Точечно обновляет таблицу устройства по путям, которые тронула команда:
+        ("interfaces", X) и ("routes", key) - одна запись, все остальное - пересборка.
+        """
+        table = self._tables.get(device)
+        if table is None: return
+        config = virtual_config.get(device, {}).get("config", {})
+        for path in touched_paths:
+            if path and path[0] not in _L3_KEYS: continue
+            if len(path) < 2:
+                self._tables.pop(device, None)
+                return
+            section = config.get(path[0]) or {}
+            if path[0] == "interfaces": table.set_interface(path[1], section.get(path[1]))
+            else: table.set_route(path[1], section.get(path[1]))
+
+    def table(self, virtual_config, device):
+        table = self._tables.get(device)
+        if table is None:
+            if device in self.topology.hosts:
+                table = self.topology.host_table(device)
+            else:
+                config = virtual_config.get(device, {}).get("config", {})
+                table = DeviceTable(config.get("interfaces", {}), config.get("routes"))
+            self._tables[device] = table
+        return table
+
+    def _next_device(self, virtual_config, device, iface, next_hop):
+        """ARP: сосед за портом iface, которому принадлежит next_hop"""
+        subnet = self.table(virtual_config, device).iface_addr.get(iface)
+        for neighbor, n_iface in self.topology.candidates(device, iface):
+            owner = self.table(virtual_config, neighbor).addresses.get(next_hop)
+            if owner is None: continue
+            if n_iface is not None and owner != n_iface: continue
+            # Без явного порта в связи: адрес соседа должен быть в подсети нашего порта
+            if subnet and (next_hop & prefix_mask(subnet[1])) != (subnet[0] & prefix_mask(subnet[1])): continue
+            return neighbor, owner
+        return None
+
+    def forward(self, virtual_config, device, destination):
+        """
+        Путь пакета хоп за хопом.
+        Возвращает (хопы [(устройство, адрес входящего порта)], дошел ли, исходный адрес).
+        """
+        hops, source = [], None
+        for _ in range(MAX_HOPS):
+            table = self.table(virtual_config, device)
+            if destination in table.addresses:
+                if source is None: source = destination
+                return hops, True, source
+            step = table.resolve(destination)
+            if step is None: return hops, False, source
+            iface, next_hop = step
+            if source is None: source = table.source_for(iface)
+            nxt = self._next_device(virtual_config, device, iface, next_hop)
+            if nxt is None: return hops, False, source
+            device, ingress = nxt
+            ingress_ip = self.table(virtual_config, device).iface_addr[ingress][0]
+            hops.append((device, destination if destination in self.table(virtual_config, device).addresses else ingress_ip))
+        return hops, False, source
+
+    def reachable(self, virtual_config, device, destination):
+        """Эхо-запрос туда и ответ обратно на исходный адрес"""
+        hops, reached, source = self.forward(virtual_config, device, destination)
+        if not reached or source is None: return False, len(hops)
+        if not hops: return True, 0
+        _, back, _ = self.forward(virtual_config, hops[-1][0], source)
+        return back, len(hops)
+
+
+# --- КЭШИ ПРОЦЕССА ---
+# Сама топология компилируется один раз на версию лабы (lab_cache.LabDefinition)
+
+# session.pk -> [state_token, NetworkState]. Ограничен по размеру.
+# Его трогают потоки запросов и поток писателя (retoken) - только под _lock
+_networks = OrderedDict()
+_lock = threading.Lock()
+MAX_CACHED_SESSIONS = 2000
+
+# Пути конфига, от которых зависит L3-таблица устройства
+_L3_KEYS = ("interfaces", "routes")
+
+
+def get_network(session, topology):
+    """L3-состояние сессии; переиспользуется, пока состояние менялось только через процессор"""
+    token = session.state_token()
+    if not session.pk: return NetworkState(topology)
+    with _lock:
+        memo = _networks.get(session.pk)
+        if memo is None or memo[1].topology is not topology or memo[0] != token:
+            memo = _networks[session.pk] = [token, NetworkState(topology)]
+        _networks.move_to_end(session.pk)
+        while len(_networks) > MAX_CACHED_SESSIONS:
+            _networks.popitem(last=False)
+    return memo[1]
+
+
+def carry_network(session, token_before, device, touched_paths):
+    """
+    Вызывается после команды: если кэш был актуален до нее, точечно обновляем
+    таблицу устройства, и только когда команда тронула интерфейсы или маршруты.
+    """
+    if not session.pk: return
+    with _lock:
+        memo = _networks.get(session.pk)
+        if memo is not None and memo[0] != token_before:
+            del _networks[session.pk]
+            return
+    if memo is None: return
+    memo[1].apply_changes(session.virtual_config, device, touched_paths)
+    memo[0] = session.state_token()
+
+
+def retoken(session, token_before, token):
+    """Состояние записано (flush_writes) без изменений: L3-таблицы переходят на записанный токен"""
+    if not session.pk: return
+    with _lock:
+        memo = _networks.get(session.pk)
+        if memo is not None and memo[0] == token_before: memo[0] = token
@@ -0,0 +1,136 @@
+"""
+Вывод show по страницам, как в IOS: после каждого экрана (LAB_TERMINAL_LENGTH - 1 строк)
+--More--, пробел - следующий экран, Enter - одна строка, любая другая клавиша - выход.
+Фильтры "| include / exclude / begin / section <regex>" применяются по ходу генерации.
+
+Рендеры show - генераторы строк, поэтому вывод не собирается целиком: берется
+только экран, который студент видит, и только он уходит в ответ и в консоль.
+Остаток ждет в PAGERS до следующего нажатия; если его там нет (другой процесс,
+вытеснен) - вывод строится заново и показанные строки пропускаются.
+"""
+import re
+import threading
+from collections import OrderedDict
+from functools import partial
+from itertools import chain, dropwhile, islice
+
+from django.conf import settings
+
+from .grammar import OUTPUT_MODIFIERS, GrammarNode
+
+# Сколько недочитанных выводов (сессия, устройство) держим в процессе
+MAX_PAGERS = 1024
+
+
+# --- ФИЛЬТРЫ ---
+
+def _include(pattern, lines):
+    return (line for line in lines if pattern.search(line))
+
+
+def _exclude(pattern, lines):
+    return (line for line in lines if not pattern.search(line))
+
+
+def _begin(pattern, lines):
+    return dropwhile(lambda line: not pattern.search(line), lines)
+
+
+def _section(pattern, lines):
+    """Секция - строка без отступа и строки с отступом под ней; выводится целиком, если совпала любая"""
+    section = []
+    for line in lines:
+        if section and not line[:1].isspace():
+            if any(pattern.search(item) for item in section): yield from section
+            section = []
+        section.append(line)
+    if any(pattern.search(item) for item in section): yield from section
+
+
+FILTERS = {"begin": _begin, "exclude": _exclude, "include": _include, "section": _section}
+_MODIFIERS = GrammarNode(OUTPUT_MODIFIERS)
+
+
+def output_filter(raw_command):
+    """
+    "show run | i Vlan1" -> фильтр строк (None - без фильтра).
+    Регулярка берется из исходной строки: регистр важен, а токены уже в нижнем регистре.
+    ValueError - неизвестный модификатор или неверная регулярка.
+    """
+    if "|" not in raw_command: return None
+    spec = raw_command.split("|", 1)[1].split(None, 1)
+    name = _MODIFIERS.resolve(spec[0].lower()) if spec else None
+    if name is None or len(spec) < 2: raise ValueError(raw_command)
+    try:
+        pattern = re.compile(spec[1].strip())
+    except re.error as e:
+        raise ValueError(raw_command) from e
+    return partial(FILTERS[name], pattern)
+
+
+# --- СТРАНИЦЫ ---
+
+def screen_length():
+    """Строк вывода на экран (последняя строка терминала - под --More--)"""
+    return max(1, settings.LAB_TERMINAL_LENGTH - 1)
+
+
+def take(lines, count):
+    """Первые count строк и остаток (None - вывод кончился)"""
+    lines = iter(lines)
+    shown = list(islice(lines, count))
+    for line in lines:
+        return shown, chain((line,), lines)
+    return shown, None
+
+
+class Pager:
+    """Недочитанный вывод: команда, сколько строк уже показано и сам остаток"""
+    __slots__ = ("command", "offset", "lines")
+
+    def __init__(self, command, offset, lines):
+        self.command = command
+        self.offset = offset
+        self.lines = lines
+
+
+# (session.pk, устройство) -> Pager; у терминала устройства не больше одного --More--
+# Общий для потоков запросов (ASGI sync_to_async, WSGI-потоки) - только под _lock
+PAGERS = OrderedDict()
+_lock = threading.Lock()
+
+
+def keep_pager(session, device, pager):
+    key = (session.pk, device)
+    with _lock:
+        PAGERS[key] = pager
+        PAGERS.move_to_end(key)
+        while len(PAGERS) > MAX_PAGERS:
+            PAGERS.popitem(last=False)
+
+
+def drop_pager(session, device):
+    """Новая строка на устройстве закрывает его --More--"""
+    with _lock: PAGERS.pop((session.pk, device), None)
+
+
+def more_request(data):
+    """
+    Запрос продолжения от терминала: {"command": ..., "more": показано строк, "lines": сколько еще}.
+    (offset, lines); None - обычная команда; False - запрос битый.
+    """
+    if data.get("more") is None: return None
+    try:
+        offset, count = int(data["more"]), data.get("lines")
+        count = None if count is None else int(count)
+    except (TypeError, ValueError):
+        return False
+    if offset < 0 or not isinstance(data.get("command"), str): return False
+    return offset, count
+
+
+def resume_pager(session, device, command, offset):
+    """Остаток вывода с места offset или None, если его в этом процессе нет"""
+    with _lock: pager = PAGERS.pop((session.pk, device), None)
+    if pager is None or pager.command != command or pager.offset != offset: return None
+    return pager.lines
@@ -1,301 +1,300 @@
 import json
+import logging
+import time
+from itertools import islice
+
+from ..lab_cache import get_lab
+from ..metrics import observe_command, span
+from ..models import ConfigBlob
+from .baseconfig import init_device
+from .digest import advance_digest, device_digest
+from .dispatch import MSG_INCOMPLETE, MSG_INVALID_ARG, CommandTable, command, context_guard, expand_interface_name
+from .grading import evaluate_session, remember
+from .grammar import PROMPT_KEYS, context_root, expand_tokens, walk
+from .network import (MAX_HOPS, carry_network, get_network, int_to_ip, ip_to_int,
+                      mask_to_prefix, prefix_mask)
+from .paging import Pager, drop_pager, keep_pager, output_filter, resume_pager, screen_length, take
+from .render import RENDERED, new_revision
+
+logger = logging.getLogger(__name__)
+
+# Ключи устройства, которые описывают "где стоит курсор" (не конфиг)
+CURSOR_KEYS = ("context", "current_iface", "current_line", "editing_policy_id")
+# Плюс ревизия конфига: растет на каждой команде, изменившей config (кэш вывода show)
+TRACKED_KEYS = CURSOR_KEYS + ("rev",)
 
 class IOSCommandProcessor:
     def __init__(self, session):
         self.session = session
         
-        # !!! ДОБАВЬТЕ ЭТУ СТРОКУ !!!
-        self.lab = session.lab
+        # Разобранная лаба из кэша процесса (без запроса session.lab)
+        self.lab = get_lab(session.lab_id)
         
         self.device_name = getattr(session, 'current_device', 'Router') 
+
+        # Снимок + несвернутые мутации из журнала
+        self.session.load_state()
+        # Версия состояния до этого запроса - для инкрементальной проверки задания
+        self._state_token = self.session.state_token()
+        self._device_created = self.device_name not in self.session.virtual_config
         
         # --- ИНИЦИАЛИЗАЦИЯ ---
-        if self.device_name not in self.session.virtual_config:
-            self.session.virtual_config[self.device_name] = {
-                "config": {
-                    "hostname": self.device_name,
-                    "services": { # Новые глобальные настройки
-                        "password-encryption": False,
-                        "timestamps_log": True,   # По умолчанию в Cisco включено? (обычно да)
-                        "timestamps_debug": True
-                    },
-                    "lines": { # Настройки линий
-                        "con 0": {"login": False, "logging_sync": False},
-                        "vty 0 4": {"login": False}, # В лабе сделаем дефолт no login для удобства
-                        "vty 5 15": {"login": False}
-                    }
-                },
-                "context": "privileged",
-                "history": [],
-                "console_logs": []
-            }
-            self.session.save()
-            
+        if self._device_created:
+            # База лабы (общая для всех сессий) + в журнал только контекст и ревизия
+            init_device(self.session, self.lab, self.device_name)
+
         self.device_data = self.session.virtual_config[self.device_name]
         self.current_context = self.device_data.get("context", "privileged")
 
+        # Пути конфига, измененные текущей командой: ("interfaces", "FastEthernet0/0")
+        self.touched_paths = set()
+        self._config_dirty = False
 
-        # --- КАРТА ПРОМПТОВ (ДИНАМИЧЕСКАЯ) ---
-        self.prompt_keys = {
-            "privileged": "#",
-            "global_config": "(config)#",
-            "interface_config": "(config-if)#",
-            "line_config": "(config-line)#",        # НОВОЕ
-            "isakmp_config": "(config-isakmp)#",
-        }
-
-        # --- ДЕРЕВО СПРАВКИ (HELP TREE) ---
-        # Формат: "контекст": [("команда", "описание"), ...]
-        self.HELP_TREE = {
-            # PRIVILEGED EXEC (Router#)
-            "": [
-                ("show", "Show running system information"),
-                ("configure", "Enter configuration mode"),
-                ("enable", "Turn on privileged commands"),
-                ("exit", "Exit current mode"),
-                ("copy", "Copy configuration files"),
-                ("write", "Write running configuration to memory")
-            ],
-            "__global__": [
-                ("hostname", "Set system's network name"),
-                ("interface", "Select an interface to configure"),
-                ("line", "Configure a terminal line"),          # НОВОЕ
-                ("service", "Modify use of network based services"), # НОВОЕ
-                ("crypto", "Encryption module"),
-                ("access-list", "Add an access list entry"),
-                ("exit", "Exit from configure mode"),
-                ("no", "Negate a command or set its defaults"),
-                ("do", "To run exec commands in config mode")
-            ],
-            "configure": [
-                ("terminal", "Configure from the terminal"),
-                ("<cr>", "")
-            ],
-
-            # !!! ДОБАВЛЕНО: Аргументы для команды interface !!!
-            "interface": [
-                ("FastEthernet0/0", ""),
-                ("FastEthernet0/1", ""),
-            ],
-            
-            # SERVICE
-            "service": [
-                ("password-encryption", "Encrypt system passwords"),
-                ("timestamps", "Timestamp debug/log messages")
-            ],
-            "service timestamps": [("log", ""), ("debug", "")],
-
-            # LINE CONFIG
-            "line": [("console", "Primary terminal line"), ("vty", "Virtual terminal")],
-            "__line__": [
-                ("password", "Set a password"),
-                ("login", "Enable password checking"),
-                ("logging", "Modify message logging facilities"),
-                ("no", "Negate a command"),
-                ("exit", "Exit from line configuration mode")
-            ],
-            "logging": [("synchronous", "Synchronized message output")],
-
-            # INTERFACE CONFIG
-            "__interface__": [
-                ("ip", "Interface Internet Protocol config commands"),
-                ("description", "Interface specific description"),
-                ("shutdown", "Shutdown the selected interface"),
-                ("no", "Negate a command or set its defaults"),
-                ("exit", "Exit from interface configuration mode")
-            ],
-            
-            # ... (Остальные команды show, crypto и т.д. остаются как были) ...
-            "show": [
-                ("running-config", "Current operating configuration"),
-                ("ip", "IP information"),
-                ("interface", "Interface status and configuration"),
-                
-                ("crypto", "Encryption module")
-            ],
-             "show interface": [
-                ("FastEthernet0/0", ""),
-                ("FastEthernet0/1", ""),
-                ("description", "Show descriptions"),
-                ("<cr>", "Output modifiers")
-                
-            ],
-            # Добавим hostname для автодополнения, если кто-то введет "hostname ?"
-            "hostname": [
-                ("<WORD>", "This system's network name")
-            ]
-        }
-
+        # Шаг отмены: состояние устройства до первой строки в режиме конфигурации
+        self._undo_blob = None
+        self._undo_dirty = False
 
-        # Добавляем контексты для ISAKMP (Phase 1)
-        self.HELP_TREE_ISAKMP = {
-            "": [
-                ("encryption", "Set encryption algorithm"),
-                ("authentication", "Set authentication method"),
-                ("group", "Set Diffie-Hellman group"),
-                ("exit", "Exit to global config")
-            ],
-            "encryption": [("aes", ""), ("3des", ""), ("des", "")],
-            "authentication": [("pre-share", "")],
-            "group": [("1", ""), ("2", ""), ("5", "")]
-        }
+        # Постраничный вывод show: исходная строка (фильтр "| ..." берется из нее),
+        # с какой строки показывать, сколько строк и сколько показано, если есть --More--
+        self._raw_command = ""
+        self._skip, self._count = 0, None
+        self._more = None
+        # False - весь вывод сразу (вставка конфига, как "terminal length 0")
+        self._paging = True
 
     # --- 1. НОРМАЛИЗАЦИЯ ---
     def normalize_command(self, raw_command):
         """
-        Динамически разворачивает сокращения, используя HELP_TREE.
+        Разворачивает сокращения по скомпилированной грамматике (grammar.GRAMMAR).
         Пример: 'sh int d' -> 'show interface description'
         """
-        tokens = raw_command.strip().lower().split()
-        if not tokens: return ""
-
-        # 1. Определяем стартовый контекст дерева
-        if self.current_context == "global_config": current_key = "__global__"
-        elif self.current_context == "interface_config": current_key = "__interface__"
-        elif self.current_context == "line_config": current_key = "__line__"
-        else: current_key = "" # Privileged
-        
-        expanded_tokens = []
-        
-        # Флаг, что мы перестали понимать команды и пошли аргументы (IP адреса, имена)
-        # Как только мы не нашли совпадение в дереве, дальше не расширяем.
-        parsing_args = False
-
-        for token in tokens:
-            if parsing_args:
-                expanded_tokens.append(token)
-                continue
-
-            # Получаем доступные команды на этом уровне
-            options = self.HELP_TREE.get(current_key, [])
-            
-            # Ищем совпадения по префиксу
-            matches = []
-            for item in options:
-                # Защита от плохих данных
-                if not isinstance(item, (list, tuple)) or len(item) < 1: continue
-                cmd_name = item[0]
-                
-                # Пропускаем плейсхолдеры типа <cr> или <WORD>
-                if cmd_name.startswith("<"): continue
-                
-                if cmd_name.startswith(token):
-                    matches.append(cmd_name)
-            
-            # ЛОГИКА ВЫБОРА
-            if len(matches) == 1:
-                # УРА! Нашли уникальное совпадение (например "sh" -> "show")
-                full_word = matches[0]
-                expanded_tokens.append(full_word)
-                
-                # Сдвигаем контекст для следующего слова
-                # Если мы в корне (специальные ключи), то новый ключ просто слово ("show")
-                # Если уже внутри, добавляем через пробел ("show" -> "show interface")
-                if current_key.startswith("__") or current_key == "":
-                    current_key = full_word
-                else:
-                    current_key += " " + full_word
-            
-            elif len(matches) > 1:
-                # АМБИГУАЦИЯ (неоднозначность)
-                # Например "co" может быть "configure" или "copy"
-                # Если есть точное совпадение введенного слова с одним из вариантов - берем его
-                if token in matches:
-                    expanded_tokens.append(token)
-                    if current_key.startswith("__") or current_key == "": current_key = token
-                    else: current_key += " " + token
-                else:
-                    # Если точного нет, оставляем как есть (пусть handler ругается "ambiguous")
-                    expanded_tokens.append(token)
-                    parsing_args = True # Дальше дерево не строим
-            
-            else:
-                # НЕТ СОВПАДЕНИЙ
-                # Это аргумент (имя хоста, IP, интерфейс Fa0/0)
-                expanded_tokens.append(token)
-                parsing_args = True # Переходим в режим аргументов
+        return " ".join(self._normalize_tokens(raw_command))
 
-        return " ".join(expanded_tokens)
+    def _command_family(self, tokens):
+        """
+        Метка для метрик: шаблон команды, а у show - еще до двух слов из грамматики
+        ("show ip route", "show running-config"). Пользовательский текст в метку не попадает.
+        """
+        family = COMMANDS.family(self.current_context, tokens)
+        if family not in ("show", "do show"): return family
+
+        node = context_root("privileged").children.get("show")
+        words = [family]
+        for token in tokens[len(words[0].split()):][:2]:
+            if node is None or node.resolve(token) != token: break
+            words.append(token)
+            node = node.children.get(token)
+        return " ".join(words)
+
+    def _normalize_tokens(self, raw_command):
+        """Тот же разбор, но списком токенов - для диспетчера команд"""
+        tokens = raw_command.strip().lower().split()
+        if not tokens: return tokens
+        with span("normalize"):
+            return expand_tokens(context_root(self.current_context), tokens)
 
 
     def _expand_interface_name(self, short_name):
-        """
-        Превращает f0/0, fa0/0, fast0/0 в FastEthernet0/0.
-        Если не распознано, возвращает оригинал.
-        """
-        s = short_name.lower()
-        # FastEthernet
-        if s.startswith("f") and "ethernet" not in s:
-             # Берем цифры из конца
-             # fa0/0 -> 0/0
-             # f0/1 -> 0/1
-             # fast0/0 -> 0/0
-             parts = s.replace("fast", "").replace("fa", "").replace("f", "")
-             return "FastEthernet" + parts
-        
-        # GigabitEthernet (на будущее)
-        if s.startswith("g") and "ethernet" not in s:
-             parts = s.replace("gig", "").replace("gi", "").replace("g", "")
-             return "GigabitEthernet" + parts
-             
-        return short_name
+        """Превращает f0/0, fa0/0, fast0/0 в FastEthernet0/0 (см. dispatch.expand_interface_name)"""
+        return expand_interface_name(short_name)
 
     # --- 2. ГЛАВНЫЙ ПРОЦЕССОР ---
     def process_input(self, raw_command):
+        output = self._execute(raw_command)
+        self._push_undo()
+        return self._get_response(output)
+
+    def process_batch(self, lines):
+        """
+        Вставка конфига: строки выполняются подряд одним процессором
+        (контекст переходит от строки к строке), задание проверяется один раз в конце.
+        Возвращает ответы по строкам и итог как у process_input.
+        Вывод show не делится на экраны: следующая строка вставки закрыла бы --More--.
+        """
+        self._paging = False
+        results = []
+        for raw_command in lines:
+            prompt_before = self._get_current_prompt()
+            output = self._execute(raw_command)
+            results.append({"command": raw_command, "prompt_before": prompt_before,
+                            "output": output, "prompt": self._get_current_prompt()})
+        # Вставка целиком - один шаг отмены
+        self._push_undo()
+        response = self._get_response("")
+        response["results"] = results
+        return response
+
+    def process_more(self, raw_command, offset, count=None):
+        """
+        --More--: следующие count строк (по умолчанию экран) вывода raw_command с места offset.
+        В консоль пишется только показанное.
+        """
+        started = time.perf_counter()
+        self._family = "more"
+        count = screen_length() if count is None else max(1, min(count, screen_length()))
+        self._raw_command, self._more = raw_command, None
+
+        lines = resume_pager(self.session, self.device_name, raw_command, offset)
+        if lines is not None:
+            output = self._page(lines, offset, count)
+        else:
+            # Остатка в этом процессе нет: строим вывод заново и пропускаем показанное.
+            # Повторяем только show - остальные команды меняют состояние
+            tokens = self._normalize_tokens(raw_command)
+            output = ""
+            if COMMANDS.family(self.current_context, tokens) in ("show", "do show"):
+                self._skip, self._count = offset, count
+                output = COMMANDS.dispatch(self, self.current_context, tokens) or ""
+
+        if output: self.session.append_console(self.device_name, [{"type": "out", "text": output}])
+        observe_command(self._family, self.lab.id, time.perf_counter() - started)
+        return self._get_response(output)
+
+    def _execute(self, raw_command):
+        """Выполняет одну строку без проверки задания, возвращает текст ответа"""
+        started = time.perf_counter()
+        self._family = "empty"
+        response_text = self._run_line(raw_command)
+        observe_command(self._family, self.lab.id, time.perf_counter() - started)
+        return response_text
+
+    def _run_line(self, raw_command):
+        # Любая новая строка закрывает --More-- этого устройства
+        drop_pager(self.session, self.device_name)
+        self._raw_command, self._more = raw_command, None
         prompt_before = self._get_current_prompt()
+        cursor_before = {key: self.device_data.get(key) for key in TRACKED_KEYS}
+        token_before = self.session.state_token()
+        self._config_dirty = False
 
         if raw_command.rstrip().endswith("?"):
+            self._family = "help"
             return self._handle_context_help(raw_command)
 
-        command = self.normalize_command(raw_command)
+        # Токенизируем один раз: дальше диспетчер работает с готовым списком
+        tokens = self._normalize_tokens(raw_command)
+        command = " ".join(tokens)
         response_text = ""
 
         if not command:
             pass
         elif command in ["exit", "end"]:
+            self._family = command
             self._handle_exit(command)
-            self._save_state()
         else:
+            self._family = self._command_family(tokens)
+            if self._undo_blob is None and self.current_context != "privileged":
+                self._undo_blob = ConfigBlob.of(self.device_data)
             try:
-                if self.current_context == "privileged":
-                    response_text = self._handle_privileged(command)
-                elif self.current_context == "global_config":
-                    response_text = self._handle_global_config(command)
-                elif self.current_context == "interface_config":
-                    response_text = self._handle_interface_config(command)
-                elif self.current_context == "line_config":    # НОВОЕ
-                    response_text = self._handle_line_config(command)
-                elif self.current_context == "isakmp_config":
-                    response_text = self._handle_isakmp_config(command)
-                else:
+                with span("dispatch"):
+                    response_text = COMMANDS.dispatch(self, self.current_context, tokens)
+                if response_text is None:
                     response_text = "% Error: Unknown mode implementation"
             except Exception as e:
                 response_text = f"% System Error: {str(e)}"
 
-        self.device_data.setdefault("console_logs", []).append({
-            "type": "cmd", "text": raw_command, "prompt": prompt_before
-        })
+        # Консоль и история живут в отдельной таблице (ConsoleEntry)
+        # Пустой ввод храним как "", чтобы он не попадал в историю команд
+        cmd_text = raw_command if raw_command.strip() else ""
+        logs = [{"type": "cmd", "text": cmd_text, "prompt": prompt_before}]
         if response_text:
-            self.device_data["console_logs"].append({
-                "type": "out", "text": response_text
-            })
-        if raw_command.strip():
-            self.device_data["history"].append(raw_command)
+            logs.append({"type": "out", "text": response_text})
+        self.session.append_console(self.device_name, logs)
+
+        self._save_state(cursor_before)
+        self._undo_dirty = self._undo_dirty or self._config_dirty
+        # L3-таблицы (ping/traceroute) сбрасываем только если тронуты интерфейсы/маршруты
+        touched = {()} if self._device_created else self.touched_paths
+        carry_network(self.session, token_before, self.device_name, touched)
+        return response_text
 
-        self._save_state()
-        return self._get_response(response_text)
 
 
+    def _push_undo(self):
+        """Команда (или вставка) изменила конфиг -> состояние до нее уходит в стек отмены"""
+        if self._undo_dirty and self._undo_blob is not None:
+            self.session.push_undo(self.device_name, self._undo_blob)
+        self._undo_blob, self._undo_dirty = None, False
 
-    def _save_state(self):
+    def _save_state(self, cursor_before):
+        """Пишет в журнал только изменения этого устройства, а не весь virtual_config"""
         self.device_data["context"] = self.current_context
-        self.session.virtual_config[self.device_name] = self.device_data
-        self.session.save()
+
+        if self._config_dirty:
+            rev_before = self._revision()
+            self.device_data["rev"] = rev_before + 1
+            advance_digest(self.session, self.device_name, rev_before, rev_before + 1, self.touched_paths)
+
+        changed = {key: self.device_data.get(key) for key in TRACKED_KEYS
+                   if self.device_data.get(key) != cursor_before.get(key)}
+        self.session.record_mutation(
+            self.device_name,
+            values=changed,
+            config_paths={path: self._config_value(path) for path in self.touched_paths},
+        )
+
+    def _touch(self, *path):
+        """Помечает путь конфига как измененный текущей командой"""
+        self.touched_paths.add(path)
+        self._config_dirty = True
+
+    def _revision(self):
+        """Ревизия конфига устройства (у старых сессий появляется при первом обращении)"""
+        if "rev" not in self.device_data: self.device_data["rev"] = new_revision()
+        return self.device_data["rev"]
+
+    def _render_cached(self, key, render, subtrees=()):
+        """
+        Строки вывода show из кэша процесса. Ключ - содержимое конфига (хэши поддеревьев subtrees,
+        () - весь config), поэтому одинаковые конфиги разных студентов делят один вывод.
+        subtrees=None - вывод зависит не только от этого устройства: ключ по сессии и ревизии.
+        """
+        if not self.session.pk: return render()
+        if subtrees is None:
+            cache_key = (self.session.pk, self.device_name, self._revision(), self.lab.updated_at, key)
+        else:
+            digest = device_digest(self.session, self.device_name, self.device_data["config"], self._revision())
+            content = digest.part(subtrees) if subtrees else digest.root
+            cache_key = (self.lab.id, self.lab.updated_at, self.device_name, content, key)
+        with span("render"):
+            return RENDERED.get_or_render(cache_key, render)
+
+    def _page(self, lines, offset, count=None):
+        """Экран вывода. Если строки остались - остаток в PAGERS, а self._more = сколько уже показано"""
+        if not self._paging: return "\n".join(lines)
+        shown, rest = take(lines, count or screen_length())
+        if rest is not None:
+            self._more = offset + len(shown)
+            keep_pager(self.session, self.device_name, Pager(self._raw_command, self._more, rest))
+        return "\n".join(shown)
+
+    def _edit(self, *path):
+        """Словарь конфига по пути (создается при необходимости) + пометка об изменении"""
+        node = self.device_data["config"]
+        for key in path:
+            node = node.setdefault(key, {})
+        self._touch(*path)
+        return node
+
+    def _config_value(self, path):
+        node = self.device_data["config"]
+        for key in path:
+            node = node.get(key) if isinstance(node, dict) else None
+        return node
+
+    def _network(self):
+        """L3-состояние сессии: маршрутизация идет через соседей, нужны все устройства"""
+        self.session.load_devices()
+        return get_network(self.session, self.lab.topology)
+
+    def _hardware_interfaces(self):
+        """Физические порты устройства (topology_data -> nodes[].interfaces)"""
+        return list(self.lab.topology.interfaces_of(self.device_name))
 
     def _get_current_prompt(self):
         cfg = self.device_data["config"]
         hostname = cfg.get("hostname", self.device_name)
-        suffix = self.prompt_keys.get(self.current_context, "#")
+        suffix = PROMPT_KEYS.get(self.current_context, "#")
         return f"{hostname}{suffix}"
 
 
@@ -310,7 +309,9 @@ class IOSCommandProcessor:
             "output": text_output,
             "prompt": self._get_current_prompt(),
             "is_completed": is_done, # Теперь передаем реальный результат
-            "hostname": current_hostname
+            "hostname": current_hostname,
+            # Вывод не поместился в экран: сколько строк показано (продолжение - process_more)
+            "more": self._more,
         }
 
 
@@ -320,99 +321,29 @@ class IOSCommandProcessor:
     def _handle_context_help(self, raw_command):
         clean_input = raw_command.replace('?', '').rstrip()
         space_before = raw_command.replace('?', '').endswith(' ')
-        
-        # Нормализуем всю строку сразу, чтобы "show int" стало "show interface"
-        # Это решает проблему поиска ключа
-        normalized_full = self.normalize_command(clean_input)
-        tokens = normalized_full.split()
-
-        context_key = ""
-        prefix = ""
-
-        if not tokens and not space_before:
-            # Корень (просто "?")
-            if self.current_context == "global_config": context_key = "__global__"
-            elif self.current_context == "interface_config": context_key = "__interface__"
-            elif self.current_context == "line_config": context_key = "__line__"
-            else: context_key = ""
-        
-        elif space_before:
-            # Закончили слово ("show int ?") -> ищем опции для "show interface"
-            context_key = normalized_full
-            prefix = ""
-            
+        tokens = clean_input.lower().split()
+
+        # "show int ?" -> опции узла "show interface"
+        # "show in?"   -> опции узла "show", начинающиеся на "in"
+        if space_before or not tokens:
+            path, prefix = tokens, ""
         else:
-            # Не закончили слово ("show in?") -> ищем опции для "show", начинающиеся на "in"
-            if len(tokens) == 1:
-                 # Первое слово
-                 if self.current_context == "global_config": context_key = "__global__"
-                 elif self.current_context == "interface_config": context_key = "__interface__"
-                 else: context_key = ""
-                 prefix = tokens[0]
-            else:
-                 # "show interface fa" -> Context="show interface", Prefix="fa"
-                 context_key = " ".join(tokens[:-1])
-                 prefix = tokens[-1]
-
-        # Ищем в дереве
-        options = self.HELP_TREE.get(context_key, [])
-        
-        # Если опций нет, возможно мы ввели что-то, чего нет в словаре как ключа
-        if not options and context_key:
-             # Попробуем найти частичное совпадение ключа? Нет, это сложно.
-             # Просто вернем ошибку или пустоту
-             pass
-
-        matches = []
-        prefix_lower = prefix.lower()
-        
-        for item in options:
-            if not isinstance(item, (list, tuple)) or len(item) < 2: continue
-            name = item[0]
-            desc = item[1]
-            if name.lower().startswith(prefix_lower):
-                matches.append((name, desc))
-        
-        if not matches: return self._get_response("% Unrecognized command")
-        
-        out = [f"  {n:<20} {d}" for n, d in matches]
-        return self._get_response("\n".join(out))
+            path, prefix = tokens[:-1], tokens[-1]
 
+        node = walk(context_root(self.current_context), path)
+        matches = node.help(prefix) if node is not None else []
 
+        if not matches: return "% Unrecognized command"
 
+        out = [f"  {n:<20} {d}" for n, d in matches]
+        return "\n".join(out)
 
-    # --- 4. ЛОГИКА КОМАНД (HANDLERS) ---
 
-    def _handle_line_config(self, cmd):
-        """Обработка команд внутри line con 0 / line vty"""
-        config = self.device_data["config"]
-        line_name = self.device_data.get("current_line")
-        
-        if not line_name or line_name not in config.get("lines", {}):
-             self.current_context = "global_config"
-             return "% Error: Line context lost."
 
-        line_cfg = config["lines"][line_name]
-
-        if cmd.startswith("password"):
-            # password cisco
-            line_cfg["password"] = cmd.split()[-1]
-            return ""
-        
-        if cmd == "login":
-            line_cfg["login"] = True
-            return ""
-            
-        if cmd == "no login":
-            line_cfg["login"] = False
-            return ""
-            
-        if "logging synchronous" in cmd:
-            line_cfg["logging_sync"] = not cmd.startswith("no ")
-            return ""
-
-        return "% Invalid input detected."
 
+    # --- 4. ЛОГИКА КОМАНД (HANDLERS) ---
+    # Каждый обработчик объявляет контекст и шаблон через @command,
+    # таблица COMMANDS собирается один раз после объявления класса.
 
     def _handle_exit(self, cmd):
         if cmd == "end":
@@ -424,213 +355,321 @@ class IOSCommandProcessor:
         elif self.current_context != "privileged":
             self.current_context = "global_config"
 
+    # --- PRIVILEGED ---
+    @command("privileged", "configure terminal")
+    def _cmd_configure_terminal(self):
+        self.current_context = "global_config"
+        return "Enter configuration commands, one per line.  End with CNTL/Z."
+
+    @command("privileged", "show <line?>")
+    @command("global_config", "show <line?>")
+    @command("global_config", "do show <line?>")
+    @command("interface_config", "do show <line?>")
+    @command("line_config", "do show <line?>")
+    @command("isakmp_config", "do show <line?>")
+    def _cmd_show(self, rest):
+        # "| include ..." - не часть команды: вывод и кэш те же, фильтр поверх
+        rest = rest.split("|", 1)[0].strip()
+        cmd = f"show {rest}" if rest else "show"
+        try:
+            keep = output_filter(self._raw_command)
+        except ValueError:
+            return MSG_INVALID_ARG
+        lines = self._render_cached(cmd, lambda: self._simulate_show_commands(cmd), self._show_scope(cmd))
+        if keep is not None: lines = keep(lines)
+        return self._page(islice(lines, self._skip, None), self._skip, self._count)
+
+    @command("privileged", "ping <ip>")
+    @command("global_config", "do ping <ip>")
+    @command("interface_config", "do ping <ip>")
+    @command("line_config", "do ping <ip>")
+    @command("isakmp_config", "do ping <ip>")
+    def _cmd_ping(self, target):
+        network = self._network()
+        ok, hops = network.reachable(self.session.virtual_config, self.device_name, ip_to_int(target))
+        lines = [
+            "Type escape sequence to abort.",
+            f"Sending 5, 100-byte ICMP Echos to {target}, timeout is 2 seconds:",
+        ]
+        if not ok:
+            lines += [".....", "Success rate is 0 percent (0/5)"]
+            return "\n".join(lines)
+        # Задержка растет с числом хопов (детерминированно, чтобы вывод был стабильным)
+        rtt = max(1, 2 * hops)
+        lines += ["!!!!!", f"Success rate is 100 percent (5/5), round-trip min/avg/max = {rtt}/{rtt + 1}/{rtt + 4} ms"]
+        return "\n".join(lines)
 
-    def _handle_privileged(self, cmd):
-        if cmd == "configure terminal":
-            self.current_context = "global_config"
-            return "Enter configuration commands, one per line.  End with CNTL/Z."
-        elif cmd.startswith("show"):
-            return self._simulate_show_commands(cmd)
-        elif cmd == "write" or cmd == "copy running-config startup-config":
-            return "Building configuration...\n[OK]"
-        return "% Invalid input detected."
+    @command("privileged", "traceroute <ip>")
+    @command("global_config", "do traceroute <ip>")
+    @command("interface_config", "do traceroute <ip>")
+    @command("line_config", "do traceroute <ip>")
+    @command("isakmp_config", "do traceroute <ip>")
+    def _cmd_traceroute(self, target):
+        network = self._network()
+        destination = ip_to_int(target)
+        hops, reached, _ = network.forward(self.session.virtual_config, self.device_name, destination)
+        lines = ["Type escape sequence to abort.", f"Tracing the route to {target}", ""]
+
+        if reached and not hops:
+            # Собственный адрес
+            lines.append(f"  1 {target} 0 msec 0 msec 0 msec")
+            return "\n".join(lines)
+        for i, (_, address) in enumerate(hops, 1):
+            rtt = 4 * i
+            lines.append(f"  {i} {int_to_ip(address)} {rtt} msec {rtt} msec {rtt} msec")
+        if not reached:
+            # Дальше никто не отвечает - как IOS, печатаем звездочки до предела TTL
+            for i in range(len(hops) + 1, MAX_HOPS + 1):
+                lines.append(f"  {i}  *  *  *")
+        return "\n".join(lines)
 
+    @command("privileged", "write")
+    @command("privileged", "copy running-config startup-config")
+    def _cmd_write(self):
+        return "Building configuration...\n[OK]"
 
-    def _handle_global_config(self, cmd):
-        real_cmd = cmd[3:] if cmd.startswith("do ") else cmd
-        if real_cmd.startswith("show"): return self._simulate_show_commands(real_cmd)
+    # --- GLOBAL CONFIG ---
+    @command("global_config", "service password-encryption", negatable=True)
+    def _cmd_service_password_encryption(self, no=False):
+        self._edit("services")["password-encryption"] = not no
+        return ""
 
-        config = self.device_data["config"]
-        
-        # --- SERVICES (service password-encryption) ---
-        if cmd.startswith("service ") or cmd.startswith("no service "):
-            is_no = cmd.startswith("no ")
-            clean = cmd[3:] if is_no else cmd
-            
-            if "services" not in config: config["services"] = {}
-            services = config["services"]
-            
-            if "password-encryption" in clean:
-                services["password-encryption"] = not is_no
-                return ""
-            if "timestamps" in clean:
-                if "log" in clean: services["timestamps_log"] = not is_no
-                if "debug" in clean: services["timestamps_debug"] = not is_no
-                return ""
-
-        # --- HOSTNAME ---
-        if cmd.startswith("hostname"):
-            parts = cmd.split()
-            if len(parts) > 1: config["hostname"] = parts[1]
-            return ""
+    @command("global_config", "service timestamps <line?>", negatable=True)
+    def _cmd_service_timestamps(self, rest, no=False):
+        services = self._edit("services")
+        # service timestamps log datetime msec -> важен только первый аргумент
+        kind = rest.split()[0] if rest else None
+        if kind == "log": services["timestamps_log"] = not no
+        if kind == "debug": services["timestamps_debug"] = not no
+        return ""
 
-        # --- LINE CONFIG ---
-        if cmd.startswith("line "):
-            # line console 0 / line vty 0 4
-            parts = cmd.split()
-            line_name = "unknown"
-            
-            if "console" in cmd and "0" in cmd: line_name = "con 0"
-            elif "vty" in cmd:
-                # Упрощение: если vty 0 -> vty 0 4
-                if "0" in parts and "4" in parts: line_name = "vty 0 4"
-                elif "5" in parts and "15" in parts: line_name = "vty 5 15"
-                elif "0" in parts: line_name = "vty 0 4" # Fallback
-            
-            if line_name == "unknown": return "% Invalid line"
+    @command("global_config", "hostname <word>")
+    def _cmd_hostname(self, name):
+        self.device_data["config"]["hostname"] = name
+        self._touch("hostname")
+        return ""
 
-            self.current_context = "line_config"
-            self.device_data["current_line"] = line_name
-            
-            # Инит конфига линий
-            if "lines" not in config: config["lines"] = {}
-            if line_name not in config["lines"]: config["lines"][line_name] = {}
-            return ""
+    @command("global_config", "line console <int>")
+    def _cmd_line_console(self, number):
+        if number != 0: return "% Invalid line"
+        return self._enter_line("con 0")
+
+    @command("global_config", "line vty <int> <int?>")
+    def _cmd_line_vty(self, first, last):
+        # Упрощение: если vty 0 -> vty 0 4 (как раньше, и для "line vty 0 15")
+        if first == 0: return self._enter_line("vty 0 4")
+        if first == 5 and last == 15: return self._enter_line("vty 5 15")
+        return "% Invalid line"
+
+    def _enter_line(self, line_name):
+        self.current_context = "line_config"
+        self.device_data["current_line"] = line_name
+        # Инит конфига линий
+        self._edit("lines", line_name)
+        return ""
 
-        # --- INTERFACE ---
-        # INTERFACE (Улучшенное распознавание)
-        if cmd.startswith("interface"):
-            parts = cmd.split()
-            if len(parts) < 2: return "% Incomplete command."
-            
-            # Используем утилиту
-            target_iface = self._expand_interface_name(parts[1])
+    @command("global_config", "interface <iface>")
+    @command("interface_config", "interface <iface>", guarded=False)
+    def _cmd_interface(self, target_iface):
+        # Для надежности приведем к правильному регистру из списка портов устройства
+        final_name = target_iface # Fallback
+        for vp in self._hardware_interfaces():
+            if vp.lower() == target_iface.lower():
+                final_name = vp
+                break
+
+        self.current_context = "interface_config"
+        self._edit("interfaces", final_name)
+        self.device_data["current_iface"] = final_name
+        return ""
 
-            # Проверка на валидность (только Fa0/0 и Fa0/1 разрешены в лабе)
-            # Но если мы хотим разрешить создание Loopback, можно смягчить
-            valid_ports = ["FastEthernet0/0", "FastEthernet0/1"]
-            
-            # Для надежности приведем к правильному регистру из списка valid_ports
-            final_name = target_iface # Fallback
-            for vp in valid_ports:
-                if vp.lower() == target_iface.lower():
-                    final_name = vp
-                    break
-            
-            self.current_context = "interface_config"
-            if "interfaces" not in config: config["interfaces"] = {}
-            if final_name not in config["interfaces"]: config["interfaces"][final_name] = {}
-            self.device_data["current_iface"] = final_name
+    @command("global_config", "ip route <ip> <mask> <word?> <int?>", negatable=True)
+    def _cmd_ip_route(self, network, mask, target, distance, no=False):
+        if ip_to_int(network) & ~prefix_mask(mask_to_prefix(mask)) & 0xFFFFFFFF:
+            return "%Inconsistent address and mask"
+        config = self.device_data["config"]
+        prefix = f"{network} {mask} "
+
+        if no:
+            # no ip route <сеть> <маска> [куда] - без "куда" удаляются все варианты.
+            # Конфиг меняется только вместе с _touch: пустой routes не создаем
+            routes = config.get("routes", {})
+            keys = [k for k in routes if k.startswith(prefix) and (target is None or k == prefix + self._route_target(target))]
+            for key in keys:
+                del routes[key]
+                self._touch("routes", key)
             return ""
 
-        # --- CRYPTO / ACL ---
-        if cmd.startswith("crypto isakmp policy"):
-            self.current_context = "isakmp_config"
-            policy_id = cmd.split()[-1]
-            if "isakmp_policies" not in config: config["isakmp_policies"] = {}
-            if policy_id not in config["isakmp_policies"]: config["isakmp_policies"][policy_id] = {}
-            self.device_data["editing_policy_id"] = policy_id
-            return ""
-        
-        if cmd.startswith("access-list"):
-            if "acls" not in config: config["acls"] = []
-            config["acls"].append(cmd)
-            return ""
+        if target is None: return MSG_INCOMPLETE
+        if distance is not None and not 1 <= distance <= 255: return MSG_INVALID_ARG
+        entry = {"network": network, "mask": mask}
+        if ip_to_int(target) is not None:
+            entry["next_hop"] = target
+        else:
+            iface = self._route_target(target)
+            if not iface.startswith(("FastEthernet", "GigabitEthernet")): return MSG_INVALID_ARG
+            entry["iface"] = iface
+        if distance is not None: entry["distance"] = distance
+
+        key = prefix + (entry.get("next_hop") or entry["iface"])
+        config.setdefault("routes", {})[key] = entry
+        self._touch("routes", key)
+        return ""
 
-        return "% Invalid input detected."
+    def _route_target(self, target):
+        return target if ip_to_int(target) is not None else expand_interface_name(target)
 
+    @command("global_config", "crypto isakmp policy <word>")
+    def _cmd_crypto_isakmp_policy(self, policy_id):
+        self.current_context = "isakmp_config"
+        self._edit("isakmp_policies", policy_id)
+        self.device_data["editing_policy_id"] = policy_id
+        return ""
 
-    def _handle_interface_config(self, cmd):
-        # --- НОВОЕ: Разрешаем переключение интерфейса без exit ---
-        if cmd.startswith("interface"):
-             # Вызываем обработчик глобального режима, он умеет переключать интерфейсы
-             return self._handle_global_config(cmd)
-        # ---------------------------------------------------------
+    @command("global_config", "access-list <line>")
+    def _cmd_access_list(self, rest):
+        self.device_data["config"].setdefault("acls", []).append(f"access-list {rest}")
+        self._touch("acls")
+        return ""
 
+    # --- INTERFACE CONFIG ---
+    @context_guard("interface_config")
+    def _guard_interface(self):
         config = self.device_data["config"]
-
-        
-        # 1. Достаем имя интерфейса из сохраненного состояния
         current_iface_name = self.device_data.get("current_iface")
-        
+
         # Защита от сбоев (если вдруг контекст есть, а имени нет)
         if not current_iface_name or "interfaces" not in config:
             self.current_context = "global_config"
             return "% Error: Interface context lost. Returning to global config."
 
-        # Получаем ссылку на словарь конфига конкретного интерфейса
-        iface_config = config["interfaces"].get(current_iface_name)
-        
         # Если интерфейс был удален пока мы в нем сидели (редкий кейс)
-        if iface_config is None:
-             return "% Error: Interface no longer exists."
+        if current_iface_name not in config["interfaces"]:
+            return "% Error: Interface no longer exists."
+        return None
 
-        # --- КОМАНДЫ ИНТЕРФЕЙСА ---
-        
-        # 2. DESCRIPTION
-        if cmd.startswith("description"):
-            # Отрезаем "description " (12 символов)
-            desc_text = cmd[12:].strip()
-            iface_config["description"] = desc_text
-            return ""
+    def _iface_config(self):
+        return self._edit("interfaces", self.device_data["current_iface"])
 
-        # 3. IP ADDRESS
-        if cmd.startswith("ip address"):
-            parts = cmd.split()
-            # Ожидаем: ip address 1.1.1.1 255.255.255.0
-            if len(parts) >= 4:
-                iface_config["ip_address"] = parts[2]
-                iface_config["mask"] = parts[3]
-            elif len(parts) == 2 and parts[1] == "dhcp":
-                 iface_config["ip_address"] = "dhcp"
-            else:
-                return "% Incomplete command."
-            return ""
-            
-        # 4. NO SHUTDOWN
-        if cmd == "no shutdown":
+    @command("interface_config", "description <line?>")
+    def _cmd_description(self, text):
+        self._iface_config()["description"] = text or ""
+        return ""
+
+    @command("interface_config", "ip address <ip> <mask>")
+    def _cmd_ip_address(self, ip, mask):
+        iface_config = self._iface_config()
+        iface_config["ip_address"] = ip
+        iface_config["mask"] = mask
+        return ""
+
+    @command("interface_config", "ip address dhcp")
+    def _cmd_ip_address_dhcp(self):
+        self._iface_config()["ip_address"] = "dhcp"
+        return ""
+
+    @command("interface_config", "shutdown", negatable=True)
+    def _cmd_shutdown(self, no=False):
+        iface_config = self._iface_config()
+        if no:
             iface_config["status"] = "up"
             # Автоматически меняем line protocol (упрощение)
             iface_config["protocol"] = "up"
             return "% Link changed, interface is up"
-            
-        # 5. SHUTDOWN
-        if cmd == "shutdown":
-            iface_config["status"] = "administratively down"
-            iface_config["protocol"] = "down"
-            return "% Link changed, interface is administratively down"
+        iface_config["status"] = "administratively down"
+        iface_config["protocol"] = "down"
+        return "% Link changed, interface is administratively down"
 
-        return "% Invalid input detected."
+    # --- LINE CONFIG ---
+    @context_guard("line_config")
+    def _guard_line(self):
+        line_name = self.device_data.get("current_line")
+        if not line_name or line_name not in self.device_data["config"].get("lines", {}):
+            self.current_context = "global_config"
+            return "% Error: Line context lost."
+        return None
 
+    def _line_config(self):
+        return self._edit("lines", self.device_data["current_line"])
 
+    @command("line_config", "password <word>")
+    def _cmd_line_password(self, password):
+        self._line_config()["password"] = password
+        return ""
 
+    @command("line_config", "login", negatable=True)
+    def _cmd_line_login(self, no=False):
+        self._line_config()["login"] = not no
+        return ""
 
-    def _handle_isakmp_config(self, cmd):
-        # Контекст настройки политики (Phase 1)
-        config = self.device_data["config"]
-        policy_id = self.device_data.get("editing_policy_id")
-        
-        if not policy_id: return "% Error: No policy selected"
-        
-        policy = config["isakmp_policies"][policy_id]
-        
-        if cmd.startswith("encryption"): policy["encryption"] = cmd.split()[-1]
-        elif cmd.startswith("authentication"): policy["authentication"] = cmd.split()[-1]
-        elif cmd.startswith("group"): policy["group"] = cmd.split()[-1]
-        
+    @command("line_config", "logging synchronous", negatable=True)
+    def _cmd_line_logging_sync(self, no=False):
+        self._line_config()["logging_sync"] = not no
+        return ""
+
+    # --- ISAKMP CONFIG (Phase 1) ---
+    @context_guard("isakmp_config")
+    def _guard_isakmp(self):
+        if not self.device_data.get("editing_policy_id"): return "% Error: No policy selected"
+        return None
+
+    def _isakmp_policy(self):
+        return self._edit("isakmp_policies", self.device_data["editing_policy_id"])
+
+    @command("isakmp_config", "encryption <word>")
+    def _cmd_isakmp_encryption(self, value):
+        self._isakmp_policy()["encryption"] = value
+        return ""
+
+    @command("isakmp_config", "authentication <word>")
+    def _cmd_isakmp_authentication(self, value):
+        self._isakmp_policy()["authentication"] = value
+        return ""
+
+    @command("isakmp_config", "group <word>")
+    def _cmd_isakmp_group(self, value):
+        self._isakmp_policy()["group"] = value
         return ""
 
     # --- 5. SHOW COMMANDS SIMULATION ---
+    def _show_scope(self, cmd):
+        """
+        От чего зависит вывод show (те же ветки, что в _simulate_show_commands):
+        поддеревья config, () - весь config, None - таблицы всей сети сессии.
+        """
+        if "run" in cmd: return ()
+        parts = cmd.split()
+        if parts[:3] == ["show", "ip", "route"]: return None
+        if ("ip" in parts and ("interface" in parts or "int" in cmd)) or "interface" in cmd or "interfaces" in cmd:
+            return ("interfaces",)
+        return ()
+
     def _simulate_show_commands(self, cmd):
+        """Генератор строк вывода (см. paging.py: берутся только показанные экраны)"""
         # Нормализованная команда
         # cmd может быть "show running-config" или "show interface fa0/1"
         
         # 1. show running-config
         if "run" in cmd:
-            return self._generate_running_config()
+            yield from self._generate_running_config()
+            return
         
         parts = cmd.split()
+
+        # show ip route [адрес]
+        if parts[:3] == ["show", "ip", "route"]:
+            yield from self._generate_ip_route(parts[3] if len(parts) > 3 else None)
+            return
         
         # 2. show ip interface brief
         # Логика: наличие 'ip' и ('int' или 'interface')
         if "ip" in parts and ("interface" in parts or "int" in cmd):
             interfaces = self.device_data["config"].get("interfaces", {})
             
-            header = f"{'Interface':<20} {'IP-Address':<15} {'OK?':<4} {'Status':<20} {'Protocol':<10}"
-            lines = [header]
+            yield f"{'Interface':<20} {'IP-Address':<15} {'OK?':<4} {'Status':<20} {'Protocol':<10}"
             
-            # Стандартные интерфейсы + созданные пользователем
-            std_ifaces = ["FastEthernet0/0", "FastEthernet0/1"]
+            # Порты устройства из топологии + созданные пользователем
+            std_ifaces = self._hardware_interfaces()
             all_ifaces = sorted(list(set(std_ifaces) | set(interfaces.keys())))
 
             for iface in all_ifaces:
@@ -639,18 +678,17 @@ class IOSCommandProcessor:
                 status = cfg.get("status", "administratively down")
                 # Упрощенно: если порт UP, протокол тоже UP
                 proto = "up" if status == "up" else "down"
-                lines.append(f"{iface:<20} {ip:<15} {'YES':<4} {status:<20} {proto:<10}")
-                
-            return "\n".join(lines)
+                yield f"{iface:<20} {ip:<15} {'YES':<4} {status:<20} {proto:<10}"
+            return
 
         # 3. show interface ...
         if "interface" in cmd or "interfaces" in cmd: # Поддержка множественного числа
             
             # Если аргументов нет ("show interface"), показываем все
             if len(parts) == 2:
-                hardware_interfaces = ["FastEthernet0/0", "FastEthernet0/1"]
-                outputs = [self._generate_interface_detail(hw) for hw in hardware_interfaces]
-                return "\n".join(outputs)
+                for hw in self._hardware_interfaces():
+                    yield from self._generate_interface_detail(hw)
+                return
             
             # Если есть аргумент ("show interface fa0/0" или "show int desc")
             if len(parts) > 2:
@@ -659,10 +697,9 @@ class IOSCommandProcessor:
                 # А) Проверка на show interface description
                 if "description".startswith(raw_arg.lower()):
                     interfaces = self.device_data["config"].get("interfaces", {})
-                    header = f"{'Interface':<25} {'Status':<12} {'Protocol':<10} {'Description'}"
-                    lines = [header]
+                    yield f"{'Interface':<25} {'Status':<12} {'Protocol':<10} {'Description'}"
                     
-                    std_ifaces = ["FastEthernet0/0", "FastEthernet0/1"]
+                    std_ifaces = self._hardware_interfaces()
                     all_ifaces = sorted(list(set(std_ifaces) | set(interfaces.keys())))
 
                     for iface in all_ifaces:
@@ -671,25 +708,75 @@ class IOSCommandProcessor:
                         status_str = "up" if status == "up" else "admin down"
                         proto = "up" if status == "up" else "down"
                         desc = cfg.get("description", "")
-                        lines.append(f"{iface:<25} {status_str:<12} {proto:<10} {desc}")
-                        
-                    return "\n".join(lines)
+                        yield f"{iface:<25} {status_str:<12} {proto:<10} {desc}"
+                    return
 
                 # Б) Проверка на конкретный интерфейс
                 # Разворачиваем имя (fa0/1 -> FastEthernet0/1)
                 full_name = self._expand_interface_name(raw_arg)
                 
                 # Ищем точное совпадение среди доступных (case-insensitive)
-                hardware_interfaces = ["FastEthernet0/0", "FastEthernet0/1"]
+                hardware_interfaces = self._hardware_interfaces()
                 
                 for hw in hardware_interfaces:
                     if hw.lower() == full_name.lower():
-                        return self._generate_interface_detail(hw)
+                        yield from self._generate_interface_detail(hw)
+                        return
                 
-                return "% Invalid interface type and number"
+                yield "% Invalid interface type and number"
+                return
 
-        return "% Invalid input detected at '^' marker."
+        yield "% Invalid input detected at '^' marker."
     
+    def _generate_ip_route(self, address=None):
+        """show ip route: таблица из скомпилированного L3-состояния (network.DeviceTable)"""
+        table = self._network().table(self.session.virtual_config, self.device_name)
+
+        if address is not None:
+            value = ip_to_int(address)
+            if value is None:
+                yield MSG_INVALID_ARG
+                return
+            route = table.lookup(value)
+            if route is None or (route.prefix == 0 and value != 0):
+                yield "% Network not in table"
+                return
+            known = {"C": "connected", "L": "connected", "S": "static"}[route.kind]
+            yield f"Routing entry for {int_to_ip(route.network)}/{route.prefix}"
+            yield f'  Known via "{known}", distance {route.distance}, metric 0'
+            return
+
+        routes = table.routes()
+        yield "Codes: L - local, C - connected, S - static, R - RIP, M - mobile, B - BGP"
+        yield "       D - EIGRP, EX - EIGRP external, O - OSPF, IA - OSPF inter area"
+        yield "       * - candidate default, U - per-user static route"
+        yield ""
+        default = next((r for r in routes if r.prefix == 0), None)
+        if default is None:
+            yield "Gateway of last resort is not set"
+        else:
+            via = int_to_ip(default.next_hop) if default.next_hop is not None else default.iface
+            yield f"Gateway of last resort is {via} to network 0.0.0.0"
+        yield ""
+
+        # Группируем по классовой сети, как IOS: "10.0.0.0/8 is variably subnetted ..."
+        groups = {}
+        for route in routes:
+            groups.setdefault(_classful(route), []).append(route)
+        for (network, prefix), members in groups.items():
+            subnetted = len(members) > 1 or members[0].prefix != prefix
+            if subnetted:
+                masks = {r.prefix for r in members}
+                if len(masks) == 1:
+                    yield f"      {int_to_ip(network)}/{prefix} is subnetted, {len(members)} subnets"
+                else:
+                    yield (f"      {int_to_ip(network)}/{prefix} is variably subnetted, "
+                           f"{len(members)} subnets, {len(masks)} masks")
+            for route in members:
+                code = route.kind + ("*" if route.prefix == 0 else "")
+                column = 9 if subnetted else 6
+                yield f"{code:<{column}}{_describe_route(route)}"
+
     def _generate_interface_detail(self, iface_name):
         """Генерирует детальный вывод для show interface"""
         
@@ -710,174 +797,155 @@ class IOSCommandProcessor:
         mac_suffix = "01" if "0/0" in iface_name else "02"
         mac = f"0000.0000.00{mac_suffix}"
         
+        yield f"{iface_name} is {status}, line protocol is {proto} "
+        # Description
+        if "description" in specific_cfg:
+            yield f"  Description: {specific_cfg['description']}"
+
+        yield f"  Hardware is AmdFE, address is {mac} (bia {mac})"
         # IP адрес
-        ip_info = ""
         if "ip_address" in specific_cfg:
             ip = specific_cfg["ip_address"]
             mask = specific_cfg.get("mask", "255.255.255.0")
-            ip_info = f"\n  Internet address is {ip}/{mask}" # В реальности маска конвертируется в CIDR, но оставим так
-        
-        # Description
-        desc_str = ""
-        if "description" in specific_cfg:
-            desc_str = f"\n  Description: {specific_cfg['description']}"
-
-        return (
-            f"{iface_name} is {status}, line protocol is {proto} {desc_str}\n"
-            f"  Hardware is AmdFE, address is {mac} (bia {mac}){ip_info}\n"
-            f"  MTU 1500 bytes, BW 100000 Kbit, DLY 100 usec,\n"
-            f"     reliability 255/255, txload 1/255, rxload 1/255\n"
-            f"  Encapsulation ARPA, loopback not set\n"
-            f"  Keepalive set (10 sec)\n"
-            f"  Full-duplex, 100Mb/s, 100BaseTX/FX"
-        )
+            yield f"  Internet address is {ip}/{mask}" # В реальности маска конвертируется в CIDR, но оставим так
+
+        yield "  MTU 1500 bytes, BW 100000 Kbit, DLY 100 usec,"
+        yield "     reliability 255/255, txload 1/255, rxload 1/255"
+        yield "  Encapsulation ARPA, loopback not set"
+        yield "  Keepalive set (10 sec)"
+        yield "  Full-duplex, 100Mb/s, 100BaseTX/FX"
     def _generate_running_config(self):
-        """Генерирует ПОЛНЫЙ конфиг на основе состояния"""
+        """Генерирует ПОЛНЫЙ конфиг на основе состояния (по строке)"""
         c = self.device_data["config"]
         svcs = c.get("services", {})
-        lines = []
 
-        lines.append(f"Building configuration...\n")
-        lines.append(f"Current configuration : 1024 bytes")
-        lines.append("!")
-        lines.append("version 15.1")
+        yield "Building configuration..."
+        yield ""
+        yield f"Current configuration : 1024 bytes"
+        yield "!"
+        yield "version 15.1"
         
         # SERVICES
         # По умолчанию timestamps включены. Если False -> пишем no service ...
-        if not svcs.get("timestamps_log", True): lines.append("no service timestamps log datetime msec")
-        else: lines.append("service timestamps log datetime msec")
+        if not svcs.get("timestamps_log", True): yield "no service timestamps log datetime msec"
+        else: yield "service timestamps log datetime msec"
         
-        if not svcs.get("timestamps_debug", True): lines.append("no service timestamps debug datetime msec")
-        else: lines.append("service timestamps debug datetime msec")
+        if not svcs.get("timestamps_debug", True): yield "no service timestamps debug datetime msec"
+        else: yield "service timestamps debug datetime msec"
         
         # По умолчанию encryption выключено. Если True -> пишем service ...
-        if svcs.get("password-encryption", False): lines.append("service password-encryption")
-        else: lines.append("no service password-encryption")
+        if svcs.get("password-encryption", False): yield "service password-encryption"
+        else: yield "no service password-encryption"
         
-        lines.append("!")
-        lines.append(f"hostname {c.get('hostname', self.device_name)}")
-        lines.append("!")
-        lines.append("boot-start-marker")
-        lines.append("boot-end-marker")
-        lines.append("!")
+        yield "!"
+        yield f"hostname {c.get('hostname', self.device_name)}"
+        yield "!"
+        yield "boot-start-marker"
+        yield "boot-end-marker"
+        yield "!"
         
         # INTERFACES
         interfaces = c.get("interfaces", {})
-        std_ifaces = ["FastEthernet0/0", "FastEthernet0/1"]
+        std_ifaces = self._hardware_interfaces()
         all_ifaces = sorted(list(set(std_ifaces) | set(interfaces.keys())))
 
         for iface in all_ifaces:
             if_data = interfaces.get(iface, {})
-            lines.append(f"interface {iface}")
-            if "description" in if_data: lines.append(f" description {if_data['description']}")
+            yield f"interface {iface}"
+            if "description" in if_data: yield f" description {if_data['description']}"
             if "ip_address" in if_data:
-                lines.append(f" ip address {if_data['ip_address']} {if_data.get('mask', '255.255.255.0')}")
-            else: lines.append(" no ip address")
+                yield f" ip address {if_data['ip_address']} {if_data.get('mask', '255.255.255.0')}"
+            else: yield " no ip address"
             
-            lines.append(" duplex auto")
-            lines.append(" speed auto")
+            yield " duplex auto"
+            yield " speed auto"
             
-            if if_data.get("status") != "up": lines.append(" shutdown")
-            lines.append("!")
+            if if_data.get("status") != "up": yield " shutdown"
+            yield "!"
+
+        # STATIC ROUTES
+        routes = c.get("routes", {})
+        for entry in routes.values():
+            line = f"ip route {entry['network']} {entry['mask']} {entry.get('next_hop') or entry.get('iface')}"
+            if entry.get("distance"): line += f" {entry['distance']}"
+            yield line
+        if routes: yield "!"
 
         # LINES
         lines_cfg = c.get("lines", {})
         
         # Console 0
-        lines.append("line con 0")
+        yield "line con 0"
         con = lines_cfg.get("con 0", {})
-        if con.get("logging_sync"): lines.append(" logging synchronous")
-        if not con.get("login"): lines.append(" no login")
-        else: lines.append(" login")
-        if "password" in con: lines.append(f" password {con['password']}")
+        if con.get("logging_sync"): yield " logging synchronous"
+        if not con.get("login"): yield " no login"
+        else: yield " login"
+        if "password" in con: yield f" password {con['password']}"
 
         # VTY 0 4
-        lines.append("line vty 0 4")
+        yield "line vty 0 4"
         vty = lines_cfg.get("vty 0 4", {})
-        if vty.get("login"): lines.append(" login")
-        else: lines.append(" no login") # В лабе по дефолту no login для удобства
-        if "password" in vty: lines.append(f" password {vty['password']}")
+        if vty.get("login"): yield " login"
+        else: yield " no login" # В лабе по дефолту no login для удобства
+        if "password" in vty: yield f" password {vty['password']}"
         
         # VTY 5 15
-        lines.append("line vty 5 15")
+        yield "line vty 5 15"
         vty5 = lines_cfg.get("vty 5 15", {})
-        if vty5.get("login"): lines.append(" login")
-        else: lines.append(" no login")
+        if vty5.get("login"): yield " login"
+        else: yield " no login"
         
-        lines.append("!")
-        lines.append("end")
-        
-        return "\n".join(lines)
+        yield "!"
+        yield "end"
 
     def check_completion(self):
-        criteria = self.lab.success_criteria
-        if not criteria: return False
-
-        user_data = self.session.virtual_config
-
-        for dev_id, requirements in criteria.items():
-            # ... (код проверки критериев остается тем же) ...
-            dev_config = user_data.get(dev_id, {}).get("config", {})
-            
-            # 1. Проверка Hostname
-            req_hostname = requirements.get("hostname")
-            if req_hostname:
-                curr_hostname = dev_config.get("hostname", "")
-                if curr_hostname.lower() != req_hostname.lower():
-                    return False
-
-            # 2. Config Checks
-            checks = requirements.get("config_checks", [])
-            for check in checks:
-                path = check.get("path", [])
-                expected_value = str(check.get("value", "")).strip()
-                
-                current_val = dev_config
-                try:
-                    for key in path:
-                        current_val = current_val.get(key)
-                        if current_val is None: break
-                except AttributeError:
-                    current_val = None
-                
-                val_str = str(current_val).strip() if current_val else ""
-                
-                if val_str.lower() != expected_value.lower():
-                    return False
+        with span("grade"):
+            return self._check_completion()
+
+    def _check_completion(self):
+        evaluator = self.lab.evaluator
+        if not evaluator: return False
+
+        # Только проверки, зависящие от путей, которые тронула команда
+        # (новое устройство целиком считается измененным)
+        touched = {()} if self._device_created else self.touched_paths
+        failing = evaluate_session(self.session, evaluator, self._state_token,
+                                   device=self.device_name, touched_paths=touched)
+        if failing:
+            remember(self.session, evaluator, failing)
+            return False
 
         # === ЕСЛИ МЫ ТУТ, ЗНАЧИТ ВСЕ УСЛОВИЯ ВЫПОЛНЕНЫ ===
         
         # Если сессия УЖЕ была завершена ранее, не даем награду второй раз
+        # (параллельные проверки той же сессии отсекает уникальность RewardEntry)
         if not self.session.is_completed:
-            print(f"[SUCCESS] Lab completed! Awarding user.")
-            
-            self.session.is_completed = True
-            self.session.save()
-            
-            # НАЧИСЛЕНИЕ НАГРАДЫ
-            try:
-                profile = self.session.user.profile
-                profile.money += self.lab.reward_money
-                profile.xp += self.lab.reward_xp
-                
-                # === ЛОГИКА LEVEL UP ===
-                # Простая формула: Новый уровень каждые 100 XP
-                # Например: 0-99 (Lvl 1), 100-199 (Lvl 2), etc.
-                
-                # Рассчитываем новый уровень на основе XP
-                new_level = 1 + (profile.xp // 100)
-                
-                if new_level > profile.level:
-                    print(f"LEVEL UP! {profile.level} -> {new_level}")
-                    profile.level = new_level
-                    # Можно добавить бонус денег за левел ап
-                    profile.money += 50 * new_level 
-                
-                profile.save()
-                
-            except Exception as e:
-                print(f"Error awarding profile: {e}")
-                
+            self.session.mark_completed()
+            entry = self.session.award_completion(self.lab.reward_money, self.lab.reward_xp)
+            if entry is not None:
+                logger.info("Lab %s completed by user %s: +%s money, +%s xp%s", self.lab.id,
+                            self.session.user_id, entry.money, entry.xp,
+                            f", level up -> {entry.level}" if entry.level else "")
+
+        remember(self.session, evaluator, failing)
         return True
 
 
+def _classful(route):
+    """Классовая сеть маршрута (A/B/C) - заголовок группы в show ip route"""
+    first = route.network >> 24
+    prefix = 8 if first < 128 else 16 if first < 192 else 24
+    # Суперсети (и маршрут по умолчанию) печатаются сами по себе
+    if route.prefix < prefix: return route.network, route.prefix
+    return route.network & prefix_mask(prefix), prefix
+
+
+def _describe_route(route):
+    target = f"{int_to_ip(route.network)}/{route.prefix}"
+    if route.next_hop is None:
+        return f"{target} is directly connected, {route.iface}"
+    return f"{target} [{route.distance}/0] via {int_to_ip(route.next_hop)}"
+
+
+# Таблица команд собирается один раз из декораторов @command
+COMMANDS = CommandTable.from_class(IOSCommandProcessor)
@@ -0,0 +1,71 @@
+import random
+import threading
+from collections import OrderedDict
+
+# Сколько отрендеренных выводов show держим в процессе
+MAX_RENDERED = 4096
+# Вывод длиннее не кэшируется (он и так идет потоком, постранично - см. paging.py)
+MAX_CACHED_LINES = 2000
+
+
+def new_revision():
+    """
+    Стартовая ревизия конфига устройства. Дальше она только растет (+1 на изменение),
+    а случайная база не дает совпасть ревизиям после reset_state в другом процессе.
+    """
+    return random.getrandbits(48)
+
+
+class RenderCache:
+    """
+    Вывод show-команд по ключу (версия лабы, устройство, хэш конфига, команда) - см. digest.py.
+    Повторный show с тем же конфигом - у этого или любого другого студента - один lookup.
+    Устаревшие конфиги не удаляются явно: они просто вытесняются по LRU.
+    """
+
+    def __init__(self, limit=MAX_RENDERED, max_lines=MAX_CACHED_LINES):
+        self.limit = limit
+        self.max_lines = max_lines
+        self._items = OrderedDict()
+        # Кэш общий для потоков запросов (ASGI sync_to_async, WSGI-потоки)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """
+        Строки вывода: кортеж из кэша или ленивый итератор по генератору render().
+        Строки рендерятся по мере чтения (экран --More-- - только его строки); в кэш вывод
+        попадает, когда его дочитали до конца и в нем не больше max_lines строк.
+        """
+        with self._lock:
+            lines = self._items.get(key)
+            if lines is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return lines
+            self.misses += 1
+        return self._recording(key, render())
+
+    def _recording(self, key, stream):
+        head = []
+        for line in stream:
+            if head is not None:
+                head.append(line)
+                # Длинный вывод не кэшируем: память не растет с конфигом
+                if len(head) > self.max_lines: head = None
+            yield line
+        if head is not None: self._store(key, tuple(head))
+
+    def _store(self, key, lines):
+        with self._lock:
+            self._items[key] = lines
+            while len(self._items) > self.limit:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock: self._items.clear()
+
+
+# Один кэш на процесс, общий для всех сессий
+RENDERED = RenderCache()
@@ -0,0 +1,102 @@
+"""
+Кэш разобранных лаб (LabScenario) в памяти процесса.
+
+Команда терминала трогает лабу много раз: критерии, топология, список устройств.
+Вместо запроса session.lab и разбора JSON на каждую команду держим готовый
+LabDefinition по lab.id. Сбрасывается сигналом при сохранении лабы (edit_lab,
+админка); другие процессы сверяют updated_at не чаще раза в LAB_CACHE_TTL секунд.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .engine.baseconfig import build_base
+from .engine.grading import CriteriaEvaluator
+from .engine.network import Topology, as_dict
+
+MAX_CACHED_LABS = 256
+
+
+class LabDefinition:
+    """Неизменяемый снимок лабы для движка и вьюх"""
+    __slots__ = ("id", "title", "description", "min_level", "reward_money", "reward_xp", "updated_at",
+                 "allowed_devices", "node_types", "node_bases", "topology", "evaluator", "_bases")
+
+    def __init__(self, lab):
+        self.id = lab.id
+        self.title = lab.title
+        self.description = lab.description
+        self.min_level = lab.min_level
+        self.reward_money = lab.reward_money
+        self.reward_xp = lab.reward_xp
+        self.updated_at = lab.updated_at
+
+        self.allowed_devices = tuple(lab.allowed_devices or ())
+        # Защита от того, что JSONField вернулся как строка
+        topology_data = as_dict(lab.topology_data)
+        nodes = [node for node in topology_data.get("nodes", []) if isinstance(node, dict) and node.get("id")]
+        self.node_types = {node["id"]: node.get("type", "router") for node in nodes}
+        # Базовый конфиг от автора лабы: nodes[].base_config (поверх дефолта типа устройства)
+        self.node_bases = {node["id"]: node["base_config"] for node in nodes if isinstance(node.get("base_config"), dict)}
+        self._bases = {}
+        self.topology = Topology(topology_data)
+        self.evaluator = CriteriaEvaluator(lab.success_criteria)
+
+    def allows(self, device, default=("R1",)):
+        return device in (self.allowed_devices or default)
+
+    def device_type(self, device):
+        return self.node_types.get(device, "router")
+
+    def base_config(self, device):
+        """Общий для всех сессий базовый конфиг устройства (не менять: см. engine/baseconfig.py)"""
+        base = self._bases.get(device)
+        if base is None:
+            base = self._bases[device] = build_base(device, self.device_type(device), self.node_bases.get(device))
+        return base
+
+    def __str__(self):
+        return self.title
+
+
+# lab.id -> [LabDefinition, время последней сверки с БД]. Общий для потоков - только под _lock
+_labs = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_lab(lab_id):
+    """Разобранная лаба; в БД ходим только при промахе или раз в LAB_CACHE_TTL за updated_at"""
+    from .models import LabScenario
+
+    with _lock:
+        entry = _labs.get(lab_id)
+        if entry is not None: _labs.move_to_end(lab_id)
+    now = time.monotonic()
+    if entry is not None:
+        if now - entry[1] < settings.LAB_CACHE_TTL:
+            return entry[0]
+        # Лабу могли отредактировать в другом процессе - сверяем только версию
+        version = LabScenario.objects.filter(id=lab_id).values_list("updated_at", flat=True).first()
+        if version == entry[0].updated_at:
+            entry[1] = now
+            return entry[0]
+
+    definition = LabDefinition(LabScenario.objects.get(id=lab_id))
+    with _lock:
+        _labs[lab_id] = [definition, now]
+        _labs.move_to_end(lab_id)
+        while len(_labs) > MAX_CACHED_LABS:
+            _labs.popitem(last=False)
+    return definition
+
+
+def invalidate_lab(lab_id=None):
+    with _lock:
+        if lab_id is None: _labs.clear()
+        else: _labs.pop(lab_id, None)
+
+
+def on_lab_changed(sender, instance, **kwargs):
+    invalidate_lab(instance.id)
@@ -0,0 +1,179 @@
+"""
+Нагрузочный прогон HTTP API лабы: N студентов одновременно заходят в лабу и работают в терминале.
+
+Каждый виртуальный студент - отдельный поток со своими cookie: логин, офис, список лаб,
+рабочее место, дальше команды с паузами "на подумать", вставки конфигов пачкой,
+переключение устройств. Сервер запускается отдельно (runserver/gunicorn/uvicorn),
+инструмент ходит в него по HTTP, как браузер.
+Запуск: python manage.py load_lab (см. management/commands/load_lab.py).
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from .benchmark import ABBREVIATIONS, CONTEXTS, percentile, running_config
+
+LOCKED = "database is locked"
+COMMANDS = ABBREVIATIONS + CONTEXTS + ["sh ip route", "sh run", "?"]
+
+
+# --- СТАТИСТИКА ---
+
+class Recorder:
+    """Общий для потоков сборщик: задержки по эндпоинтам, ошибки, блокировки SQLite"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locked = defaultdict(int)
+
+    def add(self, endpoint, elapsed, ok, locked=False):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok: self.errors[endpoint] += 1
+            if locked: self.locked[endpoint] += 1
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        total = 0
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "locked": self.locked[endpoint],
+                "rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0,
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2) if values else 0,
+            }
+        return {
+            "seconds": round(wall_seconds, 2),
+            "requests": total,
+            "rps": round(total / wall_seconds, 2) if wall_seconds else 0,
+            "errors": sum(self.errors.values()),
+            "locked": sum(self.locked.values()),
+            "endpoints": endpoints,
+        }
+
+
+# --- ВИРТУАЛЬНЫЙ СТУДЕНТ ---
+
+class Student:
+    """
+    Один студент со своей cookie-сессией.
+    paths - готовые URL (reverse() делает команда, здесь Django не нужен).
+    """
+
+    def __init__(self, base_url, username, password, paths, devices, recorder, rng, options):
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.paths = paths
+        self.devices = devices
+        self.recorder = recorder
+        self.rng = rng
+        self.options = options
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def request(self, endpoint, path, data=None, json_body=None):
+        url = self.base_url + path
+        headers = {"Referer": url}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif data is not None:
+            data = urllib.parse.urlencode(data).encode()
+
+        started = time.perf_counter()
+        status, body = 0, ""
+        try:
+            with self.opener.open(urllib.request.Request(url, data=data, headers=headers),
+                                  timeout=self.options["timeout"]) as response:
+                status, body = response.status, response.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read().decode("utf-8", "replace")
+        except (urllib.error.URLError, OSError) as e:
+            body = str(e)
+        elapsed = time.perf_counter() - started
+
+        self.recorder.add(endpoint, elapsed, 200 <= status < 400, locked=LOCKED in body)
+        return status, body
+
+    def think(self):
+        # Экспоненциальная пауза: в основном короткие, иногда студент надолго задумывается
+        mean = self.options["think"]
+        if mean > 0: time.sleep(min(self.rng.expovariate(1 / mean), mean * 10))
+
+    def login(self, attempts=3):
+        """Как живой студент: не пустило (таймаут, 500) - пробуем еще раз"""
+        for _ in range(attempts):
+            self.request("login_form", self.paths["login"])
+            token = next((c.value for c in self.cookies if c.name == "csrftoken"), "")
+            self.request("login", self.paths["login"], data={
+                "username": self.username, "password": self.password, "csrfmiddlewaretoken": token,
+            })
+            if any(c.name == "sessionid" for c in self.cookies): return True
+        return False
+
+    def run(self, duration):
+        if not self.login(): return
+        self.request("office", self.paths["office"])
+        self.request("lab_list", self.paths["lab_list"])
+        self.request("lab_workspace", self.paths["workspace"])
+
+        # Время работы в терминале отсчитываем после входа: логины всем классом
+        # (хэш пароля) сами по себе долгие и не должны съедать весь прогон
+        deadline = time.monotonic() + duration
+        paste_every = self.options["paste_every"]
+        while time.monotonic() < deadline:
+            self.think()
+            roll = self.rng.random()
+            if paste_every and self.rng.randrange(paste_every) == 0:
+                lines = running_config(self.options["paste_size"] // 6 + 1)
+                self.request("send_batch", self.paths["batch"], json_body={"commands": lines})
+            elif roll < 0.05 and len(self.devices) > 1:
+                device = self.rng.choice(self.devices)
+                self.request("switch_device", self.paths["switch"].format(device=device))
+            elif roll < 0.08:
+                self.request("lab_workspace", self.paths["workspace"])
+            elif roll < 0.10:
+                self.request("office", self.paths["office"])
+            elif roll < 0.11:
+                self.request("lab_list", self.paths["lab_list"])
+            else:
+                self.request("send_command", self.paths["command"], json_body={"command": self.rng.choice(COMMANDS)})
+
+
+def run_load(students, duration, ramp=0.0):
+    """Запускает студентов потоками; ramp - за сколько секунд подключаются все (0 = разом, как начало пары)"""
+    threads = []
+    started = time.perf_counter()
+    for i, student in enumerate(students):
+        thread = threading.Thread(target=student.run, args=(duration,), daemon=True)
+        threads.append(thread)
+        if ramp and i: time.sleep(ramp / len(students))
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def make_students(base_url, accounts, devices, options, seed=0):
+    """accounts - [(username, password, paths)]"""
+    recorder = Recorder()
+    students = [
+        Student(base_url, username, password, paths, devices, recorder, random.Random(seed + i), options)
+        for i, (username, password, paths) in enumerate(accounts)
+    ]
+    return students, recorder
@@ -0,0 +1,131 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.labs.benchmark import PHASES, SCENARIOS, micro_grammar, run_scenario, transcript_scenario
+from apps.labs.models import LabScenario, UserLabSession
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк движка лабы: p50/p95/p99 по фазам, результат в JSON для сравнения между коммитами"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                            help="Сценарий (можно несколько). По умолчанию - все")
+        parser.add_argument("--transcript", action="append", default=[],
+                            help="Файл с записанными командами (#device R2, #paste ... #end)")
+        parser.add_argument("--lab", type=int, help="ID лабы (по умолчанию - первая в БД)")
+        parser.add_argument("--commands", type=int, default=500, help="Команд на сценарий")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--db", action="store_true",
+                            help="Настоящая UserLabSession (загрузка и запись через БД, откатывается в конце)")
+        parser.add_argument("--alloc", action="store_true", help="Пиковая память на команду (tracemalloc, медленнее)")
+        parser.add_argument("--output", help="Куда сохранить JSON (по умолчанию bench-<время>.json)")
+        parser.add_argument("--compare", help="JSON прошлого прогона: показать изменение p50/p95")
+        parser.add_argument("--micro", type=int, metavar="ITERATIONS", nargs="?", const=3000,
+                            help="Только микробенчмарк разбора команд (среднее на команду, без JSON)")
+
+    def handle(self, *args, **options):
+        lab = self._lab(options["lab"])
+        if options["micro"]:
+            result = micro_grammar(lab.id, options["micro"])
+            for name, mean_us in result.items():
+                self.stdout.write(f"{name:<22} {mean_us:>10} us")
+            return
+        scenarios = {name: SCENARIOS[name] for name in (options["scenario"] or sorted(SCENARIOS))}
+        for path in options["transcript"]:
+            scenarios[f"transcript:{path}"] = transcript_scenario(path)
+
+        results = {}
+        for name, scenario in scenarios.items():
+            self.stdout.write(f"Running {name} ...")
+            results[name] = self._run(scenario, lab, options)
+
+        report = {
+            "meta": {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "commit": self._git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "lab": lab.id,
+                "mode": "db" if options["db"] else "memory",
+                "commands": options["commands"],
+                "seed": options["seed"],
+            },
+            "scenarios": results,
+        }
+
+        self._print(results, self._load(options["compare"]) if options["compare"] else None)
+
+        output = options["output"] or f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(output, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Saved {output}"))
+
+    def _lab(self, lab_id):
+        qs = LabScenario.objects.all()
+        lab = qs.filter(id=lab_id).first() if lab_id else qs.order_by("id").first()
+        if lab is None: raise CommandError("Нет лабы для бенчмарка (создайте LabScenario или укажите --lab)")
+        return lab
+
+    def _run(self, scenario, lab, options):
+        kwargs = dict(count=options["commands"], seed=options["seed"], track_allocations=options["alloc"])
+        if not options["db"]:
+            return run_scenario(scenario, lab.id, **kwargs)
+
+        # Как во вьюхе: на каждую команду сессия читается из БД заново
+        with transaction.atomic():
+            user, _ = User.objects.get_or_create(username="__bench__")
+            session = UserLabSession.objects.create(user=user, lab=lab)
+
+            def load(device):
+                row = UserLabSession.objects.get(id=session.id)
+                row.current_device = device
+                return row
+
+            result = run_scenario(scenario, lab.id, session_factory=load, **kwargs)
+            transaction.set_rollback(True)
+        return result
+
+    def _print(self, results, previous):
+        header = f"{'scenario':<22} {'phase':<10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10}"
+        if previous: header += f" {'Δp50':>8} {'Δp95':>8}"
+        self.stdout.write(header)
+        for name, result in results.items():
+            for phase in PHASES + ("total",):
+                stats = result[phase]
+                line = f"{name[:22]:<22} {phase:<10} {stats['p50_us']:>10} {stats['p95_us']:>10} {stats['p99_us']:>10}"
+                before = (previous or {}).get(name, {}).get(phase)
+                if before:
+                    line += f" {self._delta(before['p50_us'], stats['p50_us']):>8} {self._delta(before['p95_us'], stats['p95_us']):>8}"
+                self.stdout.write(line)
+            if "peak_alloc_bytes" in result:
+                alloc = result["peak_alloc_bytes"]
+                self.stdout.write(f"{name[:22]:<22} {'alloc':<10} {alloc['p50']:>10} {alloc['p95']:>10} {alloc['max']:>10}")
+
+    @staticmethod
+    def _delta(before, after):
+        if not before: return "-"
+        return f"{(after - before) / before * 100:+.0f}%"
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, encoding="utf-8") as fh:
+                return json.load(fh).get("scenarios", {})
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Не удалось прочитать {path}: {e}")
+
+    @staticmethod
+    def _git_commit():
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                  text=True, timeout=5).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
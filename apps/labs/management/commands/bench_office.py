@@ -0,0 +1,91 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.labs.models import LabScenario, PlayerProgress, UserLabSession
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк главной (офис, список лаб) на большом каталоге: старые запросы против PlayerProgress"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--labs", type=int, default=10000)
+        parser.add_argument("--sessions", type=int, default=100000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--heavy", type=int, default=3000, help="Сессий у самого активного игрока")
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        # Все данные создаются в транзакции и откатываются в конце
+        with transaction.atomic():
+            heavy, regular = self._populate(options)
+            for title, user in (("heavy user", heavy), ("regular user", regular)):
+                self.stdout.write(f"--- {title}: {UserLabSession.objects.filter(user=user).count()} sessions")
+                self._report("office (old)", lambda: self._office_old(user), options["repeat"])
+                self._report("office (progress)", lambda: self._office_new(user), options["repeat"])
+                self._report("lab_list ids (old)", lambda: self._lab_ids_old(user), options["repeat"])
+                self._report("lab_list ids (progress)", lambda: self._lab_ids_new(user), options["repeat"])
+            transaction.set_rollback(True)
+
+    def _populate(self, options):
+        self.stdout.write(f"Creating {options['labs']} labs, {options['sessions']} sessions, {options['users']} users ...")
+        LabScenario.objects.bulk_create([
+            LabScenario(title=f"bench lab {i}", description="", min_level=1 + i % 20)
+            for i in range(options["labs"])
+        ], batch_size=1000)
+        lab_ids = list(LabScenario.objects.values_list("id", flat=True))
+
+        password = make_password(None)
+        User.objects.bulk_create([User(username=f"__office_{i}", password=password)
+                                  for i in range(options["users"])], batch_size=1000)
+        users = list(User.objects.filter(username__startswith="__office_").order_by("id"))
+        heavy, regular = users[0], users[1]
+
+        sessions = [UserLabSession(user=heavy, lab_id=lab_ids[i], is_completed=i % 3 != 0)
+                    for i in range(min(options["heavy"], len(lab_ids)))]
+        rest = max(0, options["sessions"] - len(sessions))
+        per_user = max(1, rest // max(1, len(users) - 1))
+        for n, user in enumerate(users[1:]):
+            for i in range(per_user):
+                sessions.append(UserLabSession(user=user, lab_id=lab_ids[(n * 7 + i * 13) % len(lab_ids)],
+                                               is_completed=i % 4 != 0))
+        UserLabSession.objects.bulk_create(sessions, batch_size=2000)
+
+        PlayerProgress.rebuild(heavy.id)
+        PlayerProgress.rebuild(regular.id)
+        return heavy, regular
+
+    # Как было до PlayerProgress (apps/game/views.py: office, apps/labs/views.py: lab_list)
+    def _office_old(self, user):
+        active = UserLabSession.objects.filter(user=user, is_completed=False).first()
+        excluded = UserLabSession.objects.filter(user=user).values_list("lab_id", flat=True)
+        inbox = list(LabScenario.objects.filter(min_level__lte=10).exclude(id__in=excluded))
+        return active, inbox
+
+    def _office_new(self, user):
+        progress = PlayerProgress.for_user(user)
+        inbox = list(LabScenario.objects.filter(min_level__lte=10).exclude(id__in=progress.started)
+                     .order_by("id")[:settings.LAB_INBOX_LIMIT])
+        return progress.active_session, inbox
+
+    def _lab_ids_old(self, user):
+        return set(UserLabSession.objects.filter(user=user).values_list("lab_id", flat=True))
+
+    def _lab_ids_new(self, user):
+        return PlayerProgress.for_user(user).started_set
+
+    def _report(self, name, func, repeat):
+        func()   # прогрев
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        self.stdout.write(f"{name:<26} p50 {statistics.median(samples):8.2f} ms   "
+                          f"p95 {samples[int(len(samples) * 0.95) - 1]:8.2f} ms")
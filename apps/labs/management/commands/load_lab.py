@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from apps.game.models import PlayerProfile
+from apps.labs.lab_cache import get_lab
+from apps.labs.loadtest import make_students, run_load
+from apps.labs.models import ConsoleEntry, LabScenario, SessionMutation, UserLabSession
+
+USER_PREFIX = "load_"
+PASSWORD = "load-test-password"
+
+
+class Command(BaseCommand):
+    help = "Нагрузка на HTTP API лабы: N студентов против запущенного сервера (начало пары на одной машине)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Адрес запущенного сервера")
+        parser.add_argument("--users", type=int, default=200, help="Сколько студентов (потоков) одновременно")
+        parser.add_argument("--duration", type=float, default=60, help="Секунд работы в терминале (после входа каждого студента)")
+        parser.add_argument("--ramp", type=float, default=0, help="За сколько секунд подключаются все (0 = разом)")
+        parser.add_argument("--think", type=float, default=2.0, help="Средняя пауза между действиями, сек")
+        parser.add_argument("--paste-every", type=int, default=30,
+                            help="Вставка конфига примерно раз в N действий (0 - без вставок)")
+        parser.add_argument("--paste-size", type=int, default=60, help="Строк во вставке")
+        parser.add_argument("--timeout", type=float, default=30, help="Таймаут запроса, сек")
+        parser.add_argument("--lab", type=int, help="ID лабы (по умолчанию - первая в БД)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Сохранить результат в JSON")
+        parser.add_argument("--cleanup", action="store_true",
+                            help=f"Удалить пользователей {USER_PREFIX}* и их сессии и выйти")
+
+    def handle(self, *args, **options):
+        if options["cleanup"]:
+            deleted, _ = User.objects.filter(username__startswith=USER_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} rows"))
+            return
+
+        lab = self._lab(options["lab"])
+        accounts = self._accounts(lab, options["users"])
+        devices = list(get_lab(lab.id).allowed_devices or ("R1",))
+
+        students, recorder = make_students(options["url"], accounts, devices, {
+            "think": options["think"],
+            "paste_every": options["paste_every"],
+            "paste_size": options["paste_size"],
+            "timeout": options["timeout"],
+        }, seed=options["seed"])
+
+        self.stdout.write(f"{len(students)} students on lab {lab.id} -> {options['url']} for {options['duration']}s")
+        before = self._db_volume()
+        wall = run_load(students, options["duration"], ramp=options["ramp"])
+        after = self._db_volume()
+
+        report = recorder.report(wall)
+        report["db_writes"] = {name: after[name] - before[name] for name in before}
+        report["meta"] = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "url": options["url"],
+            "users": options["users"],
+            "lab": lab.id,
+            "think": options["think"],
+            "paste_every": options["paste_every"],
+        }
+        self._print(report)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fh:
+                json.dump(report, fh, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Saved {options['output']}"))
+
+    def _lab(self, lab_id):
+        qs = LabScenario.objects.all()
+        lab = qs.filter(id=lab_id).first() if lab_id else qs.order_by("id").first()
+        if lab is None: raise CommandError("Нет лабы для нагрузки (создайте LabScenario или укажите --lab)")
+        return lab
+
+    def _accounts(self, lab, count):
+        """Пользователи load_N с профилем и сессией на лабе; пароль хэшируем один раз на всех"""
+        password = make_password(PASSWORD)
+        names = [f"{USER_PREFIX}{i}" for i in range(count)]
+        existing = set(User.objects.filter(username__in=names).values_list("username", flat=True))
+        User.objects.bulk_create([User(username=name, password=password) for name in names if name not in existing])
+
+        users = list(User.objects.filter(username__in=names).order_by("id"))
+        with_profile = set(PlayerProfile.objects.filter(user__in=users).values_list("user_id", flat=True))
+        PlayerProfile.objects.bulk_create([PlayerProfile(user=u) for u in users if u.id not in with_profile])
+
+        accounts = []
+        for user in users:
+            session, _ = UserLabSession.start(user, lab)
+            accounts.append((user.username, PASSWORD, {
+                "login": reverse("login"),
+                "office": reverse("office"),
+                "lab_list": reverse("lab_list"),
+                "workspace": reverse("lab_workspace", args=[session.id]),
+                "command": reverse("send_command", args=[session.id]),
+                "batch": reverse("send_batch", args=[session.id]),
+                # имя устройства подставляет студент
+                "switch": reverse("switch_device", args=[session.id, "DEVICE"]).replace("DEVICE", "{device}"),
+            }))
+        return accounts
+
+    def _db_volume(self):
+        """Строки журнала/консоли и размер файлов SQLite (с -wal) - сколько записала нагрузка"""
+        volume = {
+            "mutations": SessionMutation.objects.count(),
+            "console_entries": ConsoleEntry.objects.count(),
+            "file_bytes": 0,
+        }
+        name = str(settings.DATABASES["default"]["NAME"])
+        for path in (name, name + "-wal", name + "-journal"):
+            if os.path.exists(path): volume["file_bytes"] += os.path.getsize(path)
+        return volume
+
+    def _print(self, report):
+        self.stdout.write(f"{'endpoint':<16} {'req':>7} {'err':>6} {'locked':>7} {'rps':>8} "
+                          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, row in report["endpoints"].items():
+            self.stdout.write(f"{name:<16} {row['requests']:>7} {row['errors']:>6} {row['locked']:>7} {row['rps']:>8} "
+                              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+        self.stdout.write(f"total: {report['requests']} requests in {report['seconds']}s ({report['rps']} req/s), "
+                          f"{report['errors']} errors, {report['locked']} 'database is locked'")
+        writes = report["db_writes"]
+        self.stdout.write(f"db writes: +{writes['mutations']} mutations, +{writes['console_entries']} console rows, "
+                          f"+{writes['file_bytes']} bytes on disk")
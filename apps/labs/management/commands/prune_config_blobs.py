@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from apps.labs.models import ConfigBlob
+
+
+class Command(BaseCommand):
+    help = "Удаляет состояния устройств (ConfigBlob), на которые не ссылается ни один чекпоинт или шаг отмены"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Removed {ConfigBlob.prune()} unreferenced blobs")
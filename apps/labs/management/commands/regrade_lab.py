@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.labs.models import LabScenario
+from apps.labs.regrade import regrade_lab
+
+
+class Command(BaseCommand):
+    help = "Перепроверка незавершенных сессий лабы по текущим success_criteria и base_config (пул процессов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("lab_ids", nargs="*", type=int, help="id лаб (по умолчанию - все)")
+        parser.add_argument("--workers", type=int, default=None, help="Процессов в пуле (по умолчанию LAB_REGRADE_WORKERS)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Сессий на задачу пула")
+
+    def handle(self, *args, **options):
+        lab_ids = options["lab_ids"] or list(LabScenario.objects.order_by("id").values_list("id", flat=True))
+        missing = set(lab_ids) - set(LabScenario.objects.filter(id__in=lab_ids).values_list("id", flat=True))
+        if missing: raise CommandError(f"Unknown lab id(s): {', '.join(map(str, sorted(missing)))}")
+
+        for lab_id in lab_ids:
+            state = regrade_lab(lab_id, workers=options["workers"], chunk_size=options["chunk_size"],
+                                progress=self._progress(lab_id))
+            self.stdout.write(f"lab {lab_id}: {state['completed']} of {state['total']} open sessions "
+                              f"completed in {state['seconds']:.2f}s")
+
+    def _progress(self, lab_id):
+        def report(state):
+            if not state["total"]: return
+            self.stderr.write(f"\r  lab {lab_id}: {state['checked']}/{state['total']} checked, "
+                              f"{state['completed']} completed", ending="")
+            if state["checked"] == state["total"]: self.stderr.write("")
+        return report
@@ -0,0 +1,177 @@
+"""
+Метрики движка лабы в памяти процесса + вывод в текстовом формате Prometheus.
+
+    lab_request_seconds{endpoint}          - запрос целиком (timed_view)
+    lab_requests_total{endpoint, status}
+    lab_span_seconds{endpoint, span}       - участки: parse, load, processor, normalize,
+                                             dispatch, render, grade, save (вложенные не вычитаются)
+    lab_command_seconds{family, lab}       - одна строка терминала по семействам команд
+                                             ("show ip route", "ip address", "help", "invalid")
+
+Смотреть: /lab/metrics/ (staff или Authorization: Bearer LAB_METRICS_TOKEN).
+Каждый процесс считает свое - Prometheus суммирует по инстансам.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+# Границы корзин гистограмм, сек (как в клиентах Prometheus, плюс мелкие для движка)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    "lab_request_seconds": ("histogram", "Lab HTTP/WebSocket request latency"),
+    "lab_requests_total": ("counter", "Lab requests by endpoint and status"),
+    "lab_span_seconds": ("histogram", "Time spent in engine stages (inclusive)"),
+    "lab_command_seconds": ("histogram", "Terminal line latency by command family and lab"),
+}
+
+# Какой эндпоинт сейчас обслуживается (метка для span)
+_endpoint = ContextVar("lab_endpoint", default="other")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # (имя, ((метка, значение), ...)) -> Histogram
+        self._counters = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None: histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self, extra=()):
+        """Текстовый формат Prometheus 0.0.4; extra - [(имя, тип, help, значение)] без меток"""
+        with self._lock:
+            histograms = [(key, h.counts[:], h.sum, h.count) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+
+        lines, seen = [], set()
+
+        def header(name):
+            if name in seen: return
+            seen.add(name)
+            kind, text = HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters):
+            header(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), counts, total, count in sorted(histograms, key=lambda item: item[0]):
+            header(name)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, kind, text, value in extra:
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels: return ""
+    body = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+
+# --- ЗАМЕРЫ ---
+
+@contextmanager
+def span(name):
+    """Участок горячего пути: with span("dispatch"): ..."""
+    if not settings.LAB_METRICS:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe("lab_span_seconds", time.perf_counter() - started, endpoint=_endpoint.get(), span=name)
+
+
+def observe_command(family, lab_id, seconds):
+    if settings.LAB_METRICS:
+        REGISTRY.observe("lab_command_seconds", seconds, family=family, lab=lab_id)
+
+
+@contextmanager
+def request_timer(endpoint):
+    """Запрос целиком + метка endpoint для вложенных span (WebSocket-терминал и т.п.)"""
+    token = _endpoint.set(endpoint)
+    started = time.perf_counter()
+    status = {"code": "500"}   # исключение во вьюхе Django превратит в 500
+    try:
+        yield status
+    finally:
+        _endpoint.reset(token)
+        if settings.LAB_METRICS:
+            REGISTRY.observe("lab_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            REGISTRY.inc("lab_requests_total", endpoint=endpoint, status=status["code"])
+
+
+def timed_view(endpoint):
+    """Декоратор вьюхи: время запроса и счетчик по статусу ответа"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with request_timer(endpoint) as status:
+                response = view(request, *args, **kwargs)
+                status["code"] = str(response.status_code)
+                return response
+        return wrapper
+    return decorator
+
+
+def process_metrics():
+    """Счетчики кэшей и писателя этого процесса (добавляются к выводу /lab/metrics/)"""
+    from .engine.render import RENDERED
+    from .writer import WRITER
+    return [
+        ("lab_render_cache_hits_total", "counter", "show output served from the render cache", RENDERED.hits),
+        ("lab_render_cache_misses_total", "counter", "show output rendered", RENDERED.misses),
+        ("lab_writer_batches_total", "counter", "Transactions committed by the session writer", WRITER.batches),
+        ("lab_writer_jobs_total", "counter", "Write jobs committed by the session writer", WRITER.jobs),
+    ]
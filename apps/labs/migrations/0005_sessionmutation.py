@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0004_labscenario_min_level'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionMutation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device', models.CharField(max_length=10)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mutations', to='labs.userlabsession')),
+            ],
+        ),
+    ]
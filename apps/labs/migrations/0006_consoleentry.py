@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_console_logs(apps, schema_editor):
+    """console_logs/history из virtual_config и журнала мутаций -> ConsoleEntry"""
+    UserLabSession = apps.get_model('labs', 'UserLabSession')
+    SessionMutation = apps.get_model('labs', 'SessionMutation')
+    ConsoleEntry = apps.get_model('labs', 'ConsoleEntry')
+
+    for session in UserLabSession.objects.all().iterator():
+        entries = []
+
+        def collect(device, logs):
+            for log in logs:
+                entries.append(ConsoleEntry(
+                    session=session, device=device, kind=log.get('type', 'out'),
+                    text=log.get('text', ''), prompt=log.get('prompt', ''),
+                ))
+
+        changed = False
+        for device, dev_data in session.virtual_config.items():
+            collect(device, dev_data.pop('console_logs', []))
+            changed = dev_data.pop('history', None) is not None or changed
+        if entries or changed:
+            session.save(update_fields=['virtual_config'])
+
+        # Несвернутые мутации: строки консоли идут после снимка
+        for mutation in SessionMutation.objects.filter(session=session).order_by('id'):
+            appended = mutation.payload.pop('append', None)
+            if appended is None: continue
+            collect(mutation.device, appended.get('console_logs', []))
+            mutation.save(update_fields=['payload'])
+
+        ConsoleEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0005_sessionmutation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsoleEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device', models.CharField(max_length=10)),
+                ('kind', models.CharField(default='out', max_length=3)),
+                ('text', models.TextField(blank=True, default='')),
+                ('prompt', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='console_entries', to='labs.userlabsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'device', 'id'], name='labs_consol_session_685f74_idx')],
+            },
+        ),
+        migrations.RunPython(move_console_logs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0006_consoleentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labscenario',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
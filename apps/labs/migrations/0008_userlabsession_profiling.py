@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0007_labscenario_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userlabsession',
+            name='profiling',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('labs', '0008_userlabsession_profiling'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerProgress',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lab_progress', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('started', models.JSONField(default=list)),
+                ('completed', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='labscenario',
+            index=models.Index(fields=['min_level', 'id'], name='labs_labsce_min_lev_f826d0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlabsession',
+            index=models.Index(fields=['user', 'is_completed'], name='labs_userla_user_id_bfcaac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userlabsession',
+            index=models.Index(fields=['user', 'lab'], name='labs_userla_user_id_de6e2c_idx'),
+        ),
+        migrations.AddField(
+            model_name='playerprogress',
+            name='active_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='labs.userlabsession'),
+        ),
+    ]
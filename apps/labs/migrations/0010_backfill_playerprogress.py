@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    """PlayerProgress для всех, у кого уже есть сессии (остальным создастся при первом заходе)"""
+    UserLabSession = apps.get_model('labs', 'UserLabSession')
+    PlayerProgress = apps.get_model('labs', 'PlayerProgress')
+
+    progress = {}
+    rows = UserLabSession.objects.order_by('id').values_list('id', 'user_id', 'lab_id', 'is_completed')
+    for session_id, user_id, lab_id, done in rows.iterator():
+        entry = progress.setdefault(user_id, {'started': set(), 'completed': set(), 'active': None})
+        entry['started'].add(lab_id)
+        if done: entry['completed'].add(lab_id)
+        elif entry['active'] is None: entry['active'] = session_id
+
+    PlayerProgress.objects.bulk_create([
+        PlayerProgress(user_id=user_id, started=sorted(e['started']), completed=sorted(e['completed']),
+                       active_session_id=e['active'])
+        for user_id, e in progress.items()
+    ], batch_size=500)
+
+
+def clear(apps, schema_editor):
+    apps.get_model('labs', 'PlayerProgress').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0009_playerprogress'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, clear),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Уже завершенные сессии: награда за них была выдана по-старому, повторно не начисляем"""
+    UserLabSession = apps.get_model('labs', 'UserLabSession')
+    RewardEntry = apps.get_model('labs', 'RewardEntry')
+
+    rows = (UserLabSession.objects.filter(is_completed=True).order_by('id')
+            .values_list('id', 'user_id', 'lab_id', 'lab__reward_money', 'lab__reward_xp'))
+    RewardEntry.objects.bulk_create([
+        RewardEntry(session_id=session_id, user_id=user_id, lab_id=lab_id, money=money, xp=xp)
+        for session_id, user_id, lab_id, money, xp in rows.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0010_backfill_playerprogress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('money', models.IntegerField(default=0)),
+                ('xp', models.IntegerField(default=0)),
+                ('level', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lab', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='labs.labscenario')),
+                ('session', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reward', to='labs.userlabsession')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lab_rewards', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
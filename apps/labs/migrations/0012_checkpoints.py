@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0011_rewardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigBlob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SessionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(default='named', max_length=5)),
+                ('name', models.CharField(blank=True, default='', max_length=100)),
+                ('devices', models.JSONField(default=dict)),
+                ('current_device', models.CharField(blank=True, default='', max_length=10)),
+                ('shared', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='labs.userlabsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session', 'kind', 'id'], name='labs_sessio_session_82bded_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CURSOR_FIELDS = ('current_iface', 'current_line', 'editing_policy_id', 'rev')
+
+
+def split_virtual_config(apps, schema_editor):
+    """virtual_config сессии -> строка DeviceState на устройство (остатки history/логов не переносим)"""
+    UserLabSession = apps.get_model('labs', 'UserLabSession')
+    DeviceState = apps.get_model('labs', 'DeviceState')
+
+    rows = []
+    sessions = UserLabSession.objects.exclude(virtual_config={}).values_list('id', 'virtual_config')
+    for session_id, virtual_config in sessions.iterator(chunk_size=2000):
+        for device, data in (virtual_config or {}).items():
+            if not isinstance(data, dict): continue
+            rows.append(DeviceState(session_id=session_id, device=device, config=data.get('config') or {},
+                                    context=data.get('context') or 'privileged',
+                                    **{name: data.get(name) for name in CURSOR_FIELDS}))
+        if len(rows) >= 2000:
+            DeviceState.objects.bulk_create(rows)
+            rows = []
+    DeviceState.objects.bulk_create(rows)
+
+
+def join_virtual_config(apps, schema_editor):
+    UserLabSession = apps.get_model('labs', 'UserLabSession')
+    DeviceState = apps.get_model('labs', 'DeviceState')
+
+    configs = {}
+    for row in DeviceState.objects.all().iterator(chunk_size=2000):
+        data = {'config': row.config, 'context': row.context}
+        data.update({name: getattr(row, name) for name in CURSOR_FIELDS if getattr(row, name) is not None})
+        configs.setdefault(row.session_id, {})[row.device] = data
+    for session_id, virtual_config in configs.items():
+        UserLabSession.objects.filter(id=session_id).update(virtual_config=virtual_config)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labs', '0012_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device', models.CharField(max_length=10)),
+                ('config', models.JSONField(default=dict)),
+                ('context', models.CharField(default='privileged', max_length=30)),
+                ('current_iface', models.CharField(blank=True, max_length=50, null=True)),
+                ('current_line', models.CharField(blank=True, max_length=20, null=True)),
+                ('editing_policy_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('rev', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sessionmutation',
+            index=models.Index(fields=['session', 'device', 'id'], name='labs_sessio_session_d94cb1_idx'),
+        ),
+        migrations.AddField(
+            model_name='devicestate',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='devices', to='labs.userlabsession'),
+        ),
+        migrations.AddConstraint(
+            model_name='devicestate',
+            constraint=models.UniqueConstraint(fields=('session', 'device'), name='labs_devicestate_unique'),
+        ),
+        migrations.RunPython(split_virtual_config, join_virtual_config),
+        migrations.RemoveField(
+            model_name='userlabsession',
+            name='virtual_config',
+        ),
+    ]
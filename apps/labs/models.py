@@ -1,5 +1,20 @@
-from django.db import models
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, F, Max, When
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from apps.game.models import PlayerProfile
+
+from .engine.baseconfig import overlay_device, resolve_device
+from .engine.grading import retoken as retoken_verdict
+from .engine.network import retoken as retoken_network
+from .engine.render import new_revision
+from .lab_cache import get_lab
+from .writer import WRITER, WriteJob, track_deferred
 
 class LabScenario(models.Model):
     title = models.CharField(max_length=200)
@@ -13,6 +28,13 @@ class LabScenario(models.Model):
     reward_money = models.IntegerField(default=100)
     reward_xp = models.IntegerField(default=10)
 
+    # Версия лабы: по ней сбрасываются скомпилированные критерии (engine/grading.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Входящие офиса: min_level <= уровень игрока
+        indexes = [models.Index(fields=["min_level", "id"])]
+
     def __str__(self):
         return self.title
 
@@ -25,11 +47,798 @@ class UserLabSession(models.Model):
     # !!! НОВОЕ: Какое устройство сейчас открыто в терминале
     current_device = models.CharField(max_length=10, default="R1")
     
-    # В virtual_config теперь храним ВСЁ: и конфиг, и контекст, и историю для каждого роутера
-    # Структура: { "R1": { "config": {}, "context": "...", "history": [] }, "R2": ... }
-    virtual_config = models.JSONField(default=dict)
-    
+    # Состояние устройств - по строке DeviceState на устройство (+ журнал SessionMutation).
+    # В памяти - virtual_config: { "R1": { "config": {}, "context": "...", "current_iface": ... }, ... }
+    # только с загруженными устройствами (см. load_devices). Консоль и история - в ConsoleEntry
+
     is_completed = models.BooleanField(default=False)
 
+    # Staff включает, когда студент жалуется на тормоза: команды идут под cProfile (apps/labs/profiling.py)
+    profiling = models.BooleanField(default=False)
+
+    # Сколько мутаций копим в журнале, прежде чем свернуть их в DeviceState
+    COMPACT_EVERY = 50
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "is_completed"]),
+            models.Index(fields=["user", "lab"]),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.lab.title}"
+
+    @classmethod
+    def start(cls, user, lab):
+        """Сессия студента на лабе (get_or_create) + отметка в PlayerProgress"""
+        session, created = cls.objects.get_or_create(user=user, lab=lab)
+        if created: PlayerProgress.session_started(session)
+        return session, created
+
+    def mark_completed(self):
+        """Лаба выполнена: флаг сессии (через отложенную запись, если она включена) + прогресс игрока"""
+        self.is_completed = True
+        self.save(update_fields=["is_completed", "updated_at"])
+        PlayerProgress.session_completed(self)
+
+    def award_completion(self, money, xp):
+        """Награда за лабу - ровно один раз на сессию (см. RewardEntry.grant)"""
+        return RewardEntry.grant(self, money, xp)
+
+    # --- ДЕЛЬТА-ПЕРСИСТЕНТНОСТЬ ---
+    # DeviceState - снимок устройства. Каждая команда дописывает в журнал SessionMutation
+    # только то, что изменилось на одном устройстве. Раз в COMPACT_EVERY мутаций
+    # журнал сворачивается в строки DeviceState тронутых устройств.
+    # И снимок, и журнал хранят только оверлей поверх базового конфига лабы
+    # (engine/baseconfig.py); собранный конфиг живет только в памяти.
+
+    @property
+    def virtual_config(self):
+        """Загруженные устройства: {устройство: собранное состояние}"""
+        state = self.__dict__.get("_virtual_config")
+        if state is None: state = self._virtual_config = {}
+        return state
+
+    @virtual_config.setter
+    def virtual_config(self, value):
+        self._virtual_config = value
+
+    def load_state(self):
+        """Текущее устройство: снимок + несвернутые мутации, собранные с базой лабы (идемпотентно)"""
+        return self.load_devices([self.current_device])
+
+    def load_devices(self, devices=None):
+        """
+        Догружает устройства, которых еще нет в памяти; None - все устройства сессии
+        (сеть для ping/show ip route, чекпоинт). Команде хватает одного устройства.
+        """
+        if getattr(self, "_applied_mutations", None) is None:
+            self._applied_mutations = []
+            self._pending_devices = set()   # устройства с несвернутыми мутациями
+            self._loaded_devices = set()
+            self._all_loaded = False
+            self._last_mutation = None      # версия всей сессии: считается при первом чтении журнала
+
+        journal = self.mutations.order_by("id")
+        if devices is None:
+            if self._all_loaded: return self.virtual_config
+            rows = self.devices.exclude(device__in=self._loaded_devices)
+            journal = journal.exclude(device__in=self._loaded_devices).values_list("id", "device", "payload")
+            self._all_loaded = True
+        else:
+            devices = [device for device in devices if device not in self._loaded_devices]
+            if not devices or self._all_loaded: return self.virtual_config
+            rows = self.devices.filter(device__in=devices)
+            if self._last_mutation is None:
+                # id - по всему журналу (версия состояния всей сессии и его размер), payload - только нужных устройств
+                journal = journal.annotate(body=Case(When(device__in=devices, then=F("payload")),
+                                                     output_field=models.JSONField()))
+                journal = journal.values_list("id", "device", "body")
+            else:
+                journal = journal.filter(device__in=devices).values_list("id", "device", "payload")
+
+        stored = {row.device: row.as_device() for row in rows}
+        self._last_mutation = self._last_mutation or 0
+        others, journal_size = set(), 0   # устройства, чьи мутации лежат в журнале, но сейчас не нужны
+        for mutation_id, device, payload in journal:
+            journal_size += 1
+            self._last_mutation = max(self._last_mutation, mutation_id)
+            if devices is not None and device not in devices:
+                others.add(device)
+                continue
+            SessionMutation(device=device, payload=payload).apply_to(stored)
+            self._pending_devices.add(device)
+            self._applied_mutations.append(mutation_id)
+        self._loaded_devices.update(devices if devices is not None else stored)
+
+        if stored:
+            lab = get_lab(self.lab_id)
+            for device, data in stored.items():
+                self.virtual_config[device] = resolve_device(lab.base_config(device), data)
+
+        # Журнал копится по всем устройствам, а сворачиваются только загруженные:
+        # раз он вырос, догружаем остальные устройства из журнала и сворачиваем все сразу
+        if others and journal_size >= self.COMPACT_EVERY:
+            self.load_devices(sorted(others - self._loaded_devices))
+            self.compact_state()
+        return self.virtual_config
+
+    def state_token(self):
+        """Версия состояния: меняется при сворачивании журнала или новой мутации"""
+        return (self.updated_at, getattr(self, "_last_mutation", None) or 0)
+
+    def record_mutation(self, device, values=None, config_paths=None):
+        """
+        Записывает изменение одного устройства (в памяти оно уже применено).
+        values       - ключи верхнего уровня устройства: {"context": ...}
+        config_paths - {("interfaces", "Fa0/0"): {...}} - поддеревья config
+        """
+        self.load_devices([device])
+        deferred = getattr(self, "_deferred", None)
+        if deferred is not None:
+            # Отложенный режим: копим только ключи, значения возьмем при flush_writes
+            pending = deferred["devices"].setdefault(device, {"set": set(), "config": set()})
+            pending["set"].update(values or ())
+            pending["config"].update(config_paths or ())
+            return
+
+        payload = {}
+        if values: payload["set"] = values
+        if config_paths:
+            payload["config"] = [[list(path), value] for path, value in config_paths.items()]
+        if not payload: return
+
+        mutation = SessionMutation(session=self, device=device, payload=payload)
+        WRITER.submit(WriteJob(rows=[mutation]))
+        # Устройство - раньше id: compact_state в потоке писателя читает их в обратном порядке
+        self._pending_devices.add(device)
+        self._applied_mutations.append(mutation.id)
+        self._last_mutation = mutation.id
+
+        if len(self._applied_mutations) >= self.COMPACT_EVERY:
+            self.compact_state()
+
+    # --- КОНСОЛЬ ---
+
+    def append_console(self, device, logs):
+        """logs - [{"type": "cmd"/"out", "text": ..., "prompt": ...}]"""
+        rows = [
+            ConsoleEntry(session=self, device=device, kind=log["type"],
+                         text=log["text"], prompt=log.get("prompt", ""))
+            for log in logs
+        ]
+        deferred = getattr(self, "_deferred", None)
+        if deferred is not None:
+            deferred["console"].extend(rows)
+            return
+        WRITER.submit(WriteJob(rows=rows, after=[lambda: self._trim_console(rows)]))
+
+    def _trim_console(self, entries):
+        """Вызывается после вставки (id уже есть)"""
+        # Кольцевой буфер: примерно раз в TRIM_EVERY вставок отрезаем хвост
+        last_id = entries[-1].id if entries else None
+        if last_id and last_id % ConsoleEntry.TRIM_EVERY < len(entries):
+            for device in {row.device for row in entries}:
+                ConsoleEntry.trim(self, device)
+
+    # --- ЧЕКПОИНТЫ И ОТМЕНА ---
+    # Состояния устройств лежат в ConfigBlob по хэшу содержимого: снимок - это словарь
+    # {устройство: хэш}, неизмененные устройства у всех снимков общие.
+
+    def push_undo(self, device, blob):
+        """Шаг отмены: состояние устройства до команды (processor._push_undo)"""
+        rows = [blob, SessionCheckpoint(session=self, kind=SessionCheckpoint.KIND_UNDO,
+                                        devices={device: blob.hash}, current_device=device)]
+        deferred = getattr(self, "_deferred", None)
+        if deferred is not None:
+            deferred["rows"].extend(rows)
+            return
+        WRITER.submit(WriteJob(rows=rows, after=[lambda: self._trim_undo(rows)]))
+
+    def _trim_undo(self, rows):
+        """Вызывается после вставки: держим не больше LAB_UNDO_DEPTH шагов (проверка раз в TRIM_EVERY)"""
+        steps = [row for row in rows if isinstance(row, SessionCheckpoint)]
+        if steps and steps[-1].id % SessionCheckpoint.TRIM_EVERY < len(steps):
+            SessionCheckpoint.trim_undo(self)
+
+    def undo_depth(self):
+        return self.checkpoints.filter(kind=SessionCheckpoint.KIND_UNDO).count()
+
+    def undo(self):
+        """Откатывает последнюю изменившую конфиг команду. Возвращает устройство или None"""
+        step = self.checkpoints.filter(kind=SessionCheckpoint.KIND_UNDO).order_by("-id").first()
+        if step is None: return None
+        (device, digest), = step.devices.items()
+        state = ConfigBlob.objects.get(hash=digest).state()
+
+        self.load_devices([device])
+        current = self.virtual_config.get(device, {})
+        # Ключи, которых не было до команды, тоже сбрасываем (current_iface и т.п.)
+        values = {key: state.get(key) for key in set(current) | set(state)}
+        values["rev"] = new_revision()   # новая ревизия: кэш вывода show не должен узнать старый конфиг
+        current.update(values)
+        self.virtual_config[device] = current
+        self.record_mutation(device, values=values)
+        step.delete()
+        return device
+
+    def save_checkpoint(self, name, shared=False):
+        """Именованный снимок всех устройств (блобы неизмененных устройств переиспользуются)"""
+        self.load_devices()
+        blobs = {device: ConfigBlob.of(data) for device, data in self.virtual_config.items()}
+        with transaction.atomic():
+            ConfigBlob.objects.bulk_create(blobs.values(), ignore_conflicts=True)
+            return SessionCheckpoint.objects.create(
+                session=self, kind=SessionCheckpoint.KIND_NAMED, name=name, shared=shared,
+                current_device=self.current_device,
+                devices={device: blob.hash for device, blob in blobs.items()})
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        Восстанавливает снимок целиком: новый virtual_config из блобов и пустой журнал,
+        без повторного проигрывания истории. Шаги отмены после восстановления сбрасываются.
+        """
+        states = {blob.hash: blob.state() for blob in ConfigBlob.objects.filter(hash__in=checkpoint.devices.values())}
+        config = {}
+        for device, digest in checkpoint.devices.items():
+            config[device] = states[digest]
+            config[device]["rev"] = new_revision()
+
+        with transaction.atomic():
+            self.mutations.all().delete()
+            self.checkpoints.filter(kind=SessionCheckpoint.KIND_UNDO).delete()
+            self.devices.all().delete()
+            self._replace_state(config)
+            DeviceState.objects.bulk_create(self._device_rows(config))
+            if checkpoint.current_device in config: self.current_device = checkpoint.current_device
+            self._save_now(["current_device", "updated_at"])
+        if getattr(self, "_deferred", None) is not None:
+            self._deferred = _empty_deferred()
+
+    # --- ОТЛОЖЕННАЯ ЗАПИСЬ (долгоживущее соединение терминала) ---
+
+    def defer_writes(self):
+        """
+        Дальше record_mutation/append_console/save(update_fields=...) копят изменения в памяти.
+        Несколько команд подряд по одному устройству сливаются в одну мутацию.
+        """
+        self.load_state()
+        if getattr(self, "_deferred", None) is None:
+            self._deferred = _empty_deferred()
+            track_deferred(self)
+
+    def has_pending_writes(self):
+        deferred = getattr(self, "_deferred", None)
+        return bool(deferred and (deferred["devices"] or deferred["console"] or deferred["fields"]
+                                  or deferred["rows"]))
+
+    def flush_writes(self):
+        """
+        Отдает накопленное писателю (apps/labs/writer.py) и ждет коммита.
+        Отложенный режим остается включенным.
+        """
+        if not self.has_pending_writes(): return
+        deferred = self._deferred
+
+        mutations = []
+        for device, pending in deferred["devices"].items():
+            dev = self.virtual_config.get(device, {})
+            payload = {}
+            if pending["set"]:
+                payload["set"] = {key: dev.get(key) for key in pending["set"]}
+            # config целиком ушел в "set" (undo) - отдельные пути не нужны
+            if pending["config"] and "config" not in pending["set"]:
+                payload["config"] = [[list(path), _read_path(dev.get("config", {}), path)]
+                                     for path in pending["config"]]
+            # Команда без изменений (show) - как и в немедленном режиме, строку не пишем
+            if payload: mutations.append(SessionMutation(session=self, device=device, payload=payload))
+
+        console = deferred["console"]
+        rows = deferred["rows"]
+        # Кэши процесса (вердикт, L3-сеть) запомнили состояние с этим токеном
+        token_before = self.state_token()
+        fields = {name: getattr(self, name) for name in deferred["fields"]}
+        # Метку времени ставим здесь, а не в писателе: токен в памяти должен совпасть с тем,
+        # что прочитает из БД следующий запрос
+        if "updated_at" in fields: self.updated_at = fields["updated_at"] = timezone.now()
+
+        def after():
+            self._pending_devices.update(m.device for m in mutations)
+            self._applied_mutations.extend(m.id for m in mutations)
+            if mutations: self._last_mutation = max(self._last_mutation or 0, mutations[-1].id)
+            self._trim_console(console)
+            self._trim_undo(rows)
+            if len(self._applied_mutations) >= self.COMPACT_EVERY:
+                self.compact_state()
+            # Записанное - то же состояние, что кэши уже видели: переносим их на новый токен
+            token = self.state_token()
+            retoken_verdict(self, token_before, token)
+            retoken_network(self, token_before, token)
+
+        WRITER.submit(WriteJob(rows=mutations + console + rows,
+                               fields=(UserLabSession, self.pk, fields) if fields else None,
+                               after=[after]))
+        self._deferred = _empty_deferred()
+
+    def compact_state(self):
+        """
+        Сворачивает журнал в строки DeviceState устройств, у которых были мутации.
+        Чужие мутации, записанные параллельным запросом, остаются и накатятся позже.
+        Идет в потоке писателя: virtual_config только читаем, его параллельно меняет поток команд.
+        """
+        applied = list(self._applied_mutations)
+        devices, self._pending_devices = self._pending_devices, set()
+        rows = self._device_rows({device: self.virtual_config[device] for device in devices
+                                  if device in self.virtual_config})
+        try:
+            with transaction.atomic():
+                DeviceState.objects.bulk_create(rows, update_conflicts=True, unique_fields=["session", "device"],
+                                                 update_fields=DeviceState.STATE_FIELDS)
+                self.mutations.filter(id__in=applied).delete()
+                self._save_now(["updated_at"])
+                # Версия журнала - как ее посчитает следующий load_devices. Если там появилась
+                # чужая мутация новее нашей, оставляем старую: токен не должен обещать лишнего
+                last = self.mutations.aggregate(last=Max("id"))["last"] or 0
+                if last <= (self._last_mutation or 0): self._last_mutation = last
+        except Exception:
+            self._pending_devices |= devices
+            raise
+        del self._applied_mutations[:len(applied)]
+
+    def reset_state(self):
+        """Полный сброс: без устройств и с пустым журналом"""
+        with transaction.atomic():
+            self.mutations.all().delete()
+            self.console_entries.all().delete()
+            self.checkpoints.filter(kind=SessionCheckpoint.KIND_UNDO).delete()
+            self.devices.all().delete()
+            self._replace_state({})
+            was_completed, self.is_completed = self.is_completed, False
+            self._save_now(["is_completed", "updated_at"])
+            if was_completed: PlayerProgress.session_reset(self)
+        if getattr(self, "_deferred", None) is not None:
+            self._deferred = _empty_deferred()
+
+    def _replace_state(self, config):
+        """Состояние в памяти целиком заменено (сброс, чекпоинт): журнал пуст, все устройства загружены"""
+        self.virtual_config = config
+        self._applied_mutations = []
+        self._pending_devices = set()
+        self._loaded_devices = set(config)
+        self._all_loaded = True
+        self._last_mutation = 0
+
+    def _device_rows(self, config):
+        """Собранные состояния устройств -> строки DeviceState (только оверлей)"""
+        lab = get_lab(self.lab_id)
+        return [DeviceState.from_device(self, device, overlay_device(lab.base_config(device), data))
+                for device, data in config.items()]
+
+    def _save_now(self, fields):
+        """Запись мимо отложенного режима (сворачивание, сброс, чекпоинт)"""
+        super().save(update_fields=fields)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        deferred = getattr(self, "_deferred", None)
+        if deferred is not None and update_fields is not None:
+            # is_completed/current_device в отложенном режиме уходят вместе с журналом
+            deferred["fields"].update(update_fields)
+            return
+        return super().save(*args, **kwargs)
+
+
+def _empty_deferred():
+    return {"devices": {}, "console": [], "rows": [], "fields": set()}
+
+
+def _read_path(config, path):
+    node = config
+    for key in path:
+        node = node.get(key) if isinstance(node, dict) else None
+    return node
+
+
+class PlayerProgress(models.Model):
+    """
+    Материализованный прогресс игрока для офиса и списка лаб.
+    Обновляется точечно (старт/завершение/сброс сессии), а не считается
+    по всем сессиям на каждый заход на главную.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="lab_progress")
+    # id лаб: все начатые (включая завершенные) и завершенные
+    started = models.JSONField(default=list)
+    completed = models.JSONField(default=list)
+    # Текущее задание офиса: незавершенная сессия с наименьшим id
+    active_session = models.ForeignKey(UserLabSession, null=True, blank=True,
+                                       on_delete=models.SET_NULL, related_name="+")
+
     def __str__(self):
-        return f"{self.user.username} - {self.lab.title}"
\ No newline at end of file
+        return f"{self.user_id}: {len(self.completed)}/{len(self.started)}"
+
+    @property
+    def started_set(self):
+        return set(self.started)
+
+    @classmethod
+    def for_user(cls, user):
+        """Прогресс игрока (один запрос по PK); у новых игроков собирается из сессий"""
+        progress = cls.objects.select_related("active_session__lab").filter(user_id=user.pk).first()
+        return progress or cls.rebuild(user.pk)
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """Полный пересчет по UserLabSession (удаление сессии, новый игрок)"""
+        return cls.rebuild_many([user_id])[user_id]
+
+    @classmethod
+    def rebuild_many(cls, user_ids):
+        """То же для пачки игроков: один запрос по сессиям + один upsert. {user_id: PlayerProgress}"""
+        result = {user_id: cls(user_id=user_id, started=[], completed=[]) for user_id in user_ids}
+        rows = (UserLabSession.objects.filter(user_id__in=result).order_by("id")
+                .values_list("user_id", "id", "lab_id", "is_completed"))
+        for user_id, session_id, lab_id, done in rows:
+            progress = result[user_id]
+            if lab_id not in progress.started: progress.started.append(lab_id)
+            if done and lab_id not in progress.completed: progress.completed.append(lab_id)
+            if not done and progress.active_session_id is None: progress.active_session_id = session_id
+        for progress in result.values():
+            progress.started.sort()
+            progress.completed.sort()
+        cls.objects.bulk_create(result.values(), update_conflicts=True, unique_fields=["user"],
+                                update_fields=["started", "completed", "active_session"])
+        return result
+
+    @classmethod
+    def _locked(cls, user_id):
+        progress = cls.objects.select_for_update().filter(user_id=user_id).first()
+        return progress or cls.rebuild(user_id)
+
+    @classmethod
+    def session_started(cls, session):
+        with transaction.atomic():
+            progress = cls._locked(session.user_id)
+            if session.lab_id not in progress.started:
+                progress.started = sorted(progress.started + [session.lab_id])
+            if progress.active_session_id is None and not session.is_completed:
+                progress.active_session_id = session.id
+            progress.save()
+
+    @classmethod
+    def session_completed(cls, session):
+        cls.sessions_completed([session])
+
+    @classmethod
+    def sessions_completed(cls, sessions):
+        """Завершенные сессии (одна из check_completion или пачка из перепроверки лабы)"""
+        by_user = {}
+        for session in sessions:
+            by_user.setdefault(session.user_id, []).append(session)
+        done_ids = {session.id for session in sessions}
+        with transaction.atomic():
+            found = {p.user_id: p for p in cls.objects.select_for_update().filter(user_id__in=by_user)}
+            missing = [user_id for user_id in by_user if user_id not in found]
+            if missing: found.update(cls.rebuild_many(missing))
+
+            # Завершили активную сессию -> следующая активная, один запрос по индексу (user, is_completed)
+            need = [user_id for user_id in by_user if found[user_id].active_session_id in done_ids]
+            next_active = {}
+            if need:
+                rows = (UserLabSession.objects.filter(user_id__in=need, is_completed=False)
+                        .exclude(id__in=done_ids).order_by("-id").values_list("user_id", "id"))
+                next_active = dict(rows)   # по убыванию id: у игрока остается наименьший
+
+            changed = []
+            for user_id, user_sessions in by_user.items():
+                progress = found[user_id]
+                completed = sorted(set(progress.completed) | {s.lab_id for s in user_sessions})
+                active = next_active.get(user_id) if user_id in need else progress.active_session_id
+                if completed == progress.completed and active == progress.active_session_id: continue
+                progress.completed, progress.active_session_id = completed, active
+                changed.append(progress)
+            cls._write_many(changed)
+
+    @classmethod
+    def _write_many(cls, rows):
+        """
+        UPDATE completed/active_session по PK одним executemany: bulk_update строит CASE
+        на каждую строку, а update() на строку - это сотни ORM-запросов на чанк перепроверки
+        """
+        if not rows: return
+        quote = connection.ops.quote_name
+        completed = cls._meta.get_field("completed")
+        active = cls._meta.get_field("active_session")
+        sql = (f"UPDATE {quote(cls._meta.db_table)} SET {quote(completed.column)} = %s, "
+               f"{quote(active.column)} = %s WHERE {quote(cls._meta.pk.column)} = %s")
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [(completed.get_db_prep_value(p.completed, connection), p.active_session_id, p.pk)
+                                     for p in rows])
+
+    @classmethod
+    def session_reset(cls, session):
+        with transaction.atomic():
+            progress = cls._locked(session.user_id)
+            if session.lab_id in progress.completed:
+                progress.completed = [lab for lab in progress.completed if lab != session.lab_id]
+            if progress.active_session_id is None or session.id < progress.active_session_id:
+                progress.active_session_id = session.id
+            progress.save()
+
+
+def on_session_deleted(sender, instance, origin=None, **kwargs):
+    """Удалили сессию или лабу (админка) -> пересчитать прогресс владельца сессии"""
+    # При удалении самого пользователя прогресс уходит каскадом - пересчитывать нечего
+    model = getattr(origin, "model", type(origin))
+    if model in (UserLabSession, LabScenario):
+        PlayerProgress.rebuild(instance.user_id)
+
+
+class DeviceState(models.Model):
+    """
+    Снимок одного устройства сессии: оверлей config поверх базы лабы, контекст и курсор.
+    Команда читает только строку своего устройства (UserLabSession.load_devices).
+    """
+    session = models.ForeignKey(UserLabSession, on_delete=models.CASCADE, related_name="devices")
+    device = models.CharField(max_length=10)
+    config = models.JSONField(default=dict)
+    context = models.CharField(max_length=30, default="privileged")
+    current_iface = models.CharField(max_length=50, null=True, blank=True)
+    current_line = models.CharField(max_length=20, null=True, blank=True)
+    editing_policy_id = models.CharField(max_length=50, null=True, blank=True)
+    # Ревизия конфига (ключ render-кэша, engine/render.py)
+    rev = models.BigIntegerField(null=True, blank=True)
+
+    # Поля, которые переписывает сворачивание журнала
+    STATE_FIELDS = ["config", "context", "current_iface", "current_line", "editing_policy_id", "rev"]
+    # Ключи устройства, для которых нет своих колонок, при записи отбрасываются
+    CURSOR_FIELDS = ("current_iface", "current_line", "editing_policy_id", "rev")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["session", "device"], name="labs_devicestate_unique")]
+
+    @classmethod
+    def from_device(cls, session, device, data):
+        return cls(session=session, device=device, config=data.get("config") or {},
+                   context=data.get("context") or "privileged",
+                   **{name: data.get(name) for name in cls.CURSOR_FIELDS})
+
+    def as_device(self):
+        """Формат устройства в virtual_config (пустые поля курсора не добавляем)"""
+        data = {"config": self.config, "context": self.context}
+        for name in self.CURSOR_FIELDS:
+            value = getattr(self, name)
+            if value is not None: data[name] = value
+        return data
+
+
+class SessionMutation(models.Model):
+    """Запись журнала изменений одного устройства сессии (append-only)"""
+    session = models.ForeignKey(UserLabSession, on_delete=models.CASCADE, related_name="mutations")
+    device = models.CharField(max_length=10)
+    # {"set": {...}, "config": [[path, value], ...]}
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Загрузка одного устройства: журнал только по нему
+        indexes = [models.Index(fields=["session", "device", "id"])]
+
+    def apply_to(self, virtual_config):
+        dev = virtual_config.setdefault(self.device, {})
+        dev.update(self.payload.get("set", {}))
+
+        # Родительские пути раньше дочерних
+        for path, value in sorted(self.payload.get("config", []), key=lambda item: len(item[0])):
+            node = dev.setdefault("config", {})
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            # None - путь удален командой (no ip route ...). Остается в оверлее надгробием:
+            # иначе ключ из базового конфига лабы "воскреснет" при сборке
+            node[path[-1]] = value
+
+
+class ConfigBlob(models.Model):
+    """
+    Неизменяемое состояние одного устройства (config, контекст, курсор) по хэшу содержимого.
+    Одинаковые состояния - из разных снимков и разных сессий - хранятся одной строкой.
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    # Канонический JSON (sort_keys): по нему считается хэш, он же и хранится
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Писатель сессий вставляет блобы с ignore_conflicts (apps/labs/writer.py)
+    WRITE_IGNORE_CONFLICTS = True
+
+    @classmethod
+    def of(cls, device_data):
+        """Блоб из живого состояния устройства (ревизия не входит - при восстановлении выдается новая)"""
+        body = json.dumps({key: value for key, value in device_data.items() if key != "rev"},
+                          sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return cls(hash=hashlib.sha256(body.encode()).hexdigest(), body=body)
+
+    def state(self):
+        """Новая (изменяемая) копия состояния устройства"""
+        return json.loads(self.body)
+
+    @classmethod
+    def prune(cls):
+        """Удаляет блобы, на которые не ссылается ни один снимок. Возвращает число удаленных"""
+        used = set()
+        for devices in SessionCheckpoint.objects.values_list("devices", flat=True).iterator():
+            used.update(devices.values())
+        orphaned = [digest for digest in cls.objects.values_list("hash", flat=True).iterator() if digest not in used]
+        for i in range(0, len(orphaned), 500):
+            cls.objects.filter(hash__in=orphaned[i:i + 500]).delete()
+        return len(orphaned)
+
+
+class SessionCheckpoint(models.Model):
+    """
+    Снимок сессии: {устройство: хэш ConfigBlob}.
+    named - сохранен студентом (или выдан преподавателем всей лабе через shared),
+    undo  - состояние одного устройства до команды, стек отмены.
+    """
+    KIND_NAMED = "named"
+    KIND_UNDO = "undo"
+
+    # Как часто (по id вставки) обрезать стек отмены до LAB_UNDO_DEPTH
+    TRIM_EVERY = 10
+
+    session = models.ForeignKey(UserLabSession, on_delete=models.CASCADE, related_name="checkpoints")
+    kind = models.CharField(max_length=5, default=KIND_NAMED)
+    name = models.CharField(max_length=100, blank=True, default="")
+    devices = models.JSONField(default=dict)
+    current_device = models.CharField(max_length=10, blank=True, default="")
+    # Преподаватель раздает промежуточное состояние всем сессиям лабы
+    shared = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["session", "kind", "id"])]
+
+    def __str__(self):
+        return f"{self.session_id}: {self.name or self.kind}"
+
+    @classmethod
+    def available(cls, session):
+        """Именованные снимки сессии + выданные преподавателем для этой лабы"""
+        own = models.Q(session=session)
+        shared = models.Q(shared=True, session__lab_id=session.lab_id)
+        return (cls.objects.filter(own | shared, kind=cls.KIND_NAMED)
+                .select_related("session__user").order_by("-id"))
+
+    @classmethod
+    def trim_undo(cls, session, keep=None):
+        keep = keep or settings.LAB_UNDO_DEPTH
+        boundary = list(cls.objects.filter(session=session, kind=cls.KIND_UNDO)
+                        .order_by("-id").values_list("id", flat=True)[keep:keep + 1])
+        if boundary:
+            cls.objects.filter(session=session, kind=cls.KIND_UNDO, id__lte=boundary[0]).delete()
+
+
+class ConsoleEntry(models.Model):
+    """Строка консоли устройства: введенная команда или вывод"""
+    KIND_CMD = "cmd"
+    KIND_OUT = "out"
+
+    # Как часто (по id вставки) проверять лимит LAB_CONSOLE_MAX_ENTRIES
+    TRIM_EVERY = 100
+
+    session = models.ForeignKey(UserLabSession, on_delete=models.CASCADE, related_name="console_entries")
+    device = models.CharField(max_length=10)
+    kind = models.CharField(max_length=3, default=KIND_OUT)
+    text = models.TextField(blank=True, default="")
+    prompt = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["session", "device", "id"])]
+
+    def as_log(self):
+        """Формат, который понимает static/js/lab.js"""
+        log = {"id": self.id, "type": self.kind, "text": self.text}
+        if self.kind == self.KIND_CMD: log["prompt"] = self.prompt
+        return log
+
+    @classmethod
+    def page(cls, session, device, before=None, limit=None):
+        """
+        Последние limit строк (старые -> новые) до курсора before.
+        Возвращает (logs, has_more).
+        """
+        limit = limit or settings.LAB_CONSOLE_PAGE_SIZE
+        qs = cls.objects.filter(session=session, device=device)
+        if before: qs = qs.filter(id__lt=before)
+        rows = list(qs.order_by("-id")[:limit + 1])
+        has_more = len(rows) > limit
+        return [row.as_log() for row in reversed(rows[:limit])], has_more
+
+    @classmethod
+    def history(cls, session, device, limit=None):
+        """История введенных команд (без пустых строк)"""
+        qs = cls.objects.filter(session=session, device=device, kind=cls.KIND_CMD).exclude(text="")
+        texts = qs.order_by("-id").values_list("text", flat=True)
+        if limit: texts = texts[:limit]
+        return list(reversed(texts))
+
+    @classmethod
+    def trim(cls, session, device, keep=None):
+        """Оставляет только последние keep строк устройства"""
+        keep = keep or settings.LAB_CONSOLE_MAX_ENTRIES
+        boundary = (cls.objects.filter(session=session, device=device)
+                    .order_by("-id").values_list("id", flat=True)[keep:keep + 1])
+        boundary = list(boundary)
+        if boundary:
+            cls.objects.filter(session=session, device=device, id__lte=boundary[0]).delete()
+
+
+class RewardEntry(models.Model):
+    """
+    Журнал наград за лабы (append-only): одна строка на сессию.
+    Уникальность session гарантирует, что две параллельные проверки
+    (вкладки, перепроверка, фоновый воркер) не начислят награду дважды.
+    """
+    session = models.OneToOneField(UserLabSession, null=True, on_delete=models.SET_NULL, related_name="reward")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lab_rewards")
+    lab = models.ForeignKey(LabScenario, null=True, on_delete=models.SET_NULL, related_name="+")
+    money = models.IntegerField(default=0)   # вместе с бонусом за уровень
+    xp = models.IntegerField(default=0)
+    level = models.IntegerField(null=True, blank=True)   # новый уровень, если был level up
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id}: +{self.money}$ +{self.xp}xp"
+
+    @staticmethod
+    def level_for(xp):
+        # Новый уровень каждые 100 XP: 0-99 (Lvl 1), 100-199 (Lvl 2), ...
+        return 1 + xp // 100
+
+    @classmethod
+    def grant(cls, session, money, xp):
+        """Награда за одну сессию: RewardEntry или None, если она уже выдана"""
+        entries = cls.grant_many([session], money, xp)
+        return entries[0] if entries else None
+
+    @classmethod
+    def grant_many(cls, sessions, money, xp):
+        """
+        Награды за одну лабу пачке сессий (по одной на игрока): атомарные инкременты
+        в БД и строки журнала в одной транзакции. Уровень считается по XP уже после
+        инкремента. Уже награжденные сессии пропускаются; возвращает новые записи.
+        """
+        sessions = list(sessions)
+        if len({s.user_id for s in sessions}) < len(sessions):
+            # Две сессии одного игрока - инкремент пачкой посчитал бы его один раз
+            return [entry for s in sessions for entry in cls.grant_many([s], money, xp)]
+        # Уже награжденные отсеиваем до транзакции: в SQLite транзакция, начатая с чтения,
+        # не может потом дождаться блокировки на запись ("database is locked").
+        # Гонку между этой проверкой и вставкой ловит уникальность session.
+        done = set(cls.objects.filter(session_id__in=[s.pk for s in sessions]).values_list("session_id", flat=True))
+        sessions = [s for s in sessions if s.pk not in done]
+        if not sessions: return []
+        try:
+            with transaction.atomic():
+                profiles = PlayerProfile.objects.filter(user_id__in=[s.user_id for s in sessions])
+                profiles.update(money=F("money") + money, xp=F("xp") + xp)
+                # Строки профилей уже заблокированы нашим UPDATE - читаем свои значения
+                levels = {}
+                for user_id, current_xp, current_level in profiles.values_list("user_id", "xp", "level"):
+                    new_level = cls.level_for(current_xp)
+                    if new_level > current_level: levels[user_id] = new_level
+                for new_level in set(levels.values()):
+                    users = [user_id for user_id, level in levels.items() if level == new_level]
+                    PlayerProfile.objects.filter(user_id__in=users).update(
+                        level=new_level, money=F("money") + 50 * new_level)
+
+                # Вставка для уже награжденной сессии откатит всю транзакцию вместе с инкрементами
+                return cls.objects.bulk_create([
+                    cls(session=s, user_id=s.user_id, lab_id=s.lab_id, xp=xp, level=levels.get(s.user_id),
+                        money=money + 50 * levels[s.user_id] if s.user_id in levels else money)
+                    for s in sessions
+                ])
+        except IntegrityError:
+            if len(sessions) == 1: return []
+            # Кого-то из пачки наградили параллельно - повторяем по одной
+            return [entry for s in sessions for entry in cls.grant_many([s], money, xp)]
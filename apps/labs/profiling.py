@@ -0,0 +1,104 @@
+"""
+Профилирование отдельных сессий по запросу ("у студента тормозит терминал").
+
+Staff включает флаг UserLabSession.profiling (на сессию или на все сессии студента),
+после чего каждая команда этой сессии выполняется под cProfile, а результат пишется
+в LAB_PROFILE_DIR/session-<id>/ (.prof для pstats/snakeviz + .json с командой и временем).
+Хранится последних LAB_PROFILE_KEEP файлов на сессию, старые удаляются.
+
+Когда флаг выключен, цена - одна проверка поля уже загруженной сессии.
+"""
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+_sequence = itertools.count()
+
+
+def session_dir(session_id):
+    return Path(settings.LAB_PROFILE_DIR) / f"session-{int(session_id)}"
+
+
+@contextmanager
+def profile_session(session, label):
+    """with profile_session(session, command): processor.process_input(command)"""
+    if not session.profiling:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _save(session, label, profiler, time.perf_counter() - started)
+
+
+def _save(session, label, profiler, elapsed):
+    folder = session_dir(session.pk)
+    folder.mkdir(parents=True, exist_ok=True)
+    # Имя сортируется по времени; счетчик и pid - чтобы не столкнулись процессы/потоки
+    name = f"{time.time():.6f}-{os.getpid()}-{next(_sequence)}"
+    profiler.dump_stats(folder / f"{name}.prof")
+    (folder / f"{name}.json").write_text(json.dumps({
+        "command": label,
+        "device": session.current_device,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "created": time.time(),
+    }))
+    _rotate(folder)
+
+
+def _rotate(folder):
+    profiles = sorted(folder.glob("*.prof"))
+    for path in profiles[:-settings.LAB_PROFILE_KEEP]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".json").unlink(missing_ok=True)
+
+
+# --- ПРОСМОТР ---
+
+def recent_profiles(session_id, limit=50):
+    """Последние профили сессии (новые сверху): [{"name", "command", "device", "elapsed_ms", "created"}]"""
+    folder = session_dir(session_id)
+    if not folder.is_dir(): return []
+    result = []
+    for path in sorted(folder.glob("*.prof"), reverse=True)[:limit]:
+        try:
+            meta = json.loads(path.with_suffix(".json").read_text())
+        except (OSError, ValueError):
+            meta = {}
+        meta["name"] = path.stem
+        result.append(meta)
+    return result
+
+
+def top_functions(session_id, names=None, limit=40, sort="cumulative"):
+    """
+    Сводка pstats по выбранным профилям (по умолчанию - по всем сохраненным):
+    [{"function", "ncalls", "primitive_calls", "tottime_ms", "cumtime_ms"}]
+    """
+    folder = session_dir(session_id)
+    paths = [folder / f"{name}.prof" for name in names] if names else sorted(folder.glob("*.prof"))
+    paths = [str(p) for p in paths if p.is_file()]
+    if not paths: return []
+
+    stats = pstats.Stats(*paths)
+    key = {"cumulative": 3, "tottime": 2, "ncalls": 0}.get(sort, 3)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][key], reverse=True)[:limit]
+    return [{
+        "function": pstats.func_std_string(func),
+        "ncalls": ncalls,
+        "primitive_calls": primitive,
+        "tottime_ms": round(tottime * 1000, 3),
+        "cumtime_ms": round(cumtime * 1000, 3),
+    } for func, (primitive, ncalls, tottime, cumtime, _) in rows]
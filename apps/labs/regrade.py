@@ -0,0 +1,168 @@
+"""
+Перепроверка всех сессий лабы после правки success_criteria или base_config устройств.
+
+Раньше новые критерии применялись лениво: lab_workspace прогонял check_completion,
+когда студент сам открывал лабу. Теперь edit_lab (или manage.py regrade_lab) запускает
+перепроверку сразу:
+
+    id незавершенных сессий -> чанки по LAB_REGRADE_CHUNK -> пул процессов
+    (каждый читает снимки и журналы мутаций своего чанка и считает проверки)
+    -> прошедшие помечаются пачкой: один UPDATE, прогресс игроков, журнал наград.
+
+Как и ленивая проверка, перепроверка только засчитывает лабу: завершенные сессии
+не трогаются, даже если по новым критериям уже не проходят. Засчитанная лаба и
+выданная награда (RewardEntry, append-only) не отзываются - иначе правка автора
+задним числом списывала бы деньги и XP игроков.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# lab_id -> {"status", "total", "checked", "completed", "seconds"} (в памяти процесса, для edit_lab)
+REGRADES = {}
+_lock = threading.Lock()
+
+# Разобранная лаба (критерии + базовые конфиги устройств) в процессе пула
+_lab = None
+
+
+def _init_worker(lab_id):
+    global _lab
+    # Пул стартует через spawn: в дочернем процессе Django еще не настроен
+    import django
+    django.setup()
+    from .lab_cache import get_lab
+    _lab = get_lab(lab_id)
+
+
+def _grade_chunk(ids):
+    """Чанк сессий -> [(id, user_id)] прошедших все проверки"""
+    from .engine.baseconfig import resolve_device
+    from .models import DeviceState, SessionMutation, UserLabSession
+
+    configs = {sid: (user_id, {}) for sid, user_id in UserLabSession.objects.filter(id__in=ids).values_list("id", "user_id")}
+    # Только устройства из критериев; несвернутые мутации накатываются так же, как в load_devices
+    devices = _lab.evaluator.devices
+    for row in DeviceState.objects.filter(session_id__in=ids, device__in=devices):
+        configs[row.session_id][1][row.device] = row.as_device()
+    mutations = (SessionMutation.objects.filter(session_id__in=ids, device__in=devices).order_by("id")
+                 .values_list("session_id", "device", "payload"))
+    for sid, device, payload in mutations:
+        SessionMutation(device=device, payload=payload).apply_to(configs[sid][1])
+
+    # В снимке только оверлей - проверяем собранный с базой лабы конфиг
+    passed = []
+    for sid, (user_id, stored) in configs.items():
+        config = {device: resolve_device(_lab.base_config(device), data) for device, data in stored.items()}
+        if not _lab.evaluator.failing(config): passed.append((sid, user_id))
+    return len(configs), passed
+
+
+def _promote(lab, passed):
+    """
+    Пачка прошедших: флаг сессий, прогресс игроков и награды - одной транзакцией.
+    Только повышает: обратного перехода (is_completed -> False) нет.
+    """
+    from .models import PlayerProgress, RewardEntry, UserLabSession
+
+    sessions = [UserLabSession(id=sid, user_id=user_id, lab_id=lab.id, is_completed=True) for sid, user_id in passed]
+    with transaction.atomic():
+        # updated_at - новая версия состояния: открытый терминал (websocket.py) перечитает сессию
+        UserLabSession.objects.filter(id__in=[s.id for s in sessions]).update(is_completed=True, updated_at=timezone.now())
+        PlayerProgress.sessions_completed(sessions)
+        RewardEntry.grant_many(sessions, lab.reward_money, lab.reward_xp)
+
+
+def regrade_lab(lab_id, workers=None, chunk_size=None, progress=None):
+    """
+    Перепроверяет незавершенные сессии лабы по текущим критериям.
+    progress(state) вызывается после каждого чанка. Возвращает итоговое состояние.
+    """
+    global _lab
+    from .lab_cache import get_lab
+    from .models import LabScenario, UserLabSession
+
+    started = time.perf_counter()
+    lab = LabScenario.objects.get(id=lab_id)
+    workers = workers or settings.LAB_REGRADE_WORKERS or os.cpu_count() or 1
+    chunk_size = chunk_size or settings.LAB_REGRADE_CHUNK
+
+    ids = list(UserLabSession.objects.filter(lab_id=lab_id, is_completed=False)
+               .order_by("id").values_list("id", flat=True))
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    state = {"status": "running", "total": len(ids), "checked": 0, "completed": 0, "seconds": 0.0}
+
+    def collect(results):
+        for checked, passed in results:
+            if passed: _promote(lab, passed)
+            state["checked"] += checked
+            state["completed"] += len(passed)
+            state["seconds"] = round(time.perf_counter() - started, 3)
+            if progress: progress(state)
+
+    # Без проверок лаба не засчитывается (как в check_completion)
+    definition = get_lab(lab_id)
+    if not definition.evaluator:
+        chunks = []
+
+    if workers == 1 or len(chunks) <= 1:
+        # Мелкая лаба: запуск пула дороже самой проверки
+        _lab = definition
+        try:
+            collect(_grade_chunk(chunk) for chunk in chunks)
+        finally:
+            _lab = None
+    else:
+        # spawn, а не fork: родитель может быть веб-процессом с живыми потоками (писатель сессий)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(workers, len(chunks)), _init_worker, (lab_id,)) as pool:
+            collect(pool.imap_unordered(_grade_chunk, chunks))
+
+    state["status"] = "done"
+    state["seconds"] = round(time.perf_counter() - started, 3)
+    return state
+
+
+# --- ФОНОВЫЙ ЗАПУСК (edit_lab) ---
+
+def start_regrade(lab_id):
+    """Перепроверка в фоновом потоке; повторная правка во время прогона запустит его еще раз"""
+    with _lock:
+        current = REGRADES.get(lab_id)
+        if current is not None and current["status"] in ("running", "queued"):
+            current["rerun"] = True
+            return
+        REGRADES[lab_id] = {"status": "queued", "rerun": False}
+    threading.Thread(target=_run_background, args=(lab_id,), name=f"lab-regrade-{lab_id}", daemon=True).start()
+
+
+def _run_background(lab_id):
+    def report(state):
+        with _lock:
+            REGRADES[lab_id].update(state)
+
+    try:
+        while True:
+            with _lock:
+                REGRADES[lab_id]["rerun"] = False
+            state = regrade_lab(lab_id, progress=report)
+            logger.info("Regraded lab %s: %s of %s sessions completed in %.2fs",
+                        lab_id, state["completed"], state["total"], state["seconds"])
+            with _lock:
+                REGRADES[lab_id].update(state)
+                if not REGRADES[lab_id]["rerun"]: return
+                REGRADES[lab_id]["status"] = "queued"
+    except Exception:
+        logger.exception("Regrade of lab %s failed", lab_id)
+        with _lock:
+            REGRADES[lab_id]["status"] = "failed"
+    finally:
+        connection.close()
@@ -0,0 +1,53 @@
+"""Общие заготовки тестов: лаба на трех роутерах и сессия студента на ней"""
+import json
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from apps.game.models import PlayerProfile
+from apps.labs.engine.processor import IOSCommandProcessor
+from apps.labs.models import LabScenario, UserLabSession
+
+TOPOLOGY = {
+    "nodes": [{"id": "R1", "type": "router"}, {"id": "R2", "type": "router"}, {"id": "R3", "type": "router"}],
+    "links": [{"from": "R1", "from_iface": "Fa0/1", "to": "R2", "to_iface": "Fa0/0"},
+              {"from": "R2", "from_iface": "Fa0/1", "to": "R3", "to_iface": "Fa0/0"}],
+}
+
+# R1 поднимает Fa0/0, R2 и R3 - только hostname (полная проверка грузит все три устройства)
+CRITERIA = {
+    "R1": {"hostname": "Edge", "config_checks": [
+        {"path": ["interfaces", "FastEthernet0/0", "status"], "value": "up"}]},
+    "R2": {"hostname": "Core"},
+    "R3": {"hostname": "Branch"},
+}
+
+
+def make_lab(**fields):
+    fields = {"title": "test lab", "description": "", "topology_data": TOPOLOGY,
+              "success_criteria": CRITERIA, "allowed_devices": ["R1", "R2", "R3"], **fields}
+    return LabScenario.objects.create(**fields)
+
+
+def make_session(username="student", lab=None):
+    user = User.objects.create_user(username, password="secret")
+    PlayerProfile.objects.create(user=user)
+    session, _ = UserLabSession.start(user, lab or make_lab())
+    return session
+
+
+def run(session, *commands):
+    """Команды как в send_command: свежая сессия из БД и свой процессор на каждую"""
+    result = None
+    for command in commands:
+        session = UserLabSession.objects.get(pk=session.pk)
+        session.defer_writes()
+        result = IOSCommandProcessor(session).process_input(command)
+        session.flush_writes()
+    return result
+
+
+def post_command(client, session, command, **extra):
+    response = client.post(reverse("send_command", args=[session.pk]), json.dumps({"command": command, **extra}),
+                           content_type="application/json")
+    return response.json()
@@ -0,0 +1,105 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.labs.engine import baseconfig
+from apps.labs.lab_cache import get_lab
+from apps.labs.models import DeviceState, SessionMutation, UserLabSession
+
+from .helpers import TOPOLOGY, make_lab, make_session, run
+
+DEFAULT_ROUTE = {"0.0.0.0 0.0.0.0 10.0.0.1": {"network": "0.0.0.0", "mask": "0.0.0.0", "next_hop": "10.0.0.1"}}
+
+
+def seeded_lab():
+    """R1 с маршрутом по умолчанию от автора лабы"""
+    nodes = [dict(node) for node in TOPOLOGY["nodes"]]
+    nodes[0]["base_config"] = {"routes": DEFAULT_ROUTE}
+    return make_lab(topology_data={**TOPOLOGY, "nodes": nodes})
+
+
+def stored(session, device="R1"):
+    return DeviceState.objects.get(session=session, device=device).as_device()
+
+
+def loaded(session, device="R1"):
+    return UserLabSession.objects.get(pk=session.pk).load_devices([device])[device]["config"]
+
+
+class OverlayTests(TestCase):
+    """merge / diff: оверлей поверх базы и обратно"""
+
+    base = {"hostname": "R1", "services": {"a": True, "b": False}, "lines": {"con 0": {"login": False}}}
+
+    def test_round_trip(self):
+        config = baseconfig.merge(self.base, {})
+        config["hostname"] = "edge"
+        config["services"]["b"] = True
+        config["routes"] = DEFAULT_ROUTE
+        del config["lines"]
+        overlay = baseconfig.diff(config, self.base)
+        self.assertEqual(overlay, {"hostname": "edge", "services": {"b": True}, "routes": DEFAULT_ROUTE, "lines": None})
+        self.assertEqual(baseconfig.merge(self.base, overlay), config)
+
+    def test_base_untouched(self):
+        config = baseconfig.merge(self.base, {"services": {"a": None}})
+        self.assertEqual(config["services"], {"b": False})
+        config["lines"]["con 0"]["login"] = True
+        self.assertFalse(self.base["lines"]["con 0"]["login"])
+        # Порядок ключей - как в базе (от него зависит show running-config)
+        self.assertEqual(list(baseconfig.merge(self.base, {"hostname": "x", "extra": 1})),
+                         ["hostname", "services", "lines", "extra"])
+
+
+class LabBaseTests(TestCase):
+    """База устройства живет в LabDefinition, одна на все сессии"""
+
+    def test_seeded_from_topology(self):
+        lab = get_lab(seeded_lab().id)
+        base = lab.base_config("R1")
+        self.assertIs(lab.base_config("R1"), base)
+        self.assertEqual((base["hostname"], base["routes"]), ("R1", DEFAULT_ROUTE))
+        self.assertIn("vty 0 4", base["lines"])
+        self.assertNotIn("routes", lab.base_config("R2"))
+
+    def test_first_command_journals_cursor_only(self):
+        session = make_session()
+        run(session, "enable")
+        payload = SessionMutation.objects.get(session=session).payload
+        self.assertEqual(sorted(payload["set"]), ["context", "rev"])
+        self.assertNotIn("config", payload)
+        self.assertEqual(loaded(session)["lines"]["vty 5 15"], {"login": False})
+
+    def test_switch_device_uses_base(self):
+        session = make_session(lab=seeded_lab())
+        self.client.login(username="student", password="secret")
+        self.client.post(reverse("switch_device", args=[session.pk, "R2"]))
+        self.assertEqual(loaded(session, "R2"), get_lab(session.lab_id).base_config("R2"))
+
+
+class SnapshotTests(TestCase):
+    """В снимок уходит только оверлей; удаленный ключ базы - надгробие None"""
+
+    def setUp(self):
+        self.session = make_session(lab=seeded_lab())
+        UserLabSession.COMPACT_EVERY, self.compact_every = 3, UserLabSession.COMPACT_EVERY
+
+    def tearDown(self):
+        UserLabSession.COMPACT_EVERY = self.compact_every
+
+    def test_overlay_snapshot(self):
+        run(self.session, "configure terminal", "hostname edge", "end")
+        self.assertEqual(stored(self.session)["config"], {"hostname": "edge"})
+        self.assertEqual(loaded(self.session)["routes"], DEFAULT_ROUTE)
+
+    def test_tombstone(self):
+        run(self.session, "configure terminal", "no ip route 0.0.0.0 0.0.0.0", "end")
+        self.assertEqual(stored(self.session)["config"], {"routes": {"0.0.0.0 0.0.0.0 10.0.0.1": None}})
+        self.assertEqual(loaded(self.session)["routes"], {})
+
+    def test_full_legacy_snapshot(self):
+        config = {**get_lab(self.session.lab_id).base_config("R1"), "hostname": "legacy"}
+        DeviceState.objects.create(session=self.session, device="R1", config=config)
+        self.assertEqual(loaded(self.session), config)
+        # Следующее сворачивание ужимает снимок до оверлея
+        run(self.session, "configure terminal", "hostname edge", "end")
+        self.assertEqual(stored(self.session)["config"], {"hostname": "edge"})
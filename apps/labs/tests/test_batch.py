@@ -0,0 +1,74 @@
+import json
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from apps.labs.models import ConsoleEntry, SessionMutation, UserLabSession
+from apps.labs.websocket import TerminalConnection
+
+from .helpers import make_session
+
+PASTE = ["configure terminal", "hostname edge", "interface fa0/0", "ip address 10.0.0.1 255.255.255.0",
+         "no shutdown", "end"]
+
+
+class BatchViewTests(TestCase):
+    """Вставка конфига: строки подряд одним процессором, одна запись в конце"""
+
+    def setUp(self):
+        self.session = make_session()
+        self.client.login(username="student", password="secret")
+        self.url = reverse("send_batch", args=[self.session.pk])
+
+    def post(self, commands):
+        return self.client.post(self.url, json.dumps({"commands": commands}), content_type="application/json")
+
+    def test_context_carries_over(self):
+        data = self.post(PASTE).json()
+        self.assertEqual(data["status"], "ok")
+        self.assertEqual([r["prompt_before"] for r in data["results"]],
+                         ["R1#", "R1(config)#", "edge(config)#", "edge(config-if)#", "edge(config-if)#", "edge(config-if)#"])
+        self.assertEqual((data["prompt"], data["new_hostname"], data["completed"]), ("edge#", "edge", False))
+
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        iface = session.load_state()["R1"]["config"]["interfaces"]["FastEthernet0/0"]
+        self.assertEqual((iface["ip_address"], iface["status"]), ("10.0.0.1", "up"))
+
+    def test_one_coalesced_write(self):
+        self.post(PASTE)
+        # Инициализация R1 и шесть строк - одна мутация
+        self.assertEqual(SessionMutation.objects.filter(session=self.session).count(), 1)
+        self.assertEqual(ConsoleEntry.history(self.session, "R1"), PASTE)
+
+    def test_bad_payload(self):
+        self.assertEqual(self.post("configure terminal").status_code, 400)
+        self.assertEqual(self.post(["ok", 1]).status_code, 400)
+
+    @override_settings(LAB_BATCH_MAX_LINES=2)
+    def test_too_many_lines(self):
+        self.assertEqual(self.post(PASTE).status_code, 400)
+        self.assertFalse(ConsoleEntry.objects.exists())
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.post(PASTE).status_code, 403)
+
+
+class TerminalBatchTests(TestCase):
+    """Та же вставка по WebSocket - на живой сессии соединения"""
+
+    def setUp(self):
+        self.session = make_session()
+        self.conn = TerminalConnection(self.session.pk, self.session.user)
+        self.conn.load()
+
+    def test_batch_then_command(self):
+        reply = self.conn.run_batch(PASTE[:3])
+        self.assertEqual((reply["status"], reply["prompt"]), ("ok", "edge(config-if)#"))
+        # Следующая команда продолжает с контекста вставки
+        self.assertEqual(self.conn.run_command("no shutdown")["prompt"], "edge(config-if)#")
+
+    @override_settings(LAB_BATCH_MAX_LINES=2)
+    def test_bad_batch(self):
+        self.assertEqual(self.conn.run_batch(PASTE)["status"], "error")
+        self.assertEqual(self.conn.run_batch("hostname x")["status"], "error")
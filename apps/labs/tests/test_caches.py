@@ -0,0 +1,69 @@
+import sys
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.labs.engine import grading, network, paging
+from apps.labs.engine.render import RenderCache
+
+
+class ConcurrentCacheTests(SimpleTestCase):
+    """LRU-кэши процесса из нескольких потоков сразу (писатель, sync_to_async): без KeyError и лишних записей"""
+
+    def setUp(self):
+        # Переключение потоков почти на каждой инструкции - гонки проявляются сразу
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+    def hammer(self, func, threads=8, rounds=2000):
+        errors, start = [], threading.Barrier(threads)
+
+        def worker(n):
+            start.wait()
+            try:
+                for i in range(rounds):
+                    func(n, i)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in workers: thread.start()
+        for thread in workers: thread.join()
+        self.assertEqual(errors, [])
+
+    def test_render_cache(self):
+        cache = RenderCache(limit=16)
+        self.hammer(lambda n, i: list(cache.get_or_render(i % 40, lambda: iter(("a", "b")))))
+        self.assertLessEqual(len(cache._items), 16)
+
+    def test_pagers(self):
+        sessions = [SimpleNamespace(pk=pk) for pk in range(40)]
+
+        def step(n, i):
+            session = sessions[i % 40]
+            paging.keep_pager(session, "R1", paging.Pager("sh run", 1, iter(())))
+            paging.resume_pager(sessions[(i + n) % 40], "R1", "sh run", 1)
+            paging.drop_pager(session, "R1")
+
+        with mock.patch.object(paging, "MAX_PAGERS", 8):
+            self.hammer(step)
+        self.assertLessEqual(len(paging.PAGERS), 8)
+
+    def test_verdicts_and_networks(self):
+        evaluator = grading.CriteriaEvaluator({})
+        topology = network.Topology({})
+        sessions = [SimpleNamespace(pk=-pk, state_token=lambda: 1, virtual_config={}) for pk in range(1, 41)]
+
+        def step(n, i):
+            session = sessions[(i + n) % 40]
+            grading.remember(session, evaluator, frozenset())
+            grading.retoken(session, 1, 1)
+            network.get_network(session, topology)
+            network.carry_network(session, 2, "R1", set())
+
+        with mock.patch.object(grading, "MAX_CACHED_SESSIONS", 8), mock.patch.object(network, "MAX_CACHED_SESSIONS", 8):
+            self.hammer(step)
+        self.assertLessEqual(len(grading._verdicts), 8)
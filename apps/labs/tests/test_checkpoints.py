@@ -0,0 +1,84 @@
+from django.test import TestCase
+
+from apps.labs.models import ConfigBlob, SessionCheckpoint, UserLabSession
+
+from .helpers import make_lab, make_session, run
+
+
+def hostname(session, device="R1"):
+    session = UserLabSession.objects.get(pk=session.pk)
+    session.load_state()
+    return session.virtual_config[device]["config"]["hostname"]
+
+
+class UndoTests(TestCase):
+    """Стек отмены: шаг на каждую команду, изменившую конфиг"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "enable", "configure terminal", "hostname first", "hostname second")
+
+    def test_undo_steps_back(self):
+        # enable / conf t конфиг не меняют - шагов только два
+        self.assertEqual(self.session.undo_depth(), 2)
+        self.assertEqual(self.session.undo(), "R1")
+        self.assertEqual(hostname(self.session), "first")
+        UserLabSession.objects.get(pk=self.session.pk).undo()
+        self.assertEqual(hostname(self.session), "R1")
+        self.assertIsNone(self.session.undo())
+
+    def test_show_does_not_push(self):
+        run(self.session, "do show running-config")
+        self.assertEqual(self.session.undo_depth(), 2)
+
+    def test_trim(self):
+        SessionCheckpoint.trim_undo(self.session, keep=1)
+        self.assertEqual(self.session.undo_depth(), 1)
+        self.session.undo()
+        self.assertEqual(hostname(self.session), "first")
+
+
+class CheckpointTests(TestCase):
+    """Именованные снимки: восстановление целиком, без проигрывания журнала"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "enable", "configure terminal", "hostname saved")
+        self.checkpoint = UserLabSession.objects.get(pk=self.session.pk).save_checkpoint("before")
+        run(self.session, "hostname changed", "exit", "exit")
+
+    def test_restore(self):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        session.restore_checkpoint(self.checkpoint)
+        self.assertEqual(hostname(self.session), "saved")
+        # Журнал пуст, стек отмены сброшен
+        self.assertFalse(session.mutations.exists())
+        self.assertEqual(session.undo_depth(), 0)
+        # Команды после восстановления идут от снимка
+        run(session, "enable", "configure terminal", "hostname next")
+        self.assertEqual(hostname(session), "next")
+
+    def test_unchanged_devices_share_blobs(self):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        changed = session.save_checkpoint("after")
+        self.assertNotEqual(changed.devices, self.checkpoint.devices)
+        session.restore_checkpoint(self.checkpoint)
+        blobs = ConfigBlob.objects.count()
+        # Тот же конфиг - тот же хэш, новых блобов нет
+        again = UserLabSession.objects.get(pk=self.session.pk).save_checkpoint("again")
+        self.assertEqual(again.devices, self.checkpoint.devices)
+        self.assertEqual(ConfigBlob.objects.count(), blobs)
+
+    def test_shared_checkpoints(self):
+        other = make_session("other", lab=self.session.lab)
+        stranger = make_session("stranger", lab=make_lab(title="other lab"))
+        self.assertNotIn(self.checkpoint, SessionCheckpoint.available(other))
+        shared = UserLabSession.objects.get(pk=self.session.pk).save_checkpoint("for all", shared=True)
+        self.assertEqual(list(SessionCheckpoint.available(other)), [shared])
+        self.assertNotIn(shared, SessionCheckpoint.available(stranger))
+
+        other.restore_checkpoint(shared)
+        self.assertEqual(hostname(other), "changed")
+        # Чужой снимок восстанавливается в свою сессию, исходная не тронута
+        self.assertEqual(hostname(self.session), "changed")
+        self.assertTrue(self.session.mutations.exists())
@@ -0,0 +1,73 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from apps.labs.models import ConsoleEntry
+
+from .helpers import make_session, run
+
+
+class ConsoleEntryTests(TestCase):
+    """Консоль устройства - строки ConsoleEntry, а не список в virtual_config"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "", "configure terminal", "hostname edge", "do show running-config")
+
+    def test_rows_per_command(self):
+        rows = ConsoleEntry.objects.filter(session=self.session, device="R1").order_by("id")
+        self.assertEqual([(row.kind, row.text) for row in rows][:2], [("cmd", ""), ("cmd", "configure terminal")])
+        self.assertEqual([row.kind for row in rows][2:], ["out", "cmd", "cmd", "out"])
+        self.assertEqual(rows.last().kind, "out")
+        self.assertNotIn("console_logs", self.session.virtual_config.get("R1", {}))
+
+    def test_history_skips_empty_input(self):
+        self.assertEqual(ConsoleEntry.history(self.session, "R1"),
+                         ["configure terminal", "hostname edge", "do show running-config"])
+        self.assertEqual(ConsoleEntry.history(self.session, "R1", limit=2),
+                         ["hostname edge", "do show running-config"])
+
+    @override_settings(LAB_CONSOLE_PAGE_SIZE=3)
+    def test_pages(self):
+        ids = list(ConsoleEntry.objects.filter(session=self.session).order_by("id").values_list("id", flat=True))
+        logs, has_more = ConsoleEntry.page(self.session, "R1")
+        self.assertEqual([log["id"] for log in logs], ids[-3:])
+        self.assertTrue(has_more)
+        logs, has_more = ConsoleEntry.page(self.session, "R1", before=ids[2])
+        self.assertEqual([log["id"] for log in logs], ids[:2])
+        self.assertFalse(has_more)
+        self.assertEqual(logs[1], {"id": ids[1], "type": "cmd", "text": "configure terminal", "prompt": "R1#"})
+
+    def test_trim_keeps_newest(self):
+        ids = list(ConsoleEntry.objects.filter(session=self.session).order_by("id").values_list("id", flat=True))
+        ConsoleEntry.trim(self.session, "R1", keep=2)
+        self.assertEqual(list(ConsoleEntry.objects.filter(session=self.session).values_list("id", flat=True)),
+                         ids[-2:])
+
+    def test_reset_clears_console(self):
+        self.session.reset_state()
+        self.assertFalse(ConsoleEntry.objects.filter(session=self.session).exists())
+
+
+@override_settings(LAB_CONSOLE_PAGE_SIZE=2)
+class ConsoleHistoryViewTests(TestCase):
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "", "show running-config")
+        self.client.login(username="student", password="secret")
+        self.url = reverse("console_history", args=[self.session.pk, "R1"])
+
+    def test_older_page(self):
+        oldest = ConsoleEntry.objects.filter(session=self.session).order_by("id").first()
+        data = self.client.get(self.url, {"before": oldest.id + 1}).json()
+        self.assertEqual((data["status"], [log["id"] for log in data["logs"]], data["has_more"]),
+                         ("ok", [oldest.id], False))
+        self.assertTrue(self.client.get(self.url).json()["has_more"])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(self.url, {"before": "x"}).status_code, 400)
+
+    def test_other_users_session(self):
+        make_session("other")
+        self.client.login(username="other", password="secret")
+        self.assertEqual(self.client.get(self.url).status_code, 404)
@@ -0,0 +1,131 @@
+import random
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from apps.labs.engine.digest import ConfigDigest
+from apps.labs.engine.grading import CriteriaEvaluator, _verdicts
+
+from .helpers import CRITERIA, make_lab, make_session, run
+
+
+def device(hostname="R1", status=None):
+    interfaces = {"FastEthernet0/0": {"status": status}} if status else {}
+    return {"config": {"hostname": hostname, "interfaces": interfaces}}
+
+
+class EvaluatorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.evaluator = CriteriaEvaluator(CRITERIA)
+
+    def test_compiled_checks(self):
+        self.assertEqual(len(self.evaluator.checks), 4)
+        self.assertEqual(self.evaluator.devices, ["R1", "R2", "R3"])
+        self.assertEqual([check.expected for check in self.evaluator.checks], ["edge", "up", "core", "branch"])
+
+    def test_values_are_normalized(self):
+        config = {"R1": device("EDGE", status="UP"), "R2": device(" core "), "R3": device("Branch")}
+        self.assertEqual(self.evaluator.failing(config), frozenset())
+
+    def test_malformed_criteria(self):
+        self.assertFalse(CriteriaEvaluator("not a dict"))
+        self.assertFalse(CriteriaEvaluator({"R1": ["hostname"]}))
+
+    def test_affected_by_prefix_in_both_directions(self):
+        hostname, status = 0, 1
+        self.assertEqual(self.evaluator.affected("R1", {("hostname",)}), {hostname})
+        # Изменено поддерево над проверкой и значение под ней
+        self.assertEqual(self.evaluator.affected("R1", {("interfaces",)}), {status})
+        self.assertEqual(self.evaluator.affected("R1", {("interfaces", "FastEthernet0/0", "status", "x")}), {status})
+        self.assertEqual(self.evaluator.affected("R1", {()}), {hostname, status})
+        self.assertEqual(self.evaluator.affected("R2", {("interfaces",)}), set())
+
+    def test_content_key_covers_checked_subtrees_only(self):
+        config = device("edge", status="up")["config"]
+        key = self.evaluator.content_key("R1", ConfigDigest.of(1, config))
+        # lines проверки R1 не читают, hostname - читают
+        self.assertEqual(self.evaluator.content_key("R1", ConfigDigest.of(2, {**config, "lines": {"con 0": {}}})), key)
+        self.assertNotEqual(self.evaluator.content_key("R1", ConfigDigest.of(3, {**config, "hostname": "x"})), key)
+        # Проверка с пустым путем зависит от всего config
+        whole = CriteriaEvaluator({"R1": {"config_checks": [{"path": [], "value": ""}]}})
+        self.assertEqual(whole.content_key("R1", ConfigDigest.of(1, config)), ConfigDigest.of(1, config).root)
+
+    def test_recheck_matches_full_grade(self):
+        # Случайные изменения путей: перепроверка тронутого = полная проверка
+        rng = random.Random(5)
+        paths = [("hostname",), ("interfaces",), ("interfaces", "FastEthernet0/0"),
+                 ("interfaces", "FastEthernet0/0", "status"), ("lines",)]
+        values = {"hostname": ["edge", "core", "branch", "x"], "status": ["up", "down"]}
+        config = {name: device() for name in ("R1", "R2", "R3")}
+        failing = self.evaluator.failing(config)
+        for _ in range(500):
+            name, path = rng.choice(["R1", "R2", "R3"]), rng.choice(paths)
+            data = config[name]["config"]
+            if path == ("hostname",):
+                data["hostname"] = rng.choice(values["hostname"])
+            elif path == ("lines",):
+                data["lines"] = {"con 0": {"login": rng.random() < 0.5}}
+            elif path == ("interfaces",):
+                data["interfaces"] = {}
+            else:
+                data["interfaces"]["FastEthernet0/0"] = {"status": rng.choice(values["status"])}
+            failing = self.evaluator.recheck(config, failing, name, {path})
+            self.assertEqual(failing, self.evaluator.failing(config))
+
+
+class SessionGradingTests(TestCase):
+    """Проверка задания на командах: полная один раз, дальше - перепроверка тронутого"""
+
+    def setUp(self):
+        self.session = make_session()
+
+    def test_completion(self):
+        run(self.session, "conf t", "hostname Edge", "int fa0/0", "no shut", "exit")
+        run(self.session, "do show running-config")
+        for device, hostname in (("R2", "Core"), ("R3", "Branch")):
+            self.session.refresh_from_db()
+            self.session.current_device = device
+            self.session.save(update_fields=["current_device"])
+            result = run(self.session, "conf t", f"hostname {hostname}")
+        self.assertTrue(result["is_completed"])
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.is_completed)
+
+    def test_verdict_remembered(self):
+        run(self.session, "conf t", "hostname Edge")
+        evaluator, _, failing = _verdicts[self.session.pk]
+        self.assertEqual(len(failing), 3)
+        self.assertNotIn(0, failing)
+
+
+class SharedVerdictTests(TestCase):
+    """Вердикт устройства по содержимому конфига: одинаковые конфиги разных студентов проверяются один раз"""
+
+    def setUp(self):
+        lab = make_lab()
+        self.first = make_session("first", lab)
+        self.second = make_session("second", lab)
+
+    def graded(self, session, *commands):
+        """Устройства, проверенные заново (не из кэша) за эти команды"""
+        spy = mock.patch.object(CriteriaEvaluator, "device_failing", autospec=True,
+                                side_effect=CriteriaEvaluator.device_failing)
+        with spy as calls:
+            run(session, *commands)
+        return [call.args[1] for call in calls.call_args_list]
+
+    def test_same_config_shares_verdict(self):
+        self.assertIn("R1", self.graded(self.first, "conf t"))
+        # У второго студента своя сессия и своя ревизия, но тот же конфиг R1
+        self.assertNotIn("R1", self.graded(self.second, "conf t"))
+
+    def test_different_config_is_graded(self):
+        run(self.first, "conf t")
+        run(self.second, "conf t", "hostname Edge")
+        _verdicts.pop(self.second.pk)
+        self.assertIn("R1", self.graded(self.second, "end"))
+        # ... а после того же изменения у первого - уже из кэша
+        run(self.first, "hostname Edge")
+        _verdicts.pop(self.first.pk)
+        self.assertNotIn("R1", self.graded(self.first, "end"))
@@ -0,0 +1,97 @@
+import hashlib
+import json
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from apps.labs.engine.dispatch import MSG_INVALID
+from apps.labs.engine.grammar import CONTEXT_ROOTS, GRAMMAR, GRAMMAR_BUNDLE, GRAMMAR_VERSION, PROMPT_KEYS
+
+from .helpers import make_session, run
+
+
+class GrammarTests(SimpleTestCase):
+
+    def test_do_in_every_config_mode(self):
+        for context in CONTEXT_ROOTS:
+            if context == "privileged": continue
+            with self.subTest(context=context):
+                self.assertIs(GRAMMAR[context].children["do"], GRAMMAR["privileged"])
+
+    def test_no_returns_to_own_root(self):
+        self.assertIs(GRAMMAR["interface_config"].children["no"], GRAMMAR["interface_config"])
+
+
+class SubModeCommandTests(TestCase):
+    """"do ..." выполняет exec-команду из любого режима конфигурации"""
+
+    def setUp(self):
+        self.session = make_session()
+
+    def test_do_show(self):
+        for enter in (("int fa0/0",), ("line con 0",), ("crypto isakmp policy 10",), ()):
+            with self.subTest(mode=enter):
+                result = run(self.session, "conf t", *enter, "do sh ip int br")
+                self.assertTrue(result["output"].startswith("Interface"), result["output"])
+                run(self.session, "end")
+
+    def test_do_ping_in_interface_mode(self):
+        result = run(self.session, "conf t", "int fa0/0", "do ping 10.0.0.1")
+        self.assertIn("Success rate", result["output"])
+
+    def test_unknown_command(self):
+        self.assertEqual(run(self.session, "conf t", "int fa0/0", "do frobnicate")["output"], MSG_INVALID)
+
+
+class HiddenShowTests(TestCase):
+    """"show ..." в global config без do - как до грамматики: только полным словом и без справки"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "conf t")
+
+    def test_full_word(self):
+        self.assertEqual(run(self.session, "show running-config | include hostname")["output"], "hostname R1")
+        self.assertTrue(run(self.session, "show ip int br")["output"].startswith("Interface"))
+
+    def test_not_abbreviated_or_listed(self):
+        self.assertEqual(run(self.session, "sh run")["output"], MSG_INVALID)
+        self.assertNotIn("show", run(self.session, "?")["output"])
+        self.assertIn("running-config", run(self.session, "show ?")["output"])
+
+
+class BundleTests(SimpleTestCase):
+    """Грамматика для браузера (lab.js): бандл по URL с версией-хэшем"""
+
+    def setUp(self):
+        self.bundle = json.loads(GRAMMAR_BUNDLE)
+        self.url = reverse("lab_grammar", args=[GRAMMAR_VERSION])
+
+    def test_version_is_content_hash(self):
+        self.assertEqual(GRAMMAR_VERSION, hashlib.blake2b(GRAMMAR_BUNDLE, digest_size=8).hexdigest())
+
+    def test_bundle_mirrors_grammar(self):
+        self.assertEqual(self.bundle["prompts"], dict(PROMPT_KEYS))
+        self.assertEqual(set(self.bundle["contexts"]), set(GRAMMAR))
+        nodes, contexts = self.bundle["nodes"], self.bundle["contexts"]
+        for context, root in GRAMMAR.items():
+            with self.subTest(context=context):
+                entry = nodes[contexts[context]]
+                self.assertEqual([tuple(option) for option in entry["options"]], [tuple(o) for o in root.options])
+                self.assertEqual(set(entry["children"]), set(root.children))
+        # Общие узлы остаются общими: "do" ведет в тот же узел, что и privileged
+        global_root = nodes[contexts["global_config"]]
+        self.assertEqual(global_root["children"]["do"], contexts["privileged"])
+        self.assertEqual(global_root["children"]["no"], contexts["global_config"])
+
+    def test_view_cached_forever(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, GRAMMAR_BUNDLE)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn(GRAMMAR_VERSION, response["ETag"])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_stale_version_redirects(self):
+        response = self.client.get(reverse("lab_grammar", args=["0" * 16]))
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
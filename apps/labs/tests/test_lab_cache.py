@@ -0,0 +1,97 @@
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.labs import lab_cache
+from apps.labs.lab_cache import get_lab, invalidate_lab
+from apps.labs.models import LabScenario
+
+from .helpers import make_lab, make_session
+
+
+class LabCacheTests(TestCase):
+    """Разобранная лаба живет в памяти процесса до сохранения или смены updated_at"""
+
+    def setUp(self):
+        invalidate_lab()
+        self.lab = make_lab()
+
+    def tearDown(self):
+        invalidate_lab()
+
+    def test_cached(self):
+        definition = get_lab(self.lab.id)
+        with self.assertNumQueries(0):
+            self.assertIs(get_lab(self.lab.id), definition)
+        self.assertEqual(definition.allowed_devices, ("R1", "R2", "R3"))
+        self.assertEqual(len(definition.evaluator.checks), 4)
+
+    def test_save_invalidates(self):
+        definition = get_lab(self.lab.id)
+        self.lab.success_criteria = {"R1": {"hostname": "Other"}}
+        self.lab.save()
+        fresh = get_lab(self.lab.id)
+        self.assertIsNot(fresh, definition)
+        self.assertEqual(len(fresh.evaluator.checks), 1)
+
+    def test_delete_invalidates(self):
+        get_lab(self.lab.id)
+        lab_id = self.lab.id
+        self.lab.delete()
+        with self.assertRaises(LabScenario.DoesNotExist):
+            get_lab(lab_id)
+
+    def test_other_process_edit(self):
+        definition = get_lab(self.lab.id)
+        # Другой процесс: UPDATE без сигнала
+        LabScenario.objects.filter(id=self.lab.id).update(title="edited", updated_at=timezone.now())
+        self.assertIs(get_lab(self.lab.id), definition)
+        with override_settings(LAB_CACHE_TTL=0):
+            self.assertEqual(get_lab(self.lab.id).title, "edited")
+            # Версия не менялась - один запрос за updated_at, тот же объект
+            current = get_lab(self.lab.id)
+            with self.assertNumQueries(1):
+                self.assertIs(get_lab(self.lab.id), current)
+
+    def test_bounded(self):
+        labs = [make_lab(title=f"lab {i}") for i in range(3)]
+        with mock.patch.object(lab_cache, "MAX_CACHED_LABS", 2):
+            for lab in labs: get_lab(lab.id)
+        self.assertEqual(list(lab_cache._labs), [labs[1].id, labs[2].id])
+
+    def test_definition(self):
+        lab = make_lab(topology_data=json.dumps({"nodes": [{"id": "SW1", "type": "switch"}, "junk"]}),
+                       allowed_devices=[])
+        definition = get_lab(lab.id)
+        self.assertEqual(definition.device_type("SW1"), "switch")
+        self.assertEqual(definition.device_type("R9"), "router")
+        self.assertTrue(definition.allows("R1"))
+        self.assertFalse(definition.allows("SW1"))
+
+
+class WarmCommandTests(TestCase):
+
+    def setUp(self):
+        invalidate_lab()
+        self.session = make_session()
+        self.client.login(username="student", password="secret")
+
+    def post(self, command):
+        return self.client.post(reverse("send_command", args=[self.session.pk]),
+                                json.dumps({"command": command}), content_type="application/json")
+
+    def test_no_lab_query(self):
+        self.post("show clock")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post("configure terminal").status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if "labs_labscenario" in q["sql"]])
+
+    def test_switch_device_uses_topology(self):
+        data = self.client.post(reverse("switch_device", args=[self.session.pk, "R2"])).json()
+        self.assertEqual((data["status"], data["device_type"]), ("ok", "router"))
+        self.assertEqual(self.client.post(reverse("switch_device", args=[self.session.pk, "R9"])).status_code, 403)
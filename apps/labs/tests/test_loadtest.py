@@ -0,0 +1,138 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from urllib.parse import parse_qs
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+
+from apps.labs.loadtest import COMMANDS, Recorder, make_students, run_load
+from apps.labs.management.commands.load_lab import USER_PREFIX, Command
+
+from .helpers import make_lab
+
+OPTIONS = {"think": 0, "paste_every": 5, "paste_size": 12, "timeout": 10}
+
+
+class RecorderTests(SimpleTestCase):
+
+    def test_report(self):
+        recorder = Recorder()
+        for ms in range(1, 101):
+            recorder.add("send_command", ms / 1000, ok=ms % 10 != 0, locked=ms == 100)
+        recorder.add("office", 0.5, ok=True)
+        report = recorder.report(2.0)
+        row = report["endpoints"]["send_command"]
+        self.assertEqual((row["requests"], row["errors"], row["locked"], row["rps"]), (100, 10, 1, 50.0))
+        self.assertEqual((row["p50_ms"], row["max_ms"]), (50.0, 100.0))
+        self.assertEqual((report["requests"], report["errors"], report["locked"]), (101, 10, 1))
+        self.assertEqual(list(report["endpoints"]), ["office", "send_command"])
+
+    def test_empty_run(self):
+        self.assertEqual(Recorder().report(0)["rps"], 0)
+
+
+class LoadCommandTests(TestCase):
+
+    def test_no_lab(self):
+        with self.assertRaises(CommandError):
+            call_command("load_lab", "--users", "1", stdout=StringIO())
+
+    def test_accounts_reused_and_cleaned_up(self):
+        lab = make_lab()
+        first = Command()._accounts(lab, 3)
+        again = Command()._accounts(lab, 3)
+        self.assertEqual(first, again)
+        self.assertEqual(User.objects.filter(username__startswith=USER_PREFIX).count(), 3)
+        call_command("load_lab", "--cleanup", stdout=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith=USER_PREFIX).exists())
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Сервер-заглушка: отвечает 200 на все и запоминает запросы"""
+    requests = []
+    # Сколько первых POST на логин "не пускают" (без sessionid)
+    reject_logins = 0
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        self.requests.append((self.command, self.path, self.headers.get("Content-Type"), body))
+        self.send_response(200)
+        if self.path == PATHS["login"] and self.command == "GET":
+            self.send_header("Set-Cookie", "csrftoken=stub-token; Path=/")
+        elif self.path == PATHS["login"] and StubHandler.reject_logins > 0:
+            StubHandler.reject_logins -= 1
+        elif self.path == PATHS["login"]:
+            self.send_header("Set-Cookie", "sessionid=stub-session; Path=/")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+PATHS = {"login": "/login/", "office": "/office/", "lab_list": "/labs/", "workspace": "/ws/",
+         "command": "/command/", "batch": "/batch/", "switch": "/switch/{device}/"}
+
+
+class StudentTests(SimpleTestCase):
+    """Виртуальные студенты против сервера-заглушки: порядок входа, тела запросов, статистика"""
+
+    def setUp(self):
+        StubHandler.requests, StubHandler.reject_logins = [], 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.stop()
+
+    def stop(self):
+        if self.server is None: return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+    def test_short_run(self):
+        students, recorder = make_students(self.url, [("s1", "pw", PATHS), ("s2", "pw", PATHS)], ["R1", "R2"], OPTIONS)
+        report = recorder.report(run_load(students, 0.3))
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["endpoints"]["login"]["requests"], 2)
+        self.assertGreater(report["endpoints"]["send_command"]["requests"], 0)
+
+        requests = StubHandler.requests
+        # Логин: форма, затем POST с csrf-токеном из cookie
+        logins = sorted(parse_qs(body)["username"] + parse_qs(body)["csrfmiddlewaretoken"]
+                        for method, path, _, body in requests if method == "POST" and path == PATHS["login"])
+        self.assertEqual(logins, [["s1", "stub-token"], ["s2", "stub-token"]])
+        for method, path, content_type, body in requests:
+            if path == PATHS["command"]:
+                self.assertEqual(content_type, "application/json")
+                self.assertIn(json.loads(body)["command"], COMMANDS)
+            elif path == PATHS["batch"]:
+                self.assertTrue(json.loads(body)["commands"])
+
+    def test_login_retry(self):
+        StubHandler.reject_logins = 1
+        students, recorder = make_students(self.url, [("s1", "pw", PATHS)], ["R1"], OPTIONS)
+        report = recorder.report(run_load(students, 0.1))
+        self.assertEqual(report["endpoints"]["login"]["requests"], 2)
+        self.assertGreater(report["endpoints"]["send_command"]["requests"], 0)
+
+    def test_login_gives_up(self):
+        StubHandler.reject_logins = 3
+        students, recorder = make_students(self.url, [("s1", "pw", PATHS)], ["R1"], OPTIONS)
+        report = recorder.report(run_load(students, 0.1))
+        self.assertEqual(report["endpoints"]["login"]["requests"], 3)
+        self.assertNotIn("send_command", report["endpoints"])
+
+    def test_unreachable_server(self):
+        self.stop()
+        students, recorder = make_students(self.url, [("s1", "pw", PATHS)], ["R1"], OPTIONS)
+        report = recorder.report(run_load(students, 0))
+        self.assertEqual(report["errors"], report["requests"])
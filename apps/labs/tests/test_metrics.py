@@ -0,0 +1,90 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from apps.labs.engine.processor import COMMANDS
+from apps.labs.metrics import BUCKETS, REGISTRY, Registry, span
+
+from .helpers import make_session
+
+
+class RegistryTests(SimpleTestCase):
+
+    def test_render(self):
+        registry = Registry()
+        registry.inc("lab_requests_total", endpoint="send_command", status="200")
+        registry.inc("lab_requests_total", 2, endpoint="send_command", status="200")
+        for value in (0.0002, 0.003, 20):
+            registry.observe("lab_request_seconds", value, endpoint="send_command")
+        text = registry.render(extra=[("lab_writer_jobs_total", "counter", "jobs", 7)])
+        lines = text.splitlines()
+        self.assertIn("# TYPE lab_requests_total counter", lines)
+        self.assertIn('lab_requests_total{endpoint="send_command",status="200"} 3', lines)
+        # Корзины накопительные, +Inf - все наблюдения
+        self.assertIn('lab_request_seconds_bucket{endpoint="send_command",le="0.00025"} 1', lines)
+        self.assertIn('lab_request_seconds_bucket{endpoint="send_command",le="0.005"} 2', lines)
+        self.assertIn('lab_request_seconds_bucket{endpoint="send_command",le="+Inf"} 3', lines)
+        self.assertIn('lab_request_seconds_count{endpoint="send_command"} 3', lines)
+        self.assertEqual(len([line for line in lines if line.startswith("lab_request_seconds_bucket")]),
+                         len(BUCKETS) + 1)
+        self.assertEqual(lines[-1], "lab_writer_jobs_total 7")
+
+    def test_label_escaping(self):
+        registry = Registry()
+        registry.inc("x_total", family='say "hi"\\\n')
+        self.assertIn('x_total{family="say \\"hi\\"\\\\\\n"} 1', registry.render())
+
+    @override_settings(LAB_METRICS=False)
+    def test_disabled(self):
+        REGISTRY.clear()
+        with span("dispatch"): pass
+        self.assertEqual(REGISTRY.render(), "\n")
+
+
+class FamilyTests(SimpleTestCase):
+    """Метка команды - шаблон из таблицы, а не текст студента"""
+
+    def family(self, context, line):
+        return COMMANDS.family(context, line.split())
+
+    def test_families(self):
+        self.assertEqual(self.family("interface_config", "ip address 10.0.0.1 255.0.0.0"), "ip address")
+        self.assertEqual(self.family("interface_config", "no shutdown"), "no shutdown")
+        self.assertEqual(self.family("global_config", "hostname anything-at-all"), "hostname")
+        self.assertEqual(self.family("global_config", "frobnicate"), "invalid")
+        self.assertEqual(self.family("no_such_mode", "hostname x"), "unknown")
+
+
+class MetricsEndpointTests(TestCase):
+
+    def setUp(self):
+        REGISTRY.clear()
+        self.url = reverse("lab_metrics")
+
+    def test_access(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        make_session()
+        self.client.login(username="student", password="secret")
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        User.objects.create_user("admin", password="secret", is_staff=True)
+        self.client.login(username="admin", password="secret")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(LAB_METRICS_TOKEN="scrape")
+    def test_token(self):
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer scrape").status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+    @override_settings(LAB_METRICS_TOKEN="scrape")
+    def test_command_recorded(self):
+        session = make_session()
+        self.client.login(username="student", password="secret")
+        self.client.post(reverse("send_command", args=[session.pk]), json.dumps({"command": "show ip route"}),
+                         content_type="application/json")
+        text = self.client.get(self.url, HTTP_AUTHORIZATION="Bearer scrape").content.decode()
+        self.assertIn('lab_requests_total{endpoint="send_command",status="200"} 1', text)
+        self.assertIn(f'lab_command_seconds_count{{family="show ip route",lab="{session.lab_id}"}} 1', text)
+        self.assertIn('lab_span_seconds_count{endpoint="send_command",span="dispatch"} 1', text)
+        self.assertIn("lab_render_cache_misses_total", text)
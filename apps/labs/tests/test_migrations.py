@@ -0,0 +1,147 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Перенос данных в миграции: схема migrate_from, данные через исторические модели (before),
+    migrate до migrate_to, проверки на исторических моделях новой схемы (self.apps).
+    """
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        self.apps = self._migrate(self.migrate_from)
+        self.before(self.apps)
+        self.apps = self._migrate(self.migrate_to)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    @staticmethod
+    def _migrate(name):
+        target = [("labs", name)]
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        executor.loader.build_graph()
+        return executor.loader.project_state(target).apps
+
+    def before(self, apps):
+        pass
+
+    def make_session(self, apps, username="student", **fields):
+        User = apps.get_model("auth", "User")
+        LabScenario = apps.get_model("labs", "LabScenario")
+        UserLabSession = apps.get_model("labs", "UserLabSession")
+        user, _ = User.objects.get_or_create(username=username)
+        lab = LabScenario.objects.create(title="lab", description="")
+        return UserLabSession.objects.create(user=user, lab=lab, **fields)
+
+
+class MoveConsoleLogsTests(MigrationTestCase):
+    """0006: console_logs/history из virtual_config и журнала -> ConsoleEntry"""
+    migrate_from = "0005_sessionmutation"
+    migrate_to = "0006_consoleentry"
+
+    def before(self, apps):
+        SessionMutation = apps.get_model("labs", "SessionMutation")
+        self.session_id = self.make_session(apps, virtual_config={"R1": {
+            "config": {"hostname": "R1"},
+            "console_logs": [{"type": "cmd", "text": "en", "prompt": "R1>"}, {"type": "out", "text": "ok"}],
+            "history": ["en"],
+        }}).id
+        SessionMutation.objects.create(session_id=self.session_id, device="R1", payload={
+            "set": {"context": "global_config"},
+            "append": {"console_logs": [{"type": "cmd", "text": "conf t", "prompt": "R1#"}]},
+        })
+
+    def test_logs_moved_in_order(self):
+        ConsoleEntry = self.apps.get_model("labs", "ConsoleEntry")
+        rows = ConsoleEntry.objects.filter(session_id=self.session_id).order_by("id")
+        self.assertEqual([(r.device, r.kind, r.text, r.prompt) for r in rows],
+                         [("R1", "cmd", "en", "R1>"), ("R1", "out", "ok", ""), ("R1", "cmd", "conf t", "R1#")])
+
+    def test_state_cleaned(self):
+        session = self.apps.get_model("labs", "UserLabSession").objects.get(id=self.session_id)
+        self.assertEqual(session.virtual_config, {"R1": {"config": {"hostname": "R1"}}})
+        mutation = self.apps.get_model("labs", "SessionMutation").objects.get(session_id=self.session_id)
+        self.assertEqual(mutation.payload, {"set": {"context": "global_config"}})
+
+
+class BackfillProgressTests(MigrationTestCase):
+    """0010: PlayerProgress из уже существующих сессий"""
+    migrate_from = "0009_playerprogress"
+    migrate_to = "0010_backfill_playerprogress"
+
+    def before(self, apps):
+        done = self.make_session(apps, is_completed=True)
+        first = self.make_session(apps)
+        second = self.make_session(apps)
+        self.labs = [done.lab_id, first.lab_id, second.lab_id]
+        self.done_lab, self.active_id = done.lab_id, first.id
+        self.user_id = done.user_id
+        apps.get_model("auth", "User").objects.create(username="idle")
+
+    def test_progress_backfilled(self):
+        PlayerProgress = self.apps.get_model("labs", "PlayerProgress")
+        self.assertEqual(PlayerProgress.objects.count(), 1)
+        progress = PlayerProgress.objects.get(user_id=self.user_id)
+        self.assertEqual(progress.started, sorted(self.labs))
+        self.assertEqual(progress.completed, [self.done_lab])
+        # Активная - первая незавершенная
+        self.assertEqual(progress.active_session_id, self.active_id)
+
+    def test_reverse_clears(self):
+        apps = self._migrate(self.migrate_from)
+        self.assertFalse(apps.get_model("labs", "PlayerProgress").objects.exists())
+
+
+class BackfillRewardsTests(MigrationTestCase):
+    """0011: завершенные сессии уже награждены - записи журнала без повторного начисления"""
+    migrate_from = "0010_backfill_playerprogress"
+    migrate_to = "0011_rewardentry"
+
+    def before(self, apps):
+        self.done = self.make_session(apps, is_completed=True)
+        self.make_session(apps)
+        apps.get_model("labs", "LabScenario").objects.filter(id=self.done.lab_id).update(reward_money=300, reward_xp=40)
+
+    def test_completed_sessions_rewarded(self):
+        RewardEntry = self.apps.get_model("labs", "RewardEntry")
+        entries = list(RewardEntry.objects.values_list("session_id", "user_id", "lab_id", "money", "xp"))
+        self.assertEqual(entries, [(self.done.id, self.done.user_id, self.done.lab_id, 300, 40)])
+
+
+class SplitVirtualConfigTests(MigrationTestCase):
+    """0013: virtual_config сессии -> строки DeviceState (и обратно)"""
+    migrate_from = "0012_checkpoints"
+    migrate_to = "0013_devicestate"
+
+    def before(self, apps):
+        self.session_id = self.make_session(apps, virtual_config={
+            "R1": {"config": {"hostname": "edge"}, "context": "interface_config",
+                   "current_iface": "FastEthernet0/0", "rev": 7, "history": ["en"]},
+            "R2": {"config": {}},
+            "broken": "not a device",
+        }).id
+        self.make_session(apps, username="empty")
+
+    def test_devices_split(self):
+        DeviceState = self.apps.get_model("labs", "DeviceState")
+        rows = {row.device: row for row in DeviceState.objects.filter(session_id=self.session_id)}
+        self.assertEqual(set(rows), {"R1", "R2"})
+        r1, r2 = rows["R1"], rows["R2"]
+        self.assertEqual((r1.config, r1.context, r1.current_iface, r1.current_line, r1.rev),
+                         ({"hostname": "edge"}, "interface_config", "FastEthernet0/0", None, 7))
+        self.assertEqual((r2.config, r2.context, r2.rev), ({}, "privileged", None))
+        self.assertEqual(DeviceState.objects.count(), 2)
+
+    def test_reverse_joins(self):
+        apps = self._migrate(self.migrate_from)
+        session = apps.get_model("labs", "UserLabSession").objects.get(id=self.session_id)
+        self.assertEqual(session.virtual_config, {
+            "R1": {"config": {"hostname": "edge"}, "context": "interface_config",
+                   "current_iface": "FastEthernet0/0", "rev": 7},
+            "R2": {"config": {}, "context": "privileged"},
+        })
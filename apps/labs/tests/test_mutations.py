@@ -0,0 +1,125 @@
+from django.test import TestCase
+
+from apps.labs.engine.processor import IOSCommandProcessor
+from apps.labs.models import DeviceState, SessionMutation, UserLabSession
+
+from .helpers import make_session, run
+
+
+def fresh(session):
+    return UserLabSession.objects.get(pk=session.pk)
+
+
+class JournalTests(TestCase):
+    """Команда дописывает в журнал только изменения своего устройства"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "enable", "configure terminal")
+
+    def last_payload(self):
+        return SessionMutation.objects.filter(session=self.session).latest("id").payload
+
+    def test_touched_subtree_only(self):
+        run(self.session, "interface fa0/0", "no shutdown")
+        payload = self.last_payload()
+        self.assertEqual([path for path, _ in payload["config"]], [["interfaces", "FastEthernet0/0"]])
+        self.assertEqual(payload["config"][0][1]["status"], "up")
+        # Курсор не сдвинулся - в "set" только новая ревизия конфига
+        self.assertEqual(list(payload["set"]), ["rev"])
+
+    def test_cursor_moves(self):
+        run(self.session, "interface fa0/0")
+        payload = self.last_payload()
+        payload["set"].pop("rev")
+        self.assertEqual(payload["set"], {"context": "interface_config", "current_iface": "FastEthernet0/0"})
+        self.assertEqual(payload["config"], [[["interfaces", "FastEthernet0/0"], {}]])
+
+    def test_show_writes_nothing(self):
+        before = SessionMutation.objects.count()
+        run(self.session, "do show running-config")
+        self.assertEqual(SessionMutation.objects.count(), before)
+
+    def test_snapshot_untouched_until_compaction(self):
+        run(self.session, "hostname edge")
+        self.assertFalse(DeviceState.objects.filter(session=self.session).exists())
+        # Журнал накатывается при загрузке
+        self.assertEqual(fresh(self.session).load_state()["R1"]["config"]["hostname"], "edge")
+
+
+class CompactionTests(TestCase):
+    """Раз в COMPACT_EVERY мутаций журнал сворачивается в снимок"""
+
+    def setUp(self):
+        self.session = make_session()
+        UserLabSession.COMPACT_EVERY, self.compact_every = 5, UserLabSession.COMPACT_EVERY
+
+    def tearDown(self):
+        UserLabSession.COMPACT_EVERY = self.compact_every
+
+    def test_compaction(self):
+        session = fresh(self.session)
+        processor = IOSCommandProcessor(session)   # первая мутация - инициализация R1
+        for command in ("configure terminal", "hostname edge", "interface fa0/0", "end"):
+            processor.process_input(command)
+        self.assertFalse(SessionMutation.objects.filter(session=self.session).exists())
+        row = DeviceState.objects.get(session=self.session, device="R1")
+        self.assertEqual((row.config["hostname"], row.context), ("edge", "privileged"))
+
+    def test_concurrent_rows_survive(self):
+        session = fresh(self.session)
+        processor = IOSCommandProcessor(session)
+        # Параллельный запрос пишет свою мутацию после того, как мы загрузили журнал
+        other = fresh(self.session)
+        other.record_mutation("R2", values={"context": "global_config"})
+        for command in ("configure terminal", "hostname edge", "interface fa0/0", "end"):
+            processor.process_input(command)
+        # Мутация R2 не потерялась: свернута вместе с R1 или осталась в журнале
+        state = fresh(self.session).load_devices()
+        self.assertEqual((state["R1"]["config"]["hostname"], state["R2"]["context"]), ("edge", "global_config"))
+
+    def test_reset(self):
+        run(self.session, "enable", "configure terminal", "hostname edge")
+        session = fresh(self.session)
+        session.is_completed = True
+        session.reset_state()
+        self.assertFalse(SessionMutation.objects.filter(session=self.session).exists())
+        self.assertEqual(fresh(self.session).load_state(), {})
+        self.assertFalse(fresh(self.session).is_completed)
+
+
+class DeviceLoadTests(TestCase):
+    """Команда грузит только свое устройство; версия сессии - по всему журналу"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "enable", "configure terminal", "hostname edge")
+        fresh(self.session).record_mutation("R2", values={"context": "global_config"})
+
+    def test_current_device_only(self):
+        session = fresh(self.session)
+        self.assertEqual(list(session.load_state()), ["R1"])
+        self.assertEqual(session.load_devices(["R2"])["R2"]["context"], "global_config")
+        self.assertEqual(sorted(fresh(self.session).load_devices()), ["R1", "R2"])
+
+    def test_state_token_sees_other_devices(self):
+        session = fresh(self.session)
+        session.load_state()
+        token = session.state_token()
+        fresh(self.session).record_mutation("R3", values={"context": "global_config"})
+        other = fresh(self.session)
+        other.load_state()
+        self.assertNotEqual(other.state_token(), token)
+
+
+class ApplyTests(TestCase):
+
+    def test_parent_paths_first(self):
+        mutation = SessionMutation(device="R1", payload={
+            "config": [[["interfaces", "Fa0/0", "status"], "up"], [["interfaces", "Fa0/0"], {"ip": "10.0.0.1"}]],
+            "set": {"context": "interface_config"},
+        })
+        state = {}
+        mutation.apply_to(state)
+        self.assertEqual(state["R1"], {"context": "interface_config",
+                                       "config": {"interfaces": {"Fa0/0": {"ip": "10.0.0.1", "status": "up"}}}})
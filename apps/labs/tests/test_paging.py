@@ -0,0 +1,163 @@
+import re
+
+from django.test import TestCase, override_settings
+
+from apps.labs.engine import paging
+from apps.labs.engine.paging import more_request, output_filter
+from apps.labs.engine.dispatch import MSG_INVALID_ARG
+from apps.labs.engine.processor import IOSCommandProcessor
+from apps.labs.engine.render import RenderCache
+from apps.labs.models import UserLabSession
+
+from .helpers import make_session, run
+
+CONFIG = """\
+hostname Edge
+interface FastEthernet0/0
+ ip address 10.0.0.1 255.255.255.0
+ no shutdown
+interface FastEthernet0/1
+ shutdown
+line con 0
+ login
+end"""
+
+
+def apply(lines, raw_command):
+    keep = output_filter(raw_command)
+    return list(keep(lines)) if keep else list(lines)
+
+
+class FilterTests(TestCase):
+
+    def setUp(self):
+        self.lines = CONFIG.split("\n")
+
+    def test_include_and_exclude(self):
+        self.assertEqual(apply(self.lines, "sh run | i address|hostname"),
+                         ["hostname Edge", " ip address 10.0.0.1 255.255.255.0"])
+        self.assertEqual(apply(self.lines, "sh run | exclude ^\\s"),
+                         [line for line in self.lines if not line.startswith(" ")])
+
+    def test_regex_is_case_sensitive(self):
+        self.assertEqual(apply(self.lines, "sh run | include HOSTNAME"), [])
+
+    def test_begin(self):
+        self.assertEqual(apply(self.lines, "sh run | begin ^line"), ["line con 0", " login", "end"])
+
+    def test_section(self):
+        self.assertEqual(apply(self.lines, "sh run | section shutdown"),
+                         ["interface FastEthernet0/0", " ip address 10.0.0.1 255.255.255.0", " no shutdown",
+                          "interface FastEthernet0/1", " shutdown"])
+
+    def test_no_filter(self):
+        self.assertIsNone(output_filter("show running-config"))
+
+    def test_bad_filters(self):
+        for raw_command in ("sh run | foo x", "sh run | include (", "sh run |", "sh run | include"):
+            with self.assertRaises(ValueError):
+                output_filter(raw_command)
+
+    def test_more_request(self):
+        self.assertIsNone(more_request({"command": "sh run"}))
+        self.assertEqual(more_request({"command": "sh run", "more": 23}), (23, None))
+        self.assertEqual(more_request({"command": "sh run", "more": "23", "lines": 1}), (23, 1))
+        self.assertIs(more_request({"command": "sh run", "more": -1}), False)
+        self.assertIs(more_request({"command": "sh run", "more": "x"}), False)
+        self.assertIs(more_request({"more": 1}), False)
+
+
+@override_settings(LAB_TERMINAL_LENGTH=6)
+class PagerTests(TestCase):
+    """Экран - LAB_TERMINAL_LENGTH - 1 строк; продолжение из PAGERS или заново с пропуском показанного"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "conf t", *(f"ip route 10.{i}.0.0 255.255.0.0 192.168.1.2" for i in range(20)), "end")
+        self.full = run(self.session, "sh run | include ip route")["output"].split("\n")
+
+    def read_all(self, command, count=None, drop=False):
+        result = run(self.session, command)
+        screens = [result["output"]]
+        while result["more"] is not None:
+            if drop: paging.PAGERS.clear()
+            result = self.more(command, result["more"], count)
+            screens.append(result["output"])
+        return screens
+
+    def more(self, command, offset, count=None):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        session.defer_writes()
+        result = IOSCommandProcessor(session).process_more(command, offset, count)
+        session.flush_writes()
+        return result
+
+    def test_filter_without_pager_is_complete(self):
+        # | include дочитывает вывод до конца, но пейджер делит на экраны уже отфильтрованное
+        self.assertEqual(len(self.full), 5)
+        self.assertTrue(all(re.match("ip route 10\\.", line) for line in self.full))
+
+    def test_screens(self):
+        result = run(self.session, "show running-config")
+        self.assertEqual(len(result["output"].split("\n")), 5)
+        self.assertEqual(result["more"], 5)
+
+    def test_pages_join_to_full_output(self):
+        screens = self.read_all("show running-config")
+        rebuilt = self.read_all("show running-config", drop=True)
+        by_line = self.read_all("show running-config", count=1)
+        self.assertGreater(len(screens), 2)
+        self.assertEqual(rebuilt, screens)
+        self.assertEqual("\n".join(by_line), "\n".join(screens))
+
+    def test_new_command_closes_pager(self):
+        result = run(self.session, "show running-config")
+        run(self.session, "show clock")
+        self.assertEqual(paging.PAGERS.get((self.session.pk, "R1")), None)
+        # Продолжение после закрытия строится заново и совпадает с тем, что было бы на экране
+        self.assertEqual(self.more("show running-config", result["more"])["output"],
+                         self.read_all("show running-config")[1])
+
+    def test_more_does_not_repeat_commands(self):
+        run(self.session, "conf t")
+        self.assertEqual(self.more("hostname X", 5)["output"], "")
+        self.assertEqual(run(self.session, "do sh run | i hostname")["output"], "hostname R1")
+
+    def test_batch_is_not_paged(self):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        result = IOSCommandProcessor(session).process_batch(["show running-config", "show clock"])
+        self.assertIsNone(result["more"])
+        self.assertEqual(result["results"][0]["output"], "\n".join(self.read_all("show running-config")))
+
+    def test_bad_filter(self):
+        self.assertEqual(run(self.session, "sh run | foo x")["output"], MSG_INVALID_ARG)
+
+
+class LazyRenderTests(TestCase):
+    """Рендер идет по мере чтения: первый экран не строит весь вывод"""
+
+    def render(self, produced, count):
+        for i in range(count):
+            produced.append(i)
+            yield f"line {i}"
+
+    def test_partial_read_is_not_cached(self):
+        cache, produced = RenderCache(max_lines=100), []
+        lines = cache.get_or_render("k", lambda: self.render(produced, 50))
+        shown, rest = paging.take(lines, 5)
+        self.assertEqual(len(shown), 5)
+        self.assertLessEqual(len(produced), 6)
+        cache.get_or_render("k", lambda: self.render([], 50))
+        self.assertEqual(cache.hits, 0)
+
+    def test_full_read_is_cached(self):
+        cache = RenderCache(max_lines=100)
+        first = list(cache.get_or_render("k", lambda: self.render([], 50)))
+        self.assertEqual(cache.get_or_render("k", lambda: self.render([], 50)), tuple(first))
+        self.assertEqual(cache.hits, 1)
+
+    def test_long_output_is_not_cached(self):
+        cache = RenderCache(max_lines=10)
+        list(cache.get_or_render("k", lambda: self.render([], 50)))
+        list(cache.get_or_render("k", lambda: self.render([], 50)))
+        self.assertEqual(cache.hits, 0)
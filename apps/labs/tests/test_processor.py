@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from apps.labs.engine.processor import IOSCommandProcessor
+from apps.labs.models import UserLabSession
+
+from .helpers import make_session, run
+
+
+class ConfigChangeTests(TestCase):
+    """Любое изменение конфига помечено в touched_paths, поэтому оно доходит до журнала"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "conf t")
+
+    def processor(self):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        return IOSCommandProcessor(session)
+
+    def test_no_ip_route_without_routes(self):
+        processor = self.processor()
+        processor.process_input("no ip route 10.0.0.0 255.0.0.0")
+        self.assertNotIn("routes", processor.device_data["config"])
+        self.assertEqual(processor.touched_paths, set())
+
+    def test_route_add_and_remove(self):
+        processor = self.processor()
+        processor.process_input("ip route 10.0.0.0 255.0.0.0 192.168.1.2")
+        self.assertEqual(processor.touched_paths, {("routes", "10.0.0.0 255.0.0.0 192.168.1.2")})
+
+        run(self.session, "ip route 10.0.0.0 255.0.0.0 192.168.1.2", "ip route 10.0.0.0 255.0.0.0 192.168.1.3")
+        run(self.session, "no ip route 10.0.0.0 255.0.0.0")
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        session.load_state()
+        self.assertEqual(session.virtual_config["R1"]["config"]["routes"], {})
+
+
+class LineTests(TestCase):
+    """line vty: все, что начинается с 0, - это vty 0 4 (упрощение лабы)"""
+
+    def setUp(self):
+        self.session = make_session()
+        run(self.session, "conf t")
+
+    def test_vty_ranges(self):
+        for command, line in (("line vty 0 4", "vty 0 4"), ("line vty 0 15", "vty 0 4"), ("line vty 0", "vty 0 4"),
+                              ("line vty 0 5", "vty 0 4"), ("line vty 5 15", "vty 5 15"), ("line con 0", "con 0")):
+            with self.subTest(command=command):
+                result = run(self.session, command)
+                self.assertEqual((result["output"], result["prompt"]), ("", "R1(config-line)#"))
+                session = UserLabSession.objects.get(pk=self.session.pk)
+                self.assertEqual(session.load_state()["R1"]["current_line"], line)
+                run(self.session, "exit")
+
+    def test_invalid_line(self):
+        for command in ("line vty 1 4", "line vty 5 10", "line con 1"):
+            with self.subTest(command=command):
+                result = run(self.session, command)
+                self.assertEqual((result["output"], result["prompt"]), ("% Invalid line", "R1(config)#"))
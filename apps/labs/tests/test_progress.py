@@ -0,0 +1,64 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.labs.models import LabScenario, PlayerProgress, UserLabSession
+
+from .helpers import make_lab, make_session
+
+
+def progress(user):
+    return PlayerProgress.objects.get(user=user)
+
+
+class ProgressTests(TestCase):
+    """PlayerProgress обновляется точечно: старт, завершение, сброс, удаление сессии"""
+
+    def setUp(self):
+        self.first = make_session()
+        self.user = self.first.user
+        self.second, _ = UserLabSession.start(self.user, make_lab(title="second"))
+
+    def test_started(self):
+        p = progress(self.user)
+        self.assertEqual(p.started, sorted([self.first.lab_id, self.second.lab_id]))
+        self.assertEqual((p.completed, p.active_session_id), ([], self.first.id))
+        # Повторный старт той же лабы - та же сессия
+        self.assertEqual(UserLabSession.start(self.user, self.first.lab), (self.first, False))
+
+    def test_completed_moves_active(self):
+        self.first.mark_completed()
+        p = progress(self.user)
+        self.assertEqual((p.completed, p.active_session_id), ([self.first.lab_id], self.second.id))
+        self.second.mark_completed()
+        self.assertIsNone(progress(self.user).active_session_id)
+
+    def test_reset(self):
+        self.first.mark_completed()
+        self.first.reset_state()
+        p = progress(self.user)
+        self.assertEqual((p.completed, p.active_session_id), ([], self.first.id))
+
+    def test_delete_rebuilds(self):
+        self.first.delete()
+        p = progress(self.user)
+        self.assertEqual((p.started, p.active_session_id), ([self.second.lab_id], self.second.id))
+        LabScenario.objects.filter(id=self.second.lab_id).delete()
+        self.assertEqual(progress(self.user).started, [])
+
+    def test_for_user_builds_missing_row(self):
+        PlayerProgress.objects.all().delete()
+        p = PlayerProgress.for_user(self.user)
+        self.assertEqual(p.started, sorted([self.first.lab_id, self.second.lab_id]))
+
+
+class OfficeTests(TestCase):
+
+    def test_inbox_skips_started_labs(self):
+        session = make_session()
+        fresh = make_lab(title="fresh")
+        make_lab(title="too hard", min_level=5)
+        self.client.login(username="student", password="secret")
+        response = self.client.get(reverse("office"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([lab.id for lab in response.context["inbox_labs"]], [fresh.id])
+        self.assertEqual(response.context["active_session"], session)
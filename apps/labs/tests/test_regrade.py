@@ -0,0 +1,77 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.labs.models import RewardEntry, UserLabSession
+from apps.labs.regrade import regrade_lab
+
+from .helpers import TOPOLOGY, make_lab, make_session, run
+
+
+def criteria(hostname):
+    return {"R1": {"hostname": hostname}}
+
+
+class RegradeTests(TestCase):
+    """regrade_lab засчитывает прошедшие по новым критериям, но ничего не отзывает"""
+
+    def setUp(self):
+        self.lab = make_lab(success_criteria=criteria("Core"))
+        self.session = make_session(lab=self.lab)
+        run(self.session, "enable", "configure terminal", "hostname Edge", "end")
+
+    def edit(self, hostname):
+        self.lab.success_criteria = criteria(hostname)
+        self.lab.save()
+        return regrade_lab(self.lab.id, workers=1)
+
+    def completed(self):
+        return UserLabSession.objects.get(pk=self.session.pk).is_completed
+
+    def test_promotes_passing(self):
+        self.assertFalse(self.completed())
+        state = self.edit("Edge")
+        self.assertEqual((state["total"], state["completed"]), (1, 1))
+        self.assertTrue(self.completed())
+        self.assertEqual(RewardEntry.objects.filter(session=self.session).count(), 1)
+
+    def test_never_demotes(self):
+        self.edit("Edge")
+        reward = RewardEntry.objects.get(session=self.session)
+        # Сессия больше не проходит, но засчитанная лаба и награда остаются
+        state = self.edit("Branch")
+        self.assertEqual(state["total"], 0)
+        self.assertTrue(self.completed())
+        self.assertEqual(list(RewardEntry.objects.filter(session=self.session)), [reward])
+
+
+class EditLabTests(TestCase):
+    """edit_lab запускает перепроверку, только если поменялся итог проверки"""
+
+    def setUp(self):
+        User.objects.create_user("admin", password="secret", is_staff=True)
+        self.client.login(username="admin", password="secret")
+        self.lab = make_lab()
+
+    def post(self, **fields):
+        data = {"title": self.lab.title, "description": "x", "allowed_devices": self.lab.allowed_devices,
+                "topology_data": self.lab.topology_data, "success_criteria": self.lab.success_criteria, **fields}
+        data = {key: value if isinstance(value, str) else json.dumps(value) for key, value in data.items()}
+        with mock.patch("apps.labs.views.start_regrade") as start:
+            response = self.client.post(reverse("edit_lab", args=[self.lab.id]), data)
+        self.assertRedirects(response, reverse("lab_list"), fetch_redirect_response=False)
+        return start
+
+    def test_unchanged(self):
+        self.post().assert_not_called()
+
+    def test_criteria_changed(self):
+        self.post(success_criteria=criteria("Edge")).assert_called_once_with(self.lab.id)
+
+    def test_base_config_changed(self):
+        nodes = [dict(node) for node in TOPOLOGY["nodes"]]
+        nodes[0]["base_config"] = {"hostname": "Edge"}
+        self.post(topology_data={**TOPOLOGY, "nodes": nodes}).assert_called_once_with(self.lab.id)
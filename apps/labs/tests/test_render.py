@@ -0,0 +1,131 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.labs.engine.digest import ConfigDigest
+from apps.labs.engine.render import RENDERED, RenderCache
+from apps.labs.models import DeviceState, UserLabSession
+
+from .helpers import make_lab, make_session, run
+
+
+def revision(session, device="R1"):
+    return UserLabSession.objects.get(pk=session.pk).load_state()[device]["rev"]
+
+
+class RenderCacheTests(SimpleTestCase):
+
+    def test_lru(self):
+        cache = RenderCache(limit=2)
+        for key in ("a", "b", "a", "c"):
+            list(cache.get_or_render(key, lambda: [key.upper()]))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        # "b" вытеснен, "a" - нет
+        self.assertEqual(list(cache.get_or_render("a", lambda: ["new"])), ["A"])
+        self.assertEqual(list(cache.get_or_render("b", lambda: ["new"])), ["new"])
+
+    def test_stored_when_read_to_end(self):
+        cache = RenderCache()
+        lines = cache.get_or_render("a", lambda: ["1", "2"])
+        next(lines)
+        # Недочитанный вывод (выход из --More--) в кэш не попадает
+        self.assertEqual(list(cache.get_or_render("a", lambda: ["1", "2"])), ["1", "2"])
+        self.assertEqual(cache.get_or_render("a", lambda: []), ("1", "2"))
+
+    def test_long_output_streams(self):
+        cache = RenderCache(max_lines=3)
+        lines = cache.get_or_render("long", lambda: (str(i) for i in range(5)))
+        self.assertEqual(list(lines), ["0", "1", "2", "3", "4"])
+        # Длинный вывод не закэширован
+        self.assertEqual(list(cache.get_or_render("long", lambda: iter(["again"]))), ["again"])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+
+class DigestTests(SimpleTestCase):
+
+    def test_touched_subtree_rehashed_lazily(self):
+        config = {"hostname": "R1", "interfaces": {"Fa0/0": {"status": "down"}}}
+        digest = ConfigDigest.of(1, config)
+        root, interfaces = digest.root, digest.part(["interfaces"])
+        config["interfaces"]["Fa0/0"]["status"] = "up"
+        digest.advance(2, [("interfaces", "Fa0/0")])
+        self.assertEqual(digest.stale, {"interfaces"})
+        digest.refresh(config)
+        self.assertNotEqual(digest.part(["interfaces"]), interfaces)
+        self.assertNotEqual(digest.root, root)
+        # Тот же конфиг - те же хэши, независимо от истории
+        self.assertEqual(digest.root, ConfigDigest.of(7, config).root)
+
+
+# Весь running-config на одном экране: в кэш попадает только дочитанный вывод
+@override_settings(LAB_TERMINAL_LENGTH=100)
+class RevisionTests(TestCase):
+    """Вывод show кэшируется, пока ревизия конфига устройства не изменилась"""
+
+    def setUp(self):
+        RENDERED.clear()
+        self.session = make_session()
+        run(self.session, "show running-config")
+
+    def counts(self):
+        return RENDERED.hits, RENDERED.misses
+
+    def test_repeated_show_hits(self):
+        hits, misses = self.counts()
+        self.assertEqual(run(self.session, "show running-config")["output"],
+                         run(self.session, "show running-config")["output"])
+        self.assertEqual(self.counts(), (hits + 2, misses))
+
+    def test_config_change_bumps_revision(self):
+        rev = revision(self.session)
+        run(self.session, "configure terminal", "do show running-config")
+        # Смена режима конфиг не трогает
+        self.assertEqual(revision(self.session), rev)
+        hits, misses = self.counts()
+        result = run(self.session, "hostname edge", "do show running-config")
+        self.assertEqual(revision(self.session), rev + 1)
+        self.assertEqual(self.counts(), (hits, misses + 1))
+        self.assertIn("hostname edge", result["output"])
+
+    def test_lab_edit_misses(self):
+        lab = self.session.lab
+        lab.title = "edited"
+        lab.save()
+        hits, misses = self.counts()
+        run(self.session, "show running-config")
+        self.assertEqual(self.counts(), (hits, misses + 1))
+
+    def test_legacy_device_gets_revision(self):
+        session = make_session("legacy")
+        DeviceState.objects.create(session=session, device="R1", config={"hostname": "old"})
+        self.assertIn("hostname old", run(session, "show running-config")["output"])
+        self.assertIsInstance(revision(session), int)
+
+
+class SharedRenderTests(TestCase):
+    """Вывод show общий для одинаковых конфигов, а ключ зависит только от нужных поддеревьев"""
+
+    def setUp(self):
+        RENDERED.clear()
+        lab = make_lab()
+        self.first = make_session("first", lab)
+        self.second = make_session("second", lab)
+
+    def counts(self):
+        return RENDERED.hits, RENDERED.misses
+
+    def test_same_config_shares_output(self):
+        script = ("conf t", "int fa0/0", "ip address 10.0.0.1 255.255.255.0", "no shut", "end")
+        run(self.first, *script)
+        run(self.second, *script)
+        first = run(self.first, "show running-config | include address")
+        hits, misses = self.counts()
+        second = run(self.second, "show running-config | include address")
+        self.assertEqual(first["output"], second["output"])
+        self.assertEqual(self.counts(), (hits + 1, misses))
+
+    def test_unrelated_change_keeps_interface_table(self):
+        run(self.first, "show ip interface brief")
+        hits, misses = self.counts()
+        run(self.first, "conf t", "hostname Edge", "end", "show ip interface brief")
+        self.assertEqual(self.counts(), (hits + 1, misses))
+        run(self.first, "conf t", "int fa0/0", "no shut", "end", "show ip interface brief")
+        self.assertEqual(self.counts(), (hits + 1, misses + 1))
@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from apps.game.models import PlayerProfile
+from apps.labs.models import RewardEntry, UserLabSession
+
+from .helpers import make_lab, make_session
+
+
+def profile(session):
+    return PlayerProfile.objects.get(user_id=session.user_id)
+
+
+class GrantTests(TestCase):
+    """RewardEntry.grant / grant_many: награда ровно один раз на сессию"""
+
+    def test_second_grant_is_noop(self):
+        session = make_session()
+        entry = RewardEntry.grant(session, 100, 30)
+        self.assertEqual((entry.money, entry.xp, entry.level), (100, 30, None))
+        self.assertIsNone(RewardEntry.grant(session, 100, 30))
+        self.assertIsNone(session.award_completion(100, 30))
+        p = profile(session)
+        self.assertEqual((p.money, p.xp, p.level), (1100, 30, 1))
+        self.assertEqual(RewardEntry.objects.filter(session=session).count(), 1)
+
+    def test_level_up_bonus(self):
+        session = make_session()
+        PlayerProfile.objects.filter(user_id=session.user_id).update(xp=90)
+        entry = RewardEntry.grant(session, 100, 30)
+        # 120 XP -> Lvl 2, бонус 50 * 2 - и в профиле, и в записи журнала
+        self.assertEqual((entry.money, entry.level), (200, 2))
+        p = profile(session)
+        self.assertEqual((p.money, p.xp, p.level), (1200, 120, 2))
+
+    def test_batch_skips_rewarded(self):
+        lab = make_lab()
+        first, second = make_session("first", lab), make_session("second", lab)
+        RewardEntry.grant(first, 100, 30)
+        entries = RewardEntry.grant_many([first, second], 100, 30)
+        self.assertEqual([e.session_id for e in entries], [second.pk])
+        self.assertEqual((profile(first).money, profile(second).money), (1100, 1100))
+
+    def test_same_user_twice_in_batch(self):
+        first = make_session()
+        second, _ = UserLabSession.start(first.user, make_lab(title="other"))
+        entries = RewardEntry.grant_many([first, second], 100, 60)
+        self.assertEqual(len(entries), 2)
+        # Каждая сессия - свой инкремент; второй поднял уровень
+        p = profile(first)
+        self.assertEqual((p.xp, p.level, p.money), (120, 2, 1300))
+        self.assertEqual(sorted(e.level or 0 for e in entries), [0, 2])
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from apps.labs.models import SessionMutation, UserLabSession
+from apps.labs.profiling import recent_profiles
+from apps.labs.websocket import TerminalConnection, terminal_app, terminal_path
+
+from .helpers import make_session, run
+
+
+class TerminalConnectionTests(TestCase):
+    """Соединение держит сессию в памяти, но отвечает только после записи и замечает чужие изменения"""
+
+    def setUp(self):
+        self.session = make_session()
+        self.conn = TerminalConnection(self.session.pk, self.session.user)
+        self.conn.load()
+
+    def stored(self):
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        session.load_devices()
+        return session.virtual_config["R1"]
+
+    def test_reply_after_write(self):
+        # hostname хранится в нижнем регистре, как и раньше
+        for command in ("conf t", "hostname Edge"):
+            self.assertEqual(self.conn.run_command(command)["status"], "ok")
+        self.assertEqual(self.stored()["config"]["hostname"], "edge")
+        self.assertFalse(self.conn.session.has_pending_writes())
+
+    def test_reload_after_http_reset(self):
+        self.conn.run_command("conf t")
+        self.conn.run_command("hostname Edge")
+        UserLabSession.objects.get(pk=self.session.pk).reset_state()
+
+        reply = self.conn.run_command("end")
+        self.assertEqual(reply["prompt"], "R1#")
+        self.conn.flush()
+        self.assertEqual(self.stored()["config"]["hostname"], "R1")
+
+    def test_reload_after_http_command(self):
+        self.conn.run_command("conf t")
+        run(self.session, "conf t", "hostname core")
+        reply = self.conn.run_command("do show running-config | include hostname")
+        self.assertEqual(reply["output"], "hostname core")
+
+    def test_undo_is_not_overwritten(self):
+        self.conn.run_command("conf t")
+        self.conn.run_command("hostname Edge")
+        self.conn.run_command("end")
+        session = UserLabSession.objects.get(pk=self.session.pk)
+        self.assertEqual(session.undo(), "R1")
+
+        self.conn.run_command("show clock")
+        self.conn.flush()
+        self.assertEqual(self.stored()["config"]["hostname"], "R1")
+        self.assertTrue(SessionMutation.objects.filter(session=self.session).exists())
+
+    def test_profiling_toggle_on_live_connection(self):
+        self.conn.run_command("show clock")
+        staff = User.objects.create_user("staff", password="secret", is_staff=True)
+        self.client.force_login(staff)
+        toggle = lambda action: self.client.post(reverse("profiling_list"),
+                                                 {"session_id": self.session.pk, "action": action})
+        with tempfile.TemporaryDirectory() as folder, override_settings(LAB_PROFILE_DIR=folder):
+            toggle("on")
+            self.conn.run_command("show clock")
+            self.assertEqual(len(recent_profiles(self.session.pk)), 1)
+            toggle("off")
+            self.conn.run_command("show clock")
+            self.assertEqual(len(recent_profiles(self.session.pk)), 1)
+
+    def test_deleted_session(self):
+        UserLabSession.objects.filter(pk=self.session.pk).delete()
+        with self.assertRaises(UserLabSession.DoesNotExist):
+            self.conn.run_command("show clock")
+
+
+class ConnectionThreadTests(SimpleTestCase):
+    """Команды разных соединений не стоят в одной очереди (поток на соединение)"""
+
+    def command(self, conn, command_text, device=None, more=None):
+        time.sleep(0.2)
+        return {"status": "ok", "output": threading.current_thread().name}
+
+    async def connect(self, session_id):
+        events = [{"type": "websocket.connect"},
+                  {"type": "websocket.receive", "text": json.dumps({"command": "show clock", "seq": 1})},
+                  {"type": "websocket.disconnect"}]
+        sent = []
+
+        async def receive():
+            return events.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await terminal_app({"type": "websocket", "path": terminal_path(session_id), "headers": []}, receive, send)
+        return json.loads(sent[-1]["text"])
+
+    def test_commands_overlap(self):
+        user = SimpleNamespace(is_authenticated=True)
+
+        async def both():
+            return await asyncio.gather(self.connect(1), self.connect(2))
+
+        with mock.patch("apps.labs.websocket._authenticate", return_value=user), \
+                mock.patch.object(TerminalConnection, "load"), mock.patch.object(TerminalConnection, "flush"), \
+                mock.patch.object(TerminalConnection, "run_command", self.command):
+            started = time.perf_counter()
+            first, second = asyncio.run(both())
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 0.35)
+        self.assertNotEqual(first["output"], second["output"])
@@ -13,10 +13,19 @@ urlpatterns = [
     path('workspace/<int:session_id>/', views.lab_workspace, name='lab_workspace'),
     
     path('api/lab/<int:session_id>/command/', views.send_command, name='send_command'),
+    path('api/lab/<int:session_id>/batch/', views.send_batch, name='send_batch'),
     path('reset/<int:session_id>/', views.reset_lab, name='reset_lab'),
+    path('checkpoint/<int:session_id>/', views.lab_checkpoint, name='lab_checkpoint'),
     path('switch/<int:session_id>/<str:device_name>/', views.switch_device, name='switch_device'),
     path('api/lab/<int:session_id>/switch/<str:device_name>/', views.switch_device, name='switch_device'),
+    path('api/lab/<int:session_id>/console/<str:device_name>/', views.console_history, name='console_history'),
+    path('api/lab/grammar/<str:version>/', views.lab_grammar, name='lab_grammar'),
 
     path('manage/<int:lab_id>/edit/', views.edit_lab, name='edit_lab'),
+    path('manage/profiling/', views.profiling_list, name='profiling_list'),
+    path('manage/profiling/<int:session_id>/', views.profiling_detail, name='profiling_detail'),
+
+    # Метрики движка (Prometheus)
+    path('metrics/', views.metrics, name='lab_metrics'),
 
 ]
\ No newline at end of file
@@ -1,13 +1,22 @@
 import json
-import traceback
 import logging
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import LabScenario, UserLabSession
+from .models import LabScenario, UserLabSession, ConsoleEntry, PlayerProgress, SessionCheckpoint
 from .engine.processor import IOSCommandProcessor
+from .engine.baseconfig import init_device
+from .engine.grammar import GRAMMAR_BUNDLE, GRAMMAR_VERSION
+from .engine.paging import more_request
+from .lab_cache import get_lab
+from .metrics import REGISTRY, process_metrics, span, timed_view
+from .profiling import profile_session, recent_profiles, top_functions
+from .regrade import start_regrade
+from .websocket import terminal_path
 # В начало файла добавьте импорт
 from django.http import HttpResponseRedirect
 from django.urls import reverse
@@ -21,23 +30,45 @@ def reset_lab(request, session_id):
     """Полный сброс лабораторной работы (Hard Reset)"""
     session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
     
-    # Сбрасываем параметры в исходное состояние
-    session.current_context = "privileged"
-    session.virtual_config = {}
-    session.command_history = []
-    session.is_completed = False
-    session.save()
+    # Сбрасываем параметры в исходное состояние (снимок + журнал мутаций)
+    session.reset_state()
     
     # Перезагружаем страницу
     return HttpResponseRedirect(reverse('lab_workspace', args=[session_id]))
 
+@login_required
+@require_POST
+def lab_checkpoint(request, session_id):
+    """Чекпоинты: сохранить снимок, восстановить, удалить, отменить последнюю команду"""
+    session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
+    action = request.POST.get('action')
+
+    if action == 'undo':
+        session.undo()
+    elif action == 'save':
+        if session.checkpoints.filter(kind=SessionCheckpoint.KIND_NAMED).count() < settings.LAB_CHECKPOINT_LIMIT:
+            name = request.POST.get('name', '').strip()[:100] or session.current_device
+            # Снимок с флагом shared видят все сессии лабы (преподаватель раздает промежуточное состояние)
+            shared = is_admin(request.user) and request.POST.get('shared') == 'on'
+            session.save_checkpoint(name, shared=shared)
+    elif action in ('restore', 'delete') and request.POST.get('checkpoint_id', '').isdigit():
+        checkpoint = get_object_or_404(SessionCheckpoint.available(session), id=int(request.POST['checkpoint_id']))
+        if action == 'restore':
+            session.restore_checkpoint(checkpoint)
+        elif checkpoint.session_id == session.id:
+            checkpoint.delete()
+
+    return HttpResponseRedirect(reverse('lab_workspace', args=[session_id]))
+
 # Настраиваем простой логгер
 logger = logging.getLogger(__name__)
 
+@timed_view("lab_list")
 @login_required
 def lab_list(request):
     labs = LabScenario.objects.all()
-    active_sessions = UserLabSession.objects.filter(user=request.user).values_list('lab_id', flat=True)
+    # Начатые лабы - из материализованного прогресса (один запрос по PK), а не по всем сессиям
+    active_sessions = PlayerProgress.for_user(request.user).started_set
     return render(request, 'labs/index.html', {
         'labs': labs, 
         'active_sessions': active_sessions
@@ -46,21 +77,21 @@ def lab_list(request):
 @login_required
 def start_lab(request, lab_id):
     lab = get_object_or_404(LabScenario, id=lab_id)
-    session, created = UserLabSession.objects.get_or_create(
-        user=request.user,
-        lab=lab
-    )
+    session, created = UserLabSession.start(request.user, lab)
     return redirect('lab_workspace', session_id=session.id)
 
+@timed_view("lab_workspace")
 @login_required
 def lab_workspace(request, session_id):
     session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
     
     # --- НОВАЯ ЛОГИКА: ПРОВЕРКА ПРИ ЗАГРУЗКЕ ---
     # Создаем процессор, чтобы запустить валидацию
+    session.defer_writes()
     processor = IOSCommandProcessor(session)
     # Проверяем выполнение по АКТУАЛЬНЫМ критериям из БД (которые мог поменять админ)
     is_completed_now = processor.check_completion() 
+    session.flush_writes()
     # -------------------------------------------
 
     # 1. Получаем текущее устройство
@@ -82,30 +113,41 @@ def lab_workspace(request, session_id):
     }
     initial_prompt = prompt_map.get(current_ctx, f"{display_name}#")
     
-    # 3. Логи
-    initial_logs = dev_data.get("console_logs", [])
+    # 3. Логи: только последняя страница, старые строки JS дозагрузит через console_history
+    initial_logs, has_more_logs = ConsoleEntry.page(session, current_dev)
     if not initial_logs:
         initial_logs = [{"type": "out", "text": f"System Bootstrap\nConnected to {current_dev} console."}]
 
     # 4. Имена устройств
     device_hostnames = {}
-    all_devices = session.lab.allowed_devices if session.lab.allowed_devices else ["R1", "R2"]
+    all_devices = processor.lab.allowed_devices or ["R1", "R2"]
+    session.load_devices(all_devices)
     for dev in all_devices:
         d_cfg = session.virtual_config.get(dev, {}).get("config", {})
         device_hostnames[dev] = d_cfg.get("hostname", dev)
 
     return render(request, 'labs/workspace.html', {
         'session': session,
-        'lab': session.lab,
+        'lab': processor.lab,
         'initial_logs_json': initial_logs, 
+        'has_more_logs': has_more_logs,
+        'console_url': reverse('console_history', args=[session.id, '__DEVICE__']),
+        'terminal_ws_path': terminal_path(session.id),
+        'batch_url': reverse('send_batch', args=[session.id]),
+        'grammar_url': reverse('lab_grammar', args=[GRAMMAR_VERSION]),
+        'command_history_json': ConsoleEntry.history(session, current_dev, limit=50),
         'initial_prompt': initial_prompt,
         'device_hostnames_json': device_hostnames,
+        'checkpoints': SessionCheckpoint.available(session),
+        'undo_depth': session.undo_depth(),
+        'is_staff': is_admin(request.user),
         
         # Передаем обновленный статус в шаблон
         'is_completed': is_completed_now 
     })
 
 
+@timed_view("send_command")
 @csrf_exempt
 @require_POST
 def send_command(request, session_id):
@@ -113,37 +155,44 @@ def send_command(request, session_id):
          return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
          
     try:
-        data = json.loads(request.body)
-        command_text = data.get('command', '')
-        
-        session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
+        with span("parse"):
+            data = json.loads(request.body)
+            command_text = data.get('command', '')
+            # Продолжение вывода на --More--: {"command": ..., "more": показано строк, "lines": сколько еще}
+            more = more_request(data)
+        if more is False:
+            return JsonResponse({'status': 'error', 'message': 'Bad --More-- request'}, status=400)
         
-        # --- ИСПРАВЛЕНИЕ: Безопасное получение контекста из JSON ---
-        # Мы больше не используем session.current_context напрямую
-        current_device = session.current_device
-        device_config = session.virtual_config.get(current_device, {})
-        current_ctx = device_config.get("context", "unknown")
-        
-        print(f"DEBUG: User '{request.user}' on '{current_device}' sent: '{command_text}' (ctx: {current_ctx})")
-        
-        processor = IOSCommandProcessor(session)
-        result = processor.process_input(command_text)
+        with span("load"):
+            session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
+            # Мутация, строки консоли и отметка о завершении уходят писателю одним заданием
+            session.defer_writes()
+        # Если staff включил профилирование сессии - команда идет под cProfile
+        with profile_session(session, command_text):
+            # Процессор сам накатывает журнал мутаций, поэтому контекст берем у него
+            with span("processor"):
+                processor = IOSCommandProcessor(session)
+            
+            logger.debug("User '%s' on '%s' sent: '%s' (ctx: %s)",
+                         request.user, session.current_device, command_text, processor.current_context)
+            
+            if more is None: result = processor.process_input(command_text)
+            else: result = processor.process_more(command_text, *more)
+        # Отвечаем только после коммита: подтвержденная команда не потеряется
+        with span("save"):
+            session.flush_writes()
         
         return JsonResponse({
             'status': 'ok',
             'output': result['output'],
             'prompt': result['prompt'],
             'completed': result['is_completed'],
-            'new_hostname': result['hostname'] 
+            'new_hostname': result['hostname'],
+            'more': result['more'],
         })
 
     except Exception as e:
-        print("\n" + "="*30)
-        print("!!! CRITICAL ERROR IN LAB ENGINE !!!")
-        print(f"Error Message: {str(e)}")
-        print("Traceback:")
-        traceback.print_exc() 
-        print("="*30 + "\n")
+        logger.exception("Lab engine error in send_command (session %s)", session_id)
         
         return JsonResponse({
             'status': 'error', 
@@ -151,51 +200,79 @@ def send_command(request, session_id):
         }, status=500)
 
 
+@timed_view("send_batch")
+@csrf_exempt
+@require_POST
+def send_batch(request, session_id):
+    """Вставка нескольких строк: одна загрузка сессии, одна запись, одна проверка задания"""
+    if not request.user.is_authenticated:
+         return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
+
+    try:
+        with span("parse"):
+            data = json.loads(request.body)
+            lines = data.get('commands')
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            return JsonResponse({'status': 'error', 'message': 'commands must be a list of strings'}, status=400)
+        if len(lines) > settings.LAB_BATCH_MAX_LINES:
+            return JsonResponse({'status': 'error', 'message': f'Too many lines (max {settings.LAB_BATCH_MAX_LINES})'}, status=400)
+
+        with span("load"):
+            session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
+            # Все мутации и строки консоли копятся в памяти и пишутся одной транзакцией
+            session.defer_writes()
+        with profile_session(session, f"<paste {len(lines)} lines>"):
+            with span("processor"):
+                processor = IOSCommandProcessor(session)
+            logger.debug("User '%s' on '%s' pasted %d lines (ctx: %s)",
+                         request.user, session.current_device, len(lines), processor.current_context)
+
+            result = processor.process_batch(lines)
+        with span("save"):
+            session.flush_writes()
+
+        return JsonResponse({
+            'status': 'ok',
+            'results': result['results'],
+            'prompt': result['prompt'],
+            'completed': result['is_completed'],
+            'new_hostname': result['hostname'],
+        })
+
+    except Exception as e:
+        logger.exception("Lab engine error in send_batch (session %s)", session_id)
+
+        return JsonResponse({
+            'status': 'error',
+            'message': f"Server Logic Error: {str(e)}"
+        }, status=500)
+
+
+@timed_view("switch_device")
 @csrf_exempt
 @login_required
 def switch_device(request, session_id, device_name):
     session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
-    lab = session.lab
+    # Разобранная лаба из кэша процесса: топология уже распарсена
+    lab = get_lab(session.lab_id)
     
     # 1. Проверка прав
-    allowed = lab.allowed_devices if lab.allowed_devices else ["R1"]
-    if device_name not in allowed:
+    if not lab.allows(device_name):
          return JsonResponse({'status': 'error', 'message': 'Access Denied'}, status=403)
 
-    # --- ИСПРАВЛЕНИЕ ЗДЕСЬ ---
     # 2. Определяем ТИП устройства
-    # Защита от того, что JSONField вернулся как строка
-    topology = lab.topology_data
-    if isinstance(topology, str):
-        try:
-            topology = json.loads(topology)
-        except json.JSONDecodeError:
-            topology = {} # Если мусор в БД
-
-    nodes = topology.get('nodes', [])
-    # -------------------------
-
-    device_type = "router" 
-    for node in nodes:
-        if node.get('id') == device_name:
-            device_type = node.get('type', 'router')
-            break
+    device_type = lab.device_type(device_name)
 
 
-    # 3. Переключение сессии в БД
+    # 3. Переключение сессии в БД (новое устройство и current_device - одной записью)
     session.current_device = device_name
+    session.defer_writes()
     
-    # Инициализация, если данных еще нет
+    # Инициализация, если данных еще нет (пишем только это устройство)
     if device_name not in session.virtual_config:
-        session.virtual_config[device_name] = {
-            "config": {"hostname": device_name},
-            "context": "privileged",
-            "history": [],
-            "console_logs": [] 
-        }
-        session.save()
-    else:
-        session.save()
+        init_device(session, lab, device_name)
+    session.save(update_fields=["current_device", "updated_at"])
+    session.flush_writes()
     
     # Получаем данные устройства
     dev_data = session.virtual_config[device_name]
@@ -222,7 +299,7 @@ def switch_device(request, session_id, device_name):
     new_prompt = prompt_map.get(current_ctx, f"{display_name}#")
     # ============================================================
 
-    logs = dev_data.get("console_logs", [])
+    logs, has_more = ConsoleEntry.page(session, device_name)
     if not logs:
         logs = [{"type": "out", "text": f"Switched to {device_name} ({device_type})."}]
 
@@ -230,21 +307,105 @@ def switch_device(request, session_id, device_name):
         'status': 'ok', 
         'prompt': new_prompt,
         'logs': logs,
+        'has_more': has_more,
+        'history': ConsoleEntry.history(session, device_name, limit=50),
         'device_type': device_type
     })
 
+
+@timed_view("console_history")
+@login_required
+def console_history(request, session_id, device_name):
+    """Старые строки консоли для прокрутки вверх: ?before=<id самой старой загруженной строки>"""
+    session = get_object_or_404(UserLabSession, id=session_id, user=request.user)
+    try:
+        before = int(request.GET.get('before', 0)) or None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Bad cursor'}, status=400)
+
+    logs, has_more = ConsoleEntry.page(session, device_name, before=before)
+    return JsonResponse({
+        'status': 'ok',
+        'logs': logs,
+        'has_more': has_more,
+    })
+
+@timed_view("lab_grammar")
+@require_GET
+@condition(etag_func=lambda request, version: GRAMMAR_VERSION)
+def lab_grammar(request, version):
+    """Грамматика команд для справки "?" и Tab в браузере (см. engine/grammar.py)"""
+    # Страница со старой версией (открыта до деплоя) получает текущий бандл
+    if version != GRAMMAR_VERSION: return redirect('lab_grammar', version=GRAMMAR_VERSION)
+    response = HttpResponse(GRAMMAR_BUNDLE, content_type='application/json')
+    # Содержимое по этому URL не меняется никогда
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
+
 # Проверка: является ли юзер админом
 def is_admin(user):
     return user.is_authenticated and user.is_staff
 
+
+def metrics(request):
+    """Метрики движка в формате Prometheus: для staff или по токену LAB_METRICS_TOKEN"""
+    token = settings.LAB_METRICS_TOKEN
+    by_token = bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
+    if not (by_token or is_admin(request.user)):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(extra=process_metrics()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@user_passes_test(is_admin)
+def profiling_list(request):
+    """Включение профилирования: для одной сессии или для всех сессий студента"""
+    message = None
+    if request.method == 'POST':
+        enable = request.POST.get('action') == 'on'
+        sessions = UserLabSession.objects.none()
+        if request.POST.get('session_id', '').isdigit():
+            sessions = UserLabSession.objects.filter(id=int(request.POST['session_id']))
+        elif request.POST.get('username'):
+            sessions = UserLabSession.objects.filter(user__username=request.POST['username'].strip())
+        count = sessions.update(profiling=enable)
+        message = f"{'Включено' if enable else 'Выключено'} для сессий: {count}"
+
+    return render(request, 'labs/profiling.html', {
+        'sessions': UserLabSession.objects.filter(profiling=True).select_related('user', 'lab').order_by('-updated_at'),
+        'message': message,
+    })
+
+
+@user_passes_test(is_admin)
+def profiling_detail(request, session_id):
+    """Последние команды сессии под профайлером + топ функций (по всем или по одной команде)"""
+    session = get_object_or_404(UserLabSession.objects.select_related('user', 'lab'), id=session_id)
+    selected = request.GET.get('profile')
+    sort = request.GET.get('sort', 'cumulative')
+    profiles = recent_profiles(session.id)
+    if selected not in {p['name'] for p in profiles}: selected = None
+
+    return render(request, 'labs/profiling_detail.html', {
+        'session': session,
+        'profiles': profiles,
+        'selected': selected,
+        'sort': sort,
+        'functions': top_functions(session.id, names=[selected] if selected else None, sort=sort),
+    })
+
+
 @user_passes_test(is_admin)
 def edit_lab(request, lab_id):
     lab = get_object_or_404(LabScenario, pk=lab_id)
     
     if request.method == 'POST':
+        before = (lab.success_criteria, lab.topology_data)
         form = LabScenarioForm(request.POST, instance=lab)
         if form.is_valid():
             form.save()
+            # Новые критерии или base_config устройств (в topology_data) меняют итог проверки -
+            # сразу перепроверяем все открытые сессии лабы (в фоне). Завершенные не отзываются.
+            if (lab.success_criteria, lab.topology_data) != before: start_regrade(lab.id)
             # Редирект на список лаб после сохранения
             return redirect('lab_list')
     else:
@@ -259,6 +420,6 @@ def edit_lab(request, lab_id):
 def accept_task(request, lab_id):
     lab = get_object_or_404(LabScenario, id=lab_id)
     # Создаем сессию (или получаем, если случайно нажали дважды)
-    UserLabSession.objects.get_or_create(user=request.user, lab=lab)
+    UserLabSession.start(request.user, lab)
     # Возвращаем в офис, где теперь появится предмет
     return redirect('office')
\ No newline at end of file
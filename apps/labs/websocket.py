@@ -0,0 +1,226 @@
+"""
+WebSocket-терминал лабораторной поверх ASGI (config/asgi.py), без сторонних пакетов.
+
+На одно соединение держим в памяти UserLabSession с накатанным журналом,
+команды гоняем через IOSCommandProcessor без повторной загрузки из БД.
+Ответ уходит только после записи (flush_writes ждет коммита писателя), поэтому
+подтвержденная команда не теряется; пачкуются записи разных соединений (writer.py).
+Синхронный код соединения идет в его собственном потоке (ThreadSensitiveContext):
+медленная команда одного студента не держит терминалы остальных.
+Перед командой сверяем версию состояния с БД: если сессию поменяли по HTTP
+(сброс, отмена, чекпоинт, перепроверка), перечитываем ее.
+HTTP-эндпоинты send_command / send_batch остаются запасным вариантом.
+"""
+import json
+import logging
+import re
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, connection
+from django.db.models import Max
+
+from .engine.paging import more_request
+from .engine.processor import IOSCommandProcessor
+from .lab_cache import get_lab
+from .metrics import request_timer, span
+from .models import UserLabSession
+from .profiling import profile_session
+
+logger = logging.getLogger(__name__)
+
+PATH_RE = re.compile(r"^/lab/ws/terminal/(?P<session_id>\d+)/$")
+
+
+def terminal_path(session_id):
+    return f"/lab/ws/terminal/{session_id}/"
+
+
+def _headers(scope):
+    return {name.decode("latin1").lower(): value.decode("latin1") for name, value in scope.get("headers", [])}
+
+
+def _cookies(headers):
+    cookies = {}
+    for chunk in headers.get("cookie", "").split(";"):
+        if "=" in chunk:
+            name, value = chunk.strip().split("=", 1)
+            cookies[name] = value
+    return cookies
+
+
+def _same_origin(headers):
+    """Защита от cross-site WebSocket hijacking: Origin должен совпадать с Host"""
+    origin = headers.get("origin")
+    if not origin: return True
+    return origin.split("://", 1)[-1] == headers.get("host")
+
+
+class TerminalConnection:
+    """Живое состояние одной сессии на время соединения"""
+
+    def __init__(self, session_id, user):
+        self.session_id = session_id
+        self.user = user
+        self.session = None
+
+    def load(self):
+        close_old_connections()
+        self.session = UserLabSession.objects.get(id=self.session_id, user=self.user)
+        self.session.defer_writes()
+
+    def _refresh(self):
+        """Сверяет state_token с БД (одна строка) и перечитывает сессию, если ее поменяли мимо соединения"""
+        stored = (UserLabSession.objects.filter(id=self.session_id)
+                  .annotate(last=Max("mutations__id")).values_list("updated_at", "last", "profiling").first())
+        if stored is None: raise UserLabSession.DoesNotExist
+        if (stored[0], stored[1] or 0) != self.session.state_token(): self.load()
+        # profiling_list меняет флаг без updated_at: берем его из той же строки
+        self.session.profiling = stored[2]
+
+    def _select_device(self, device):
+        # Устройство переключили через HTTP (switch_device) -> перечитываем состояние
+        if not device or device == self.session.current_device: return None
+        self.flush()
+        self.load()
+        if not get_lab(self.session.lab_id).allows(device):
+            return {"status": "error", "message": "Access Denied"}
+        self.session.current_device = device
+        return None
+
+    def run_command(self, command_text, device=None, more=None):
+        with request_timer("ws_command") as status:
+            reply = self._run_command(command_text, device, more)
+            status["code"] = reply["status"]
+            return reply
+
+    def _run_command(self, command_text, device, more=None):
+        close_old_connections()
+        self._refresh()
+        error = self._select_device(device)
+        if error: return error
+
+        with profile_session(self.session, command_text):
+            processor = IOSCommandProcessor(self.session)
+            # Продолжение вывода на --More-- (offset, lines), см. paging.more_request
+            if more is None: result = processor.process_input(command_text)
+            else: result = processor.process_more(command_text, *more)
+        with span("save"): self.flush()
+        return {
+            "status": "ok",
+            "output": result["output"],
+            "prompt": result["prompt"],
+            "completed": result["is_completed"],
+            "new_hostname": result["hostname"],
+            "more": result["more"],
+        }
+
+    def run_batch(self, lines, device=None):
+        """Вставка конфига: как send_batch, но на живой сессии соединения"""
+        with request_timer("ws_batch") as status:
+            reply = self._run_batch(lines, device)
+            status["code"] = reply["status"]
+            return reply
+
+    def _run_batch(self, lines, device):
+        close_old_connections()
+        if not isinstance(lines, list) or len(lines) > settings.LAB_BATCH_MAX_LINES:
+            return {"status": "error", "message": "Bad batch"}
+        self._refresh()
+        error = self._select_device(device)
+        if error: return error
+
+        with profile_session(self.session, f"<paste {len(lines)} lines>"):
+            result = IOSCommandProcessor(self.session).process_batch([str(line) for line in lines])
+        with span("save"): self.flush()
+        return {
+            "status": "ok",
+            "results": result["results"],
+            "prompt": result["prompt"],
+            "completed": result["is_completed"],
+            "new_hostname": result["hostname"],
+        }
+
+    def flush(self):
+        if self.session is None: return
+        close_old_connections()
+        self.session.flush_writes()
+
+
+def _authenticate(headers):
+    close_old_connections()
+    engine = import_module(settings.SESSION_ENGINE)
+    store = engine.SessionStore(_cookies(headers).get(settings.SESSION_COOKIE_NAME))
+    return get_user(SimpleNamespace(session=store))
+
+
+def _close_connection():
+    """Поток соединения уходит вместе с его контекстом - закрываем и его подключение к БД"""
+    # connection.close нельзя брать в цикле событий: атрибут найдется у подключения того потока
+    connection.close()
+
+
+async def terminal_app(scope, receive, send):
+    """ASGI-приложение для scope["type"] == "websocket" """
+    # Без своего контекста все sync_to_async(thread_sensitive=True) идут в один общий поток,
+    # и команды всех терминалов выполнялись бы по очереди
+    async with ThreadSensitiveContext():
+        try:
+            await _serve_terminal(scope, receive, send)
+        finally:
+            await sync_to_async(_close_connection)()
+
+
+async def _serve_terminal(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect": return
+
+    headers = _headers(scope)
+    match = PATH_RE.match(scope.get("path", ""))
+    if not match or not _same_origin(headers):
+        await send({"type": "websocket.close", "code": 4404})
+        return
+
+    user = await sync_to_async(_authenticate)(headers)
+    if not user.is_authenticated:
+        await send({"type": "websocket.close", "code": 4403})
+        return
+
+    conn = TerminalConnection(int(match.group("session_id")), user)
+    try:
+        await sync_to_async(conn.load)()
+    except UserLabSession.DoesNotExist:
+        await send({"type": "websocket.close", "code": 4404})
+        return
+
+    await send({"type": "websocket.accept"})
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect": break
+            if event["type"] != "websocket.receive": continue
+
+            try:
+                data = json.loads(event.get("text") or "{}")
+            except json.JSONDecodeError:
+                continue
+            seq = data.get("seq")
+
+            try:
+                if "commands" in data:
+                    reply = await sync_to_async(conn.run_batch)(data["commands"], data.get("device"))
+                else:
+                    more = more_request(data)
+                    if more is False: reply = {"status": "error", "message": "Bad --More-- request"}
+                    else: reply = await sync_to_async(conn.run_command)(data.get("command", ""), data.get("device"), more)
+            except Exception as e:
+                logger.exception("Lab engine error on websocket terminal")
+                reply = {"status": "error", "message": f"Server Logic Error: {e}"}
+            reply["seq"] = seq
+            await send({"type": "websocket.send", "text": json.dumps(reply)})
+    finally:
+        # Команда, оборванная ошибкой до записи, - дописываем при закрытии
+        await sync_to_async(conn.flush)()
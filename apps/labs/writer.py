@@ -0,0 +1,185 @@
+"""
+Write-behind запись сессий: один поток-писатель на процесс.
+
+SQLite пускает одного писателя за раз. Когда класс из 200 студентов одновременно
+шлет команды, каждый запрос сам открывает транзакцию и ждет блокировку - хвост
+задержек растет, часть запросов падает с "database is locked".
+
+Здесь запросы не пишут сами, а отдают WriteJob писателю и ждут его подтверждения.
+Писатель забирает все, что накопилось за LAB_WRITE_WINDOW, и коммитит пачку одной
+транзакцией: вставки журнала и консоли всех сессий - по одному bulk_create на модель,
+обновления полей одной сессии сливаются в один UPDATE. Ответ клиенту уходит только
+после коммита, поэтому подтвержденная команда не теряется.
+
+Внутри открытой транзакции (transaction.atomic, тесты, бенчмарк --db) и при
+LAB_WRITE_BEHIND = False задание выполняется сразу в вызывающем потоке.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд без заданий, прежде чем писатель отпустит соединение с БД
+IDLE_TIMEOUT = 30
+
+# Сессии в отложенном режиме (терминал по WebSocket): при остановке процесса дописываем их буферы
+_deferred_sessions = weakref.WeakSet()
+
+
+class WriteJob:
+    """
+    Что записать за одну команду/пачку.
+    rows    - новые объекты моделей (SessionMutation, ConsoleEntry, шаги отмены) для bulk_create
+    fields  - (модель, pk, {поле: значение}) - обновление строки сессии
+    after   - функции после вставок (им уже известны id): обрезка консоли, сворачивание журнала
+    """
+    __slots__ = ("rows", "fields", "after", "done", "error")
+
+    def __init__(self, rows=(), fields=None, after=()):
+        self.rows = list(rows)
+        self.fields = fields
+        self.after = list(after)
+        self.done = threading.Event()
+        self.error = None
+
+    def __bool__(self):
+        return bool(self.rows or self.fields or self.after)
+
+
+def _apply(jobs):
+    """Пишет пачку заданий; вызывается внутри transaction.atomic()"""
+    by_model = {}
+    for job in jobs:
+        for row in job.rows:
+            by_model.setdefault(type(row), []).append(row)
+    for model, rows in by_model.items():
+        # Адресуемые по содержимому строки (ConfigBlob) могут уже быть в таблице
+        model.objects.bulk_create(rows, ignore_conflicts=getattr(model, "WRITE_IGNORE_CONFLICTS", False))
+
+    # Несколько обновлений одной строки за окно -> один UPDATE (последнее значение побеждает)
+    updates = {}
+    for job in jobs:
+        if not job.fields: continue
+        model, pk, values = job.fields
+        updates.setdefault((model, pk), {}).update(values)
+    for (model, pk), values in updates.items():
+        model.objects.filter(pk=pk).update(**values)
+
+    for job in jobs:
+        for func in job.after:
+            func()
+
+
+class SessionWriter:
+    """Поток-писатель с очередью заданий (group commit)"""
+
+    def __init__(self, max_batch=500):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.batches = 0
+        self.jobs = 0
+
+    def submit(self, job):
+        """Ставит задание в очередь и ждет коммита; ошибка записи пробрасывается вызывающему"""
+        if not job: return
+        if self._stopped or not settings.LAB_WRITE_BEHIND or connection.in_atomic_block:
+            with transaction.atomic():
+                _apply([job])
+            return
+
+        self._ensure_thread()
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None: raise job.error
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="lab-session-writer", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        try:
+            job = self._queue.get(timeout=IDLE_TIMEOUT)
+        except queue.Empty:
+            # Простой: отпускаем соединение (по CONN_MAX_AGE), пока идут задания - пишем через одно
+            close_old_connections()
+            job = self._queue.get()
+        if job is None: return None
+        jobs = [job]
+        deadline = time.monotonic() + settings.LAB_WRITE_WINDOW
+        while len(jobs) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)   # остановка: сначала допишем собранное
+                break
+            jobs.append(job)
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            if jobs is None: return
+            try:
+                with transaction.atomic():
+                    _apply(jobs)
+            except Exception:
+                # Пачка откатилась целиком -> повторяем задания по одному,
+                # чтобы ошибка одного не уронила остальных (соединение могло порваться - переоткрываем)
+                logger.exception("Batched session write failed, retrying one by one")
+                close_old_connections()
+                for job in jobs:
+                    try:
+                        with transaction.atomic():
+                            _apply([job])
+                    except Exception as e:
+                        job.error = e
+            finally:
+                # Ждущие запросы отпускаем в любом случае (с ошибкой или без)
+                self.batches += 1
+                self.jobs += len(jobs)
+                for job in jobs:
+                    job.done.set()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток (atexit)"""
+        self._stopped = True
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout=30)
+
+
+WRITER = SessionWriter()
+
+
+def track_deferred(session):
+    _deferred_sessions.add(session)
+
+
+def shutdown():
+    """Остановка процесса: буферы отложенных сессий -> писатель -> диск"""
+    for session in list(_deferred_sessions):
+        try:
+            session.flush_writes()
+        except Exception:
+            logger.exception("Failed to flush session %s on shutdown", session.pk)
+    WRITER.stop()
+
+
+atexit.register(shutdown)
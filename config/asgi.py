@@ -1,4 +1,14 @@
 import os
 from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+# Импорт после инициализации Django: модуль тянет модели
+from apps.labs.websocket import terminal_app
+
+
+async def application(scope, receive, send):
+    # WebSocket-терминал лабы, все остальное - обычный Django
+    if scope["type"] == "websocket":
+        return await terminal_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -54,6 +54,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Сколько секунд ждать освобождения блокировки писателя, прежде чем "database is locked"
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -70,4 +72,42 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # В конце файла
 LOGIN_REDIRECT_URL = 'lab_list'
 LOGOUT_REDIRECT_URL = 'login'
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+# Консоль лабораторных: сколько строк отдавать за раз и сколько хранить на устройство
+LAB_CONSOLE_PAGE_SIZE = 200
+LAB_CONSOLE_MAX_ENTRIES = 5000
+
+# Максимум строк в одной вставке (api/lab/<id>/batch/)
+LAB_BATCH_MAX_LINES = 500
+
+# Высота экрана терминала: вывод show длиннее идет страницами с --More-- (apps/labs/engine/paging.py)
+LAB_TERMINAL_LENGTH = 24
+
+# Как часто (сек) процесс сверяет закэшированную лабу с БД (apps/labs/lab_cache.py)
+LAB_CACHE_TTL = 30
+
+# Запись сессий через общий поток-писатель (apps/labs/writer.py): пачки одной транзакцией.
+# Окно (сек), за которое копятся записи разных запросов перед коммитом
+LAB_WRITE_BEHIND = True
+LAB_WRITE_WINDOW = 0.002
+
+# Метрики движка в памяти процесса (apps/labs/metrics.py), вывод на /lab/metrics/.
+# Токен - для Prometheus без логина (Authorization: Bearer ...); пустой = только staff
+LAB_METRICS = True
+LAB_METRICS_TOKEN = ''
+
+# Профилирование сессий по запросу staff (apps/labs/profiling.py): куда писать и сколько хранить на сессию
+LAB_PROFILE_DIR = BASE_DIR / 'profiles'
+LAB_PROFILE_KEEP = 200
+
+# Сколько входящих заданий показывать в офисе
+LAB_INBOX_LIMIT = 50
+
+# Чекпоинты сессий: глубина стека отмены и сколько именованных снимков на сессию
+LAB_UNDO_DEPTH = 50
+LAB_CHECKPOINT_LIMIT = 20
+
+# Перепроверка сессий после правки критериев лабы (apps/labs/regrade.py)
+LAB_REGRADE_WORKERS = 0      # 0 - по числу ядер
+LAB_REGRADE_CHUNK = 500      # сессий на задачу пула (и на одну транзакцию записи)
@@ -2,6 +2,7 @@ document.addEventListener('DOMContentLoaded', () => {
     
     // --- DATA & STATE ---
     let devices = [];
+    let links = [];   // Связи топологии (ping/traceroute), редактор их не меняет
     let criteriaList = [];
     let editingCritIndex = -1;
 
@@ -34,6 +35,7 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const topoObj = safeParse(rawTopo) || { nodes: [] };
             devices = topoObj.nodes || [];
+            links = topoObj.links || [];
             
             const critObj = safeParse(rawCrit) || {};
             
@@ -231,7 +233,8 @@ document.addEventListener('DOMContentLoaded', () => {
         },
 
         submitBuilder: () => {
-            const topology = { nodes: devices };
+            const ids = new Set(devices.map(d => d.id));
+            const topology = { nodes: devices, links: links.filter(l => ids.has(l.from) && ids.has(l.to)) };
             const allowed = devices.map(d => d.id);
 
             const criteriaObj = {};
@@ -15,6 +15,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const hostnamesMap = getDjangoData("hostnames-data") || {};
     const initialLogs = getDjangoData("initial-logs-data") || [];
     let currentDevice = getDjangoData("current-device-id") || "R1";
+    // Шаблон URL для дозагрузки старых строк консоли (__DEVICE__ подменяется)
+    const CONSOLE_URL = getDjangoData("console-url");
+    const TERMINAL_WS_PATH = getDjangoData("terminal-ws-path");
+    const BATCH_URL = getDjangoData("batch-url");
+    const GRAMMAR_URL = getDjangoData("grammar-url");
 
     // --- DOM ELEMENTS ---
     const inputEl = document.getElementById('cmd-input');
@@ -30,15 +35,110 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- STATE ---
-    let commandHistory = [];
+    let commandHistory = getDjangoData("command-history-data") || [];
     let historyIndex = -1;
 
+    // Пагинация консоли: id самой старой показанной строки и есть ли что-то раньше
+    let oldestLogId = null;
+    let hasMoreLogs = getDjangoData("has-more-logs") || false;
+    let loadingOlder = false;
+
+    // --More--: вывод show не поместился в экран, остаток дочитывается пробелом (экран) или Enter (строка)
+    let paging = null;   // {command, offset, prompt}
+
     // --- DICTIONARIES ---
     const VOCAB_COMMON = ["show", "running-config", "interface", "ip", "address", "brief", "configure", "terminal", "enable", "exit", "end", "no", "shutdown", "description", "hostname", "write", "copy", "do", "line", "vty", "console", "login", "password", "FastEthernet0/0", "FastEthernet0/1", "service", "password-encryption"];
     const VOCAB_ROUTER = ["crypto", "isakmp", "policy", "encryption", "authentication", "group", "pre-share", "key", "transform-set", "esp-aes", "esp-sha-hmac", "access-list", "permit", "udp", "tcp", "host", "any", "match", "set", "peer", "map"];
     const VOCAB_SWITCH = ["vlan", "name", "switchport", "mode", "access", "trunk", "native", "allowed", "spanning-tree", "port-security"];
     let activeVocabulary = [...VOCAB_COMMON, ...VOCAB_ROUTER];
 
+    // --- GRAMMAR ---
+    // Дерево команд с сервера (engine/grammar.py): "?" и Tab отвечаются локально.
+    // Пока бандл не загружен, "?" уходит на сервер, а Tab берет слова из словаря выше.
+    const grammar = (() => {
+        let nodes = null, contexts = {}, prompts = [];
+
+        // Как GrammarNode: все префиксы слов разложены заранее, плейсхолдеры <...> не разворачиваем
+        const compile = (raw) => {
+            const prefixes = new Map();
+            raw.options.forEach(([name]) => {
+                if (name.startsWith('<')) return;
+                for (let i = 1; i <= name.length; i++) {
+                    const p = name.slice(0, i);
+                    if (!prefixes.has(p)) prefixes.set(p, []);
+                    prefixes.get(p).push(name);
+                }
+            });
+            return { options: raw.options, children: raw.children, prefixes };
+        };
+
+        if (GRAMMAR_URL) {
+            fetch(GRAMMAR_URL)
+                .then(res => res.ok ? res.json() : null)
+                .then(data => {
+                    if (!data) return;
+                    contexts = data.contexts;
+                    // Длинные суффиксы первыми: "(config-if)#" раньше "#"
+                    prompts = Object.entries(data.prompts).sort((a, b) => b[1].length - a[1].length);
+                    nodes = data.nodes.map(compile);
+                })
+                .catch(e => console.error("Grammar bundle:", e));
+        }
+
+        // Контекст по промпту (неизвестный -> privileged, как context_root на сервере)
+        const root = () => {
+            const prompt = promptEl.textContent.trim();
+            const found = prompts.find(([, suffix]) => prompt.endsWith(suffix));
+            const id = contexts[found ? found[0] : 'privileged'];
+            return nodes[id === undefined ? contexts.privileged : id];
+        };
+
+        const resolve = (node, token) => {
+            const matches = node.prefixes.get(token) || [];
+            if (matches.length === 1) return matches[0];
+            if (matches.includes(token)) return token;
+            // Скрытое слово (grammar.HIDDEN_KEYWORDS) - только целиком
+            return Object.prototype.hasOwnProperty.call(node.children, token) ? token : null;
+        };
+
+        const walk = (node, tokens) => {
+            for (const token of tokens) {
+                const word = resolve(node, token);
+                if (word === null) return null;
+                const next = node.children[word];
+                if (next === undefined) return null;
+                node = nodes[next];
+            }
+            return node;
+        };
+
+        return {
+            ready: () => nodes !== null,
+
+            // То же, что _handle_context_help: "show int ?" - опции узла, "show in?" - опции на "in"
+            help: (raw) => {
+                const text = raw.replace(/\?/g, '');
+                const tokens = text.trimEnd().toLowerCase().split(/\s+/).filter(Boolean);
+                const spaceBefore = text.endsWith(' ');
+                const path = spaceBefore || !tokens.length ? tokens : tokens.slice(0, -1);
+                const prefix = spaceBefore || !tokens.length ? '' : tokens[tokens.length - 1];
+
+                const node = walk(root(), path);
+                const matches = node ? node.options.filter(([n]) => n.toLowerCase().startsWith(prefix)) : [];
+                if (!matches.length) return '% Unrecognized command';
+                return matches.map(([n, d]) => `  ${n.padEnd(20)} ${d}`).join('\n');
+            },
+
+            // Слова, которыми можно дополнить последний токен
+            complete: (parts) => {
+                const node = walk(root(), parts.slice(0, -1).filter(Boolean).map(t => t.toLowerCase()));
+                if (!node) return [];
+                const last = parts[parts.length - 1].toLowerCase();
+                return node.options.map(([n]) => n).filter(n => !n.startsWith('<') && n.toLowerCase().startsWith(last));
+            }
+        };
+    })();
+
     // --- CORE FUNCTIONS ---
 
     function scrollToBottom() { 
@@ -85,7 +185,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
-    function appendOutput(text, isCmd = false, customPrompt = null) {
+    function createLogLine(text, isCmd = false, customPrompt = null) {
         const div = document.createElement('div');
         div.className = 'log-line';
         if (isCmd) {
@@ -96,24 +196,71 @@ document.addEventListener('DOMContentLoaded', () => {
             div.textContent = text.replace(/^\n+|\n+$/g, '');
             if (!div.textContent && text.length > 0) div.innerHTML = '&nbsp;';
         }
-        
+        return div;
+    }
+
+    function appendOutput(text, isCmd = false, customPrompt = null) {
         // !!! ИСПРАВЛЕНИЕ: Вставляем перед строкой ввода, а не перед ее родителем !!!
-        outputEl.insertBefore(div, inputLineContainer); 
+        outputEl.insertBefore(createLogLine(text, isCmd, customPrompt), inputLineContainer); 
         
         scrollToBottom();
     }
 
-    function renderLogs(logs) {
+    function rememberOldest(logs) {
+        const withId = logs.find(entry => entry.id);
+        if (withId) oldestLogId = withId.id;
+    }
+
+    function renderLogs(logs, hasMore = false) {
         document.querySelectorAll('.log-line').forEach(el => el.remove());
+        oldestLogId = null;
+        hasMoreLogs = hasMore;
         if (Array.isArray(logs)) {
             logs.forEach(entry => {
                 if (entry.type === 'cmd') appendOutput(entry.text, true, entry.prompt);
                 else appendOutput(entry.text, false);
             });
+            rememberOldest(logs);
         }
         scrollToBottom();
     }
 
+    // Дозагрузка старых строк при прокрутке вверх
+    async function loadOlderLogs() {
+        if (!hasMoreLogs || loadingOlder || !oldestLogId || !CONSOLE_URL) return;
+        loadingOlder = true;
+        try {
+            const url = CONSOLE_URL.replace('__DEVICE__', encodeURIComponent(currentDevice));
+            const res = await fetch(`${url}?before=${oldestLogId}`);
+            const data = await res.json();
+            if (data.status !== 'ok') return;
+
+            // Вставляем над текущими строками, сохраняя позицию прокрутки
+            const heightBefore = wrapper.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.logs.forEach(entry => {
+                fragment.appendChild(createLogLine(entry.text, entry.type === 'cmd', entry.prompt));
+            });
+            outputEl.insertBefore(fragment, outputEl.firstChild);
+            wrapper.scrollTop += wrapper.scrollHeight - heightBefore;
+
+            rememberOldest(data.logs);
+            hasMoreLogs = data.has_more;
+        } catch (e) { console.error(e); }
+        finally { loadingOlder = false; }
+    }
+
+    // Промпт после ответа сервера; more - сколько строк показано, если вывод не кончился
+    function setPrompt(prompt, more = null, command = '') {
+        if (more === null || more === undefined) {
+            paging = null;
+            promptEl.textContent = prompt;
+            return;
+        }
+        paging = { command, offset: more, prompt };
+        promptEl.textContent = ' --More-- ';
+    }
+
     function updateDeviceLabels(deviceId, newLabel) {
         const tab = document.getElementById(`tab-${deviceId}`);
         if (tab) tab.textContent = newLabel;
@@ -147,8 +294,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 if (data.status === 'ok') {
                     currentDevice = targetDeviceName;
-                    promptEl.textContent = data.prompt;
-                    renderLogs(data.logs);
+                    setPrompt(data.prompt);
+                    renderLogs(data.logs, data.has_more);
+                    commandHistory = data.history || [];
+                    historyIndex = -1;
 
                     inputEl.value = '';
                     updateMirror();
@@ -163,6 +312,75 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // --- WEBSOCKET TERMINAL ---
+    // Одно соединение на вкладку: сервер держит сессию в памяти и пишет в БД пачками.
+    // Если сокет не открылся, send() вернет null и команда уйдет по HTTP.
+    // Команда, уже отправленная в упавший сокет, по HTTP не повторяется: ее могли
+    // успеть выполнить, поэтому она завершается ошибкой.
+    const terminalSocket = (() => {
+        let socket = null;
+        let seq = 0;
+        let opened = false;
+        let failed = !TERMINAL_WS_PATH || !window.WebSocket;
+        const pending = new Map();   // seq -> resolve
+        const LOST = { status: 'error', message: 'Connection lost - command may have been applied' };
+
+        const failPending = () => {
+            pending.forEach(resolve => resolve(LOST));
+            pending.clear();
+        };
+
+        const connect = () => {
+            if (failed) return null;
+            if (socket && socket.readyState <= WebSocket.OPEN) return socket;
+
+            const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+            socket = new WebSocket(`${scheme}://${location.host}${TERMINAL_WS_PATH}`);
+            socket.onopen = () => { opened = true; };
+            socket.onmessage = (e) => {
+                const data = JSON.parse(e.data);
+                const resolve = pending.get(data.seq);
+                if (resolve) { pending.delete(data.seq); resolve(data); }
+            };
+            socket.onclose = (e) => {
+                // Не смогли подключиться или сервер отказал -> дальше только HTTP
+                if (!opened || e.code >= 4000) failed = true;
+                opened = false;
+                socket = null;
+                failPending();
+            };
+            return socket;
+        };
+
+        const waitOpen = (ws) => new Promise(resolve => {
+            if (ws.readyState === WebSocket.OPEN) return resolve(true);
+            ws.addEventListener('open', () => resolve(true), { once: true });
+            ws.addEventListener('close', () => resolve(false), { once: true });
+        });
+
+        connect();
+
+        return {
+            send: async (payload) => {
+                const ws = connect();
+                if (!ws || !(await waitOpen(ws))) return null;
+                // Закрылся между open и отправкой: сообщение не ушло, можно по HTTP
+                if (ws.readyState !== WebSocket.OPEN) return null;
+                const id = ++seq;
+                return new Promise(resolve => {
+                    pending.set(id, resolve);
+                    ws.send(JSON.stringify({ ...payload, seq: id }));
+                });
+            }
+        };
+    })();
+
+    // Справка по локальной грамматике: без запроса, ввод остается в строке
+    function showHelp(cmd) {
+        appendOutput(cmd + '?', true);
+        appendOutput(grammar.help(cmd + '?'));
+    }
+
     async function sendCommand(cmd, isHelp) {
         inputEl.disabled = true;
         appendOutput(cmd + (isHelp ? '?' : ''), true);
@@ -177,14 +395,20 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            const res = await fetch(`/api/lab/${SESSION_ID}/command/`, {
-                method: 'POST', headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ command: isHelp ? cmd + '?' : cmd })
-            });
-            const data = await res.json();
+            const payload = { command: isHelp ? cmd + '?' : cmd, device: currentDevice };
+            let data = await terminalSocket.send(payload);
+            if (!data) {
+                // WebSocket недоступен (команда не отправлялась) -> обычный HTTP
+                const res = await fetch(`/api/lab/${SESSION_ID}/command/`, {
+                    method: 'POST', headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(payload)
+                });
+                data = await res.json();
+            }
 
+            if (data.status === 'error') { appendOutput(`% Error: ${data.message}`); return; }
             if (data.output) appendOutput(data.output);
-            promptEl.textContent = data.prompt;
+            setPrompt(data.prompt, data.more, cmd);
             if (data.new_hostname) updateDeviceLabels(currentDevice, data.new_hostname);
             
             if (data.completed) {
@@ -199,6 +423,72 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Следующий экран (lines = null) или строка (lines = 1) вывода на --More--
+    async function sendMore(lines) {
+        const { command, offset, prompt } = paging;
+        paging = null;
+        inputEl.disabled = true;
+        try {
+            const payload = { command, more: offset, lines, device: currentDevice };
+            let data = await terminalSocket.send(payload);
+            if (!data) {
+                const res = await fetch(`/api/lab/${SESSION_ID}/command/`, {
+                    method: 'POST', headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(payload)
+                });
+                data = await res.json();
+            }
+            if (data.status === 'error') { setPrompt(prompt); appendOutput(`% Error: ${data.message}`); return; }
+            if (data.output) appendOutput(data.output);
+            setPrompt(data.prompt, data.more, command);
+        } catch (e) { setPrompt(prompt); appendOutput(`% Error: ${e.message}`); }
+        finally {
+            inputEl.disabled = false;
+            inputEl.focus();
+            scrollToBottom();
+        }
+    }
+
+    // Вставка конфига целиком: один запрос на все строки
+    async function sendBatch(lines) {
+        inputEl.disabled = true;
+        inputEl.value = '';
+        updateMirror();
+        lines.forEach(line => {
+            if (line.trim() && commandHistory[commandHistory.length - 1] !== line) commandHistory.push(line);
+        });
+        historyIndex = -1;
+
+        try {
+            let data = await terminalSocket.send({ commands: lines, device: currentDevice });
+            if (!data) {
+                const res = await fetch(BATCH_URL, {
+                    method: 'POST', headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ commands: lines })
+                });
+                data = await res.json();
+            }
+            if (data.status !== 'ok') { appendOutput(`% Error: ${data.message}`); return; }
+
+            data.results.forEach(r => {
+                appendOutput(r.command, true, r.prompt_before);
+                if (r.output) appendOutput(r.output);
+            });
+            setPrompt(data.prompt);
+            if (data.new_hostname) updateDeviceLabels(currentDevice, data.new_hostname);
+
+            if (data.completed) {
+                const status = document.getElementById('lab-status');
+                if(status) { status.textContent = "DONE ✅"; status.style.color = "green"; }
+            }
+        } catch (e) { appendOutput(`% Error: ${e.message}`); }
+        finally {
+            inputEl.disabled = false;
+            inputEl.focus();
+            scrollToBottom();
+        }
+    }
+
     // --- EVENT LISTENERS ---
 
     ['input', 'keyup', 'click', 'focus'].forEach(evt => {
@@ -209,11 +499,36 @@ document.addEventListener('DOMContentLoaded', () => {
         if (window.getSelection().toString().length === 0) { inputEl.focus(); wrapper.classList.remove('blur'); }
     });
     inputEl.addEventListener('blur', () => wrapper.classList.add('blur'));
+    wrapper.addEventListener('scroll', () => {
+        if (wrapper.scrollTop < 40) loadOlderLogs();
+    });
+
+    inputEl.addEventListener('paste', function (e) {
+        const text = (e.clipboardData || window.clipboardData).getData('text');
+        if (!/[\r\n]/.test(text)) return;   // одна строка -> обычная вставка
+        e.preventDefault();
+        const lines = (this.value + text).split(/\r?\n/);
+        if (lines[lines.length - 1] === '') lines.pop();
+        sendBatch(lines);
+    });
 
     inputEl.addEventListener('keydown', function (e) {
         setTimeout(updateMirror, 0);
 
-        if (e.key === '?') { e.preventDefault(); sendCommand(this.value, true); return; }
+        if (paging) {
+            // Как в IOS: пробел - экран, Enter - строка, любая другая клавиша - выход из вывода
+            if (e.key === ' ') { e.preventDefault(); sendMore(null); }
+            else if (e.key === 'Enter') { e.preventDefault(); sendMore(1); }
+            else if (e.key.length === 1 || e.key === 'Escape') { e.preventDefault(); setPrompt(paging.prompt); }
+            return;
+        }
+
+        if (e.key === '?') {
+            e.preventDefault();
+            if (grammar.ready()) showHelp(this.value);
+            else sendCommand(this.value, true);
+            return;
+        }
 
         if (e.key === 'Tab') {
             e.preventDefault();
@@ -221,12 +536,15 @@ document.addEventListener('DOMContentLoaded', () => {
             const parts = val.split(' ');
             const last = parts[parts.length - 1]; if (!last) return;
 
-            const matches = activeVocabulary.filter(c => c.toLowerCase().startsWith(last.toLowerCase()));
+            const matches = grammar.ready()
+                ? grammar.complete(parts)
+                : activeVocabulary.filter(c => c.toLowerCase().startsWith(last.toLowerCase()));
             if (matches.length === 0) return;
 
             if (matches.length === 1) {
                 parts[parts.length - 1] = matches[0];
                 this.value = parts.join(' ') + ' ';
+                return;
             } else {
                 let common = matches[0];
                 for (let i = 1; i < matches.length; i++) {
@@ -277,7 +595,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (startNode) startNode.classList.add('active-node');
         
         // Logs
-        renderLogs(initialLogs);
+        renderLogs(initialLogs, hasMoreLogs);
         
         // Focus
         inputEl.focus();